@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
 import asyncio
@@ -9,80 +9,161 @@ import re
 import time
 import os
 import uuid
-import hashlib
+import json
+import functools
+import contextvars
+import threading
 import subprocess
 import signal
-from typing import Optional, Dict, Any, Set, List
-from collections import defaultdict
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple, Callable
+from collections import OrderedDict
 import uvicorn
-import sys
 import random
-from contextlib import asynccontextmanager
-from bs4 import BeautifulSoup
+from contextlib import asynccontextmanager, AsyncExitStack
+from urllib.parse import urlparse
 from datetime import datetime
-from curl_cffi import requests as curl_requests
-from curl_cffi.requests import AsyncSession
-import aria2p
 
-from apkpure_client import APKPureClient, get_smart_download_info
+from lazy_imports import lazy_import, preload
+from apkpure_client import APKPureClient, file_type_from_headers
+from download_scheduler import DownloadScheduler, INTERNAL_PREFIX
+from engine_stats import EngineSelector, size_class
+from download_jobs import DownloadJob, JobManager
+from loop_monitor import LoopMonitor
+from shared_state import SharedState
+from cluster import Cluster, FORWARDED_HEADER
+from search_cache import SearchCache, normalize_query
+from app_index import AppIndex
+from rate_limit import upstream_limiter, UpstreamUnavailable, is_throttled
+from budget import BudgetMiddleware, request_budget, current_budget, spend, check_budget, budget_timeout, budget_exhausted
+from inflight import SharedFetches, ClientDisconnected
+import upstream
+from providers import ProviderResolver, DEFAULT_PROVIDERS
+from upstream import curl_get, cached_dns_transport, keep_warm, trace_request, HTTP2_AVAILABLE, cdn_url_fields, cdn_url_valid
+from icon_cache import IconCache, ICON_SIZES, ICON_FORMATS, MAX_ICON_BYTES, icon_source_allowed
+from structured_log import get_logger, log_stats
 
-DOWNLOADS_DIR = os.path.join(os.path.dirname(__file__), 'app_cache')
+logger = get_logger("api_server")
+
+# Heavy imports are deferred so the server can start answering sooner
+BeautifulSoup = lazy_import("bs4", "BeautifulSoup")
+curl_requests = lazy_import("curl_cffi.requests")
+cloudscraper = lazy_import("cloudscraper")
+aria2p = lazy_import("aria2p")
+from file_serving import file_response, make_etag, etag_matches
+from archive_utils import (
+    StreamValidator, validate_file, read_app_manifest, read_central_directory,
+    open_member, iter_member, ZipFormatError
+)
+
+# Overridable so several nodes can run side by side from one checkout
+DOWNLOADS_DIR = os.environ.get("APP_CACHE_DIR", os.path.join(os.path.dirname(__file__), 'app_cache'))
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
-url_cache: Dict[str, tuple] = {}
+# Kept outside app_cache, which the cleanup jobs empty
+DATA_DIR = os.environ.get("DATA_DIR", os.path.join(os.path.dirname(__file__), 'data'))
+API_WORKERS = int(os.environ.get("API_WORKERS", 1))
+# How long the event loop may wait on another worker's write to the shared database
+SHARED_DB_LOOP_TIMEOUT = float(os.environ.get("SHARED_DB_LOOP_TIMEOUT", 0.5))
+
+shared_state = SharedState(DATA_DIR, loop_timeout=SHARED_DB_LOOP_TIMEOUT, counters={
+    "total_requests": 0,
+    "cache_hits": 0,
+    "downloads": 0,
+    "active_downloads": 0,
+    "cached_files": 0,
+    "aria2_downloads": 0,
+    "aria2_success": 0,
+    "aria2_failed": 0,
+    "admission_rejected": 0,
+    "cdn_url_downloads": 0,
+    "cdn_url_fallbacks": 0,
+    "fused_downloads": 0,
+    "fused_handoffs": 0
+})
+
+# Caches, counters and per-package locks are shared by every worker process through shared_state
+url_cache = shared_state.dict("url_cache")
 URL_CACHE_TTL = 1800
 
-file_cache: Dict[str, Dict[str, Any]] = {}
+file_cache = shared_state.dict("file_cache")
 
-download_locks: Dict[str, asyncio.Lock] = {}
-user_downloads: Dict[str, Set[str]] = defaultdict(set)
+download_locks = shared_state.package_locks
 
 pending_deletions: Dict[str, asyncio.Task] = {}
 
 http_client: Optional[httpx.AsyncClient] = None
 
-aria2_client: Optional[aria2p.API] = None
+# Idle connections to APKPure are kept this long, and the warm-up touches them more often than that
+UPSTREAM_KEEPALIVE = float(os.environ.get("UPSTREAM_KEEPALIVE", 60))
+UPSTREAM_WARM_INTERVAL = float(os.environ.get("UPSTREAM_WARM_INTERVAL", 45))
+# Warm-up stops once the worker has made no upstream request for this long
+UPSTREAM_WARM_IDLE = float(os.environ.get("UPSTREAM_WARM_IDLE", 600))
+
+aria2_client: Optional["aria2p.API"] = None
 aria2_process: Optional[subprocess.Popen] = None
 
-stats = {
-    "total_requests": 0,
-    "cache_hits": 0,
-    "downloads": 0,
-    "active_downloads": 0,
-    "cached_files": 0,
-    "aria2_downloads": 0,
-    "aria2_success": 0,
-    "aria2_failed": 0
-}
+stats = shared_state.counters
 
 def get_client() -> httpx.AsyncClient:
     if http_client is None:
         raise RuntimeError("HTTP client not initialized")
     return http_client
 
-def get_download_lock(package_name: str) -> asyncio.Lock:
-    if package_name not in download_locks:
-        download_locks[package_name] = asyncio.Lock()
-    return download_locks[package_name]
+def get_download_lock(package_name: str):
+    return shared_state.package_lock(package_name)
 
 def generate_user_file_id(package_name: str, user_id: Optional[str] = None) -> str:
     unique_id = user_id or str(uuid.uuid4())[:8]
     return f"{package_name}_{unique_id}_{int(time.time())}"
 
+# Short blocking calls (deletes, renames, stats, cleanup) get their own threads, so they never wait
+# behind transfers, polling loops and rate-limit sleeps that hold default-executor threads for minutes
+QUICK_EXECUTOR_WORKERS = int(os.environ.get("QUICK_EXECUTOR_WORKERS", 4))
+quick_executor = ThreadPoolExecutor(max_workers=QUICK_EXECUTOR_WORKERS, thread_name_prefix="quick")
+
+async def run_blocking(func, *args, executor: Optional[ThreadPoolExecutor] = None, **kwargs):
+    """Run a blocking call in the default executor so it cannot stall the event loop"""
+    # Executor threads do not inherit context variables; the request budget has to travel with the call
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_event_loop().run_in_executor(executor, call)
+
+async def run_quick(func, *args, **kwargs):
+    """run_blocking for calls that finish in milliseconds"""
+    return await run_blocking(func, *args, executor=quick_executor, **kwargs)
+
+def remove_file(file_path: str) -> bool:
+    try:
+        os.remove(file_path)
+        return True
+    except OSError:
+        return False
+
 async def schedule_file_deletion(file_path: str, delay: int = 30):
     await asyncio.sleep(delay)
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"[Cleanup] Deleted: {os.path.basename(file_path)}", file=sys.stderr)
+        # Any worker may have used the file since; its touch pushed the shared expiry back
+        while True:
+            cache_key, entry = next(iter(file_cache.find('file_path', file_path)), (None, {}))
+            remaining = entry.get('expires_at', 0) - time.time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        
+        # Unlinking a multi-GB file can take a while on some filesystems
+        if await run_quick(remove_file, file_path):
+            logger.debug("[Cleanup] Deleted: %s", os.path.basename(file_path))
             
-            for pkg, info in list(file_cache.items()):
-                if info.get('file_path') == file_path:
-                    del file_cache[pkg]
-                    stats["cached_files"] = max(0, stats["cached_files"] - 1)
-                    break
+            if cache_key and file_cache.pop(cache_key, None):
+                stats.incr("cached_files", -1)
     except Exception as e:
-        print(f"[Cleanup Error] {file_path}: {e}", file=sys.stderr)
+        logger.warning("[Cleanup Error] %s: %s", file_path, e)
+    finally:
+        for key, task in list(pending_deletions.items()):
+            if task is asyncio.current_task():
+                del pending_deletions[key]
 
 def cleanup_old_files():
     try:
@@ -95,30 +176,45 @@ def cleanup_old_files():
                 file_age = now - os.path.getmtime(file_path)
                 if file_age > max_age:
                     os.remove(file_path)
-                    print(f"[Cleanup] Removed old file: {filename}", file=sys.stderr)
+                    logger.info("[Cleanup] Removed old file: %s", filename)
     except Exception as e:
-        print(f"[Cleanup Error] {e}", file=sys.stderr)
+        logger.warning("[Cleanup Error] %s", e)
 
 async def periodic_cleanup():
     while True:
         await asyncio.sleep(60)
-        cleanup_old_files()
+        await run_quick(cleanup_old_files)
+        await run_quick(app_index.save)
+
+ARIA2_STARTUP_TIMEOUT = 10
+
+startup_state: Dict[str, Any] = {"started_at": time.time(), "ready_at": None, "aria2": "starting"}
 
 def start_aria2_daemon():
+    # Workers start together; only the first one to get here launches the daemon, the rest attach to it
+    with shared_state.file_lock("aria2-daemon"):
+        return _start_aria2_daemon()
+
+def connect_aria2() -> Optional["aria2p.API"]:
+    try:
+        client = aria2p.API(
+            aria2p.Client(host="http://localhost", port=6800, secret="")
+        )
+        client.get_stats()
+        return client
+    except:
+        return None
+
+def _start_aria2_daemon():
     global aria2_process, aria2_client
     try:
-        try:
-            test_client = aria2p.API(
-                aria2p.Client(host="http://localhost", port=6800, secret="")
-            )
-            test_client.get_stats()
-            print("[aria2] Daemon already running", file=sys.stderr)
-            aria2_client = test_client
+        existing = connect_aria2()
+        if existing:
+            logger.info("[aria2] Daemon already running")
+            aria2_client = existing
             return True
-        except:
-            pass
         
-        print("[aria2] Starting aria2c daemon...", file=sys.stderr)
+        logger.info("[aria2] Starting aria2c daemon...")
         aria2_process = subprocess.Popen(
             [
                 "aria2c",
@@ -145,18 +241,21 @@ def start_aria2_daemon():
             stderr=subprocess.DEVNULL
         )
         
-        time.sleep(2)
-        
-        aria2_client = aria2p.API(
-            aria2p.Client(host="http://localhost", port=6800, secret="")
-        )
-        
-        aria2_client.get_stats()
-        print("[aria2] Daemon started successfully with high-concurrency settings", file=sys.stderr)
-        return True
+        # Poll the RPC port instead of sleeping a fixed time; aria2c is usually up within ~100ms
+        deadline = time.time() + ARIA2_STARTUP_TIMEOUT
+        while time.time() < deadline:
+            if aria2_process.poll() is not None:
+                raise RuntimeError(f"aria2c exited with code {aria2_process.returncode}")
+            client = connect_aria2()
+            if client:
+                aria2_client = client
+                logger.info("[aria2] Daemon started successfully with high-concurrency settings")
+                return True
+            time.sleep(0.1)
+        raise RuntimeError(f"no RPC answer within {ARIA2_STARTUP_TIMEOUT}s")
         
     except Exception as e:
-        print(f"[aria2] Failed to start daemon: {e}", file=sys.stderr)
+        logger.warning("[aria2] Failed to start daemon: %s", e)
         aria2_client = None
         return False
 
@@ -172,14 +271,56 @@ def stop_aria2_daemon():
             except:
                 pass
         aria2_process = None
-        print("[aria2] Daemon stopped", file=sys.stderr)
+        logger.info("[aria2] Daemon stopped")
+
+async def bootstrap_in_background():
+    """Start or attach to aria2 once requests are being served; the other engines cover the gap"""
+    ok = await run_blocking(start_aria2_daemon)
+    startup_state["aria2"] = "running" if ok else "not available"
+    startup_state["aria2_ready_at"] = time.time()
+    logger.info("[Server] aria2 %s after %.2fs", startup_state['aria2'], time.time() - startup_state['started_at'])
+    await run_blocking(app_index.load)
+    # Warm the deferred imports so the first scrape does not pay for them
+    await run_blocking(preload, BeautifulSoup, curl_requests, cloudscraper)
+
+async def limit_upstream_request(request: httpx.Request):
+    if request.extensions.get("warmup"):
+        return
+    # Every hop, redirects included; hosts other than APKPure's pass straight through
+    await upstream_limiter.acquire(str(request.url))
+    budget = current_budget()
+    if budget:
+        left = budget.timeout(None)
+        timeouts = request.extensions.get("timeout", {})
+        request.extensions["timeout"] = {k: min(v, left) if v else left for k, v in timeouts.items()}
+
+async def record_upstream_response(response: httpx.Response):
+    if response.request.extensions.get("warmup"):
+        return
+    upstream_limiter.record(str(response.request.url), response.status_code, response.headers)
+
+def upstream_unavailable(e: UpstreamUnavailable) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"APKPure is limiting requests ({e.reason}), try again later",
+                         headers={"Retry-After": str(int(e.retry_after) + 1)})
+
+def check_upstream(*urls: str):
+    """Fail fast with 503 and Retry-After instead of adding traffic to a host whose circuit is open"""
+    for url in urls:
+        try:
+            upstream_limiter.check(url)
+        except UpstreamUnavailable as e:
+            raise upstream_unavailable(e)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global http_client
     http_client = httpx.AsyncClient(
+        event_hooks={"request": [limit_upstream_request, trace_request], "response": [record_upstream_response]},
         timeout=httpx.Timeout(120.0, connect=30.0),
-        limits=httpx.Limits(max_connections=2000, max_keepalive_connections=1000),
+        transport=cached_dns_transport(
+            limits=httpx.Limits(max_connections=2000, max_keepalive_connections=1000,
+                                keepalive_expiry=UPSTREAM_KEEPALIVE),
+            http2=HTTP2_AVAILABLE),
         follow_redirects=True,
         headers={
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
@@ -187,23 +328,55 @@ async def lifespan(app: FastAPI):
         }
     )
     
-    start_aria2_daemon()
-    
+    bootstrap_task = asyncio.create_task(bootstrap_in_background())
     asyncio.create_task(periodic_cleanup())
+    warm_task = asyncio.create_task(keep_warm(http_client, UPSTREAM_WARM_INTERVAL, UPSTREAM_WARM_IDLE))
+    loop_monitor.start()
     
-    print("[Server] Started with aria2 high-performance configuration", file=sys.stderr)
+    startup_state["ready_at"] = time.time()
+    logger.info("[Server] Ready in %.2fs, aria2 starting in the background",
+                startup_state['ready_at'] - startup_state['started_at'])
     yield
     
+    startup_state["ready_at"] = None
+    bootstrap_task.cancel()
+    warm_task.cancel()
+    loop_monitor.stop()
     for task in pending_deletions.values():
         task.cancel()
     
     stop_aria2_daemon()
+    await cluster.close()
+    app_index.save()
     
     if http_client:
         await http_client.aclose()
 
 app = FastAPI(title="AppOmar APK Download API", version="5.0.0", lifespan=lifespan)
 
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 540))
+REQUEST_RETRY_BUDGET = int(os.environ.get("REQUEST_RETRY_BUDGET", 30))
+JOB_DEADLINE = float(os.environ.get("JOB_DEADLINE", 1800))
+DISCONNECT_KEEP_PERCENT = float(os.environ.get("DISCONNECT_KEEP_PERCENT", 90))
+DISCONNECT_KEEP_MB = int(os.environ.get("DISCONNECT_KEEP_MB", 16))
+
+# Requesters of the same package share one fetch, which is cancelled when the last of them disconnects
+shared_fetches = SharedFetches(keep_ratio=DISCONNECT_KEEP_PERCENT / 100, keep_bytes=DISCONNECT_KEEP_MB * 1024 * 1024)
+
+APK_PROVIDERS = os.environ.get("APK_PROVIDERS", DEFAULT_PROVIDERS)
+PROVIDER_HEDGE_DELAY = float(os.environ.get("PROVIDER_HEDGE_DELAY", 5))
+
+# Where packages are resolved, best observed source first; a slow favourite is hedged with the next one
+source_providers = ProviderResolver.from_spec(APK_PROVIDERS, hedge_delay=PROVIDER_HEDGE_DELAY)
+
+# Every request gets one deadline (inside the bot's 600s wait) and one allowance of upstream attempts
+app.add_middleware(BudgetMiddleware, deadline=REQUEST_DEADLINE, attempts=REQUEST_RETRY_BUDGET)
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    error = upstream_unavailable(exc)
+    return JSONResponse({"detail": error.detail}, status_code=error.status_code, headers=error.headers)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -220,7 +393,107 @@ USER_AGENTS = [
     'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Safari/605.1.15',
 ]
 
-download_semaphore = asyncio.Semaphore(200)
+FAST_LANE_SLOTS = int(os.environ.get("FAST_LANE_SLOTS", 150))
+BULK_LANE_SLOTS = int(os.environ.get("BULK_LANE_SLOTS", 50))
+PER_USER_DOWNLOADS = int(os.environ.get("PER_USER_DOWNLOADS", 3))
+FAST_LANE_MAX_MB = int(os.environ.get("FAST_LANE_MAX_MB", 100))
+
+download_scheduler = DownloadScheduler(
+    fast_slots=FAST_LANE_SLOTS,
+    bulk_slots=BULK_LANE_SLOTS,
+    per_user_limit=PER_USER_DOWNLOADS,
+    fast_lane_max_bytes=FAST_LANE_MAX_MB * 1024 * 1024
+)
+
+# Who the current request counts against in the scheduler when it carries no user_id
+request_client: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_client", default=None)
+
+def client_key(scope) -> str:
+    """Peer nodes by URL, exempt from the per-user quota; anyone else by address, behind the proxy if there is one"""
+    headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope.get("headers", [])}
+    forwarded_by = headers.get(FORWARDED_HEADER.lower())
+    if forwarded_by and cluster.is_peer(forwarded_by):
+        return f"{INTERNAL_PREFIX}peer:{forwarded_by}"
+    address = headers.get("x-forwarded-for", "").split(",")[0].strip()
+    if not address and scope.get("client"):
+        address = scope["client"][0]
+    return f"ip:{address or 'unknown'}"
+
+class ClientKeyMiddleware:
+    """Sets request_client for the request and every task it starts (jobs included)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = request_client.set(client_key(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_client.reset(token)
+
+app.add_middleware(ClientKeyMiddleware)
+
+def scheduler_user_key(user_id: Optional[str]) -> str:
+    # The bot sends its users' ids; everyone else gets a quota per address rather than one shared by all
+    return user_id or request_client.get() or "anon"
+
+# Finished job files outlive the usual 30s so the client has time to collect them,
+# but stay under the 300s age limit of cleanup_old_files
+JOB_FILE_TTL = int(os.environ.get("JOB_FILE_TTL", 240))
+
+download_jobs = JobManager(store=shared_state.dict("jobs"))
+
+# CLUSTER_SELF and CLUSTER_PEERS (comma-separated base URLs) turn on package ownership across nodes
+cluster = Cluster.from_env()
+
+LOOP_LAG_THRESHOLD_MS = int(os.environ.get("LOOP_LAG_THRESHOLD_MS", 250))
+
+loop_monitor = LoopMonitor(threshold=LOOP_LAG_THRESHOLD_MS / 1000)
+
+MAX_FILE_SIZE_MB = int(os.environ.get("MAX_FILE_SIZE_MB", 4096))
+MIN_FREE_DISK_MB = int(os.environ.get("MIN_FREE_DISK_MB", 512))
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", 300))
+RETRY_AFTER_MIN = 5
+RETRY_AFTER_MAX = 600
+
+def reject_overloaded(reason: str, retry_after: float):
+    stats.incr("admission_rejected")
+    retry_after = int(min(RETRY_AFTER_MAX, max(RETRY_AFTER_MIN, retry_after)))
+    logger.warning("[Admission] Rejected: %s (retry after %ss)", reason, retry_after)
+    raise HTTPException(
+        status_code=503,
+        detail=f"Server busy: {reason}",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def is_oversized(size: int) -> bool:
+    return size > MAX_FILE_SIZE_MB * 1024 * 1024
+
+def check_file_size(size: int):
+    # A file over the limit will never be admitted, so this is a 413 rather than a retryable 503
+    if is_oversized(size):
+        stats.incr("admission_rejected")
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large: {size / (1024*1024):.0f} MB > {MAX_FILE_SIZE_MB} MB limit"
+        )
+
+def check_admission(expected_size: int = 0, count: int = 1):
+    """Reject work up front when it cannot start soon, instead of letting it hang behind the queue"""
+    queued = download_scheduler.queued
+    if queued + count > MAX_QUEUE_DEPTH:
+        reject_overloaded(f"download queue full ({queued}/{MAX_QUEUE_DEPTH})",
+                          download_scheduler.expected_wait_for(expected_size))
+    
+    free = shutil.disk_usage(DOWNLOADS_DIR).free
+    available = free - download_scheduler.reserved_bytes() - MIN_FREE_DISK_MB * 1024 * 1024
+    if available < expected_size or available <= 0:
+        # Served files are deleted 30s after their last hit, so space comes back on that cadence
+        wait = 30 if pending_deletions else download_scheduler.expected_wait_for(expected_size)
+        reject_overloaded(f"not enough disk space ({free / (1024*1024):.0f} MB free)", wait)
 
 def get_headers() -> Dict[str, str]:
     return {
@@ -239,197 +512,133 @@ async def root() -> Dict[str, Any]:
         "version": "5.0.0",
         "status": "running",
         "source": "APKPure Only",
-        "features": ["aria2_downloads", "file_caching", "auto_cleanup", "100_concurrent_downloads"],
+        "features": ["aria2_downloads", "file_caching", "auto_cleanup", "100_concurrent_downloads", "fair_scheduling", "download_jobs", "cluster_mode", "icon_proxy"],
         "aria2_status": "running" if aria2_client else "not available"
     }
 
 @app.get("/health")
 async def health_check() -> Dict[str, str]:
-    return {"status": "healthy", "aria2": "running" if aria2_client else "not available"}
+    return {"status": "healthy", "aria2": "running" if aria2_client else startup_state["aria2"]}
 
-@app.get("/stats")
-async def get_server_stats() -> Dict[str, Any]:
-    aria2_stats = {}
+@app.get("/health/live")
+async def liveness() -> Dict[str, Any]:
+    """The process is up and its event loop is answering"""
+    return {"status": "alive", "uptime": round(time.time() - startup_state["started_at"], 1)}
+
+@app.get("/health/ready")
+async def readiness():
+    """Whether this instance should receive traffic; aria2 may still be starting, other engines work meanwhile"""
+    checks = {"http_client": http_client is not None and startup_state["ready_at"] is not None}
+    try:
+        shared_state.db.execute("SELECT 1")
+        checks["shared_state"] = True
+    except Exception:
+        checks["shared_state"] = False
+    
+    ready = all(checks.values())
+    return JSONResponse({
+        "status": "ready" if ready else "not ready",
+        "checks": checks,
+        "aria2": "running" if aria2_client else startup_state["aria2"],
+        "startup_seconds": round(startup_state["ready_at"] - startup_state["started_at"], 3) if ready else None
+    }, status_code=200 if ready else 503)
+
+def collect_blocking_stats() -> Dict[str, Any]:
+    """aria2 RPC and cache directory listing for /stats; runs in the executor"""
+    result = {
+        "cached_files": len([f for f in os.listdir(DOWNLOADS_DIR) if os.path.isfile(os.path.join(DOWNLOADS_DIR, f))])
+    }
     if aria2_client:
         try:
             aria2_stat = aria2_client.get_stats()
-            aria2_stats = {
+            result.update({
                 "aria2_active": aria2_stat.num_active,
                 "aria2_waiting": aria2_stat.num_waiting,
                 "aria2_stopped": aria2_stat.num_stopped,
                 "aria2_download_speed": aria2_stat.download_speed,
-            }
+            })
         except:
             pass
+    return result
+
+@app.get("/stats")
+async def get_server_stats() -> Dict[str, Any]:
+    blocking_stats = await run_quick(collect_blocking_stats)
     
     return {
-        **stats,
+        **stats.snapshot(),
+        "workers": API_WORKERS,
         "cached_urls": len(url_cache),
-        "cached_files": len([f for f in os.listdir(DOWNLOADS_DIR) if os.path.isfile(os.path.join(DOWNLOADS_DIR, f))]),
         "active_locks": len([l for l in download_locks.values() if l.locked()]),
         "pending_deletions": len(pending_deletions),
-        **aria2_stats
+        "scheduler": download_scheduler.snapshot(),
+        "engines": engine_selector.snapshot(),
+        "jobs": download_jobs.snapshot(),
+        "cluster": cluster.snapshot(),
+        "search_cache": search_cache.snapshot(),
+        "upstream_connections": upstream.snapshot(),
+        "inflight_fetches": shared_fetches.snapshot(),
+        "providers": source_providers.snapshot(),
+        "logging": log_stats.snapshot(),
+        "app_index": app_index.snapshot(),
+        "icon_cache": icon_cache.snapshot(),
+        "upstream_rate_limits": upstream_limiter.snapshot(),
+        "event_loop": loop_monitor.snapshot(include_stacks=False),
+        **blocking_stats
     }
 
-async def get_apkpure_app_slug(package_name: str) -> Optional[str]:
-    try:
-        client = get_client()
-        search_url = f"https://apkpure.com/search?q={package_name}"
-        response = await client.get(search_url, headers=get_headers())
-        
-        if response.status_code != 200:
-            return None
-            
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        for link in soup.find_all('a', href=True):
-            href_attr = link.get('href')
-            href = str(href_attr) if href_attr else ''
-            if f'/{package_name}' in href and '/download' not in href:
-                parts = href.strip('/').split('/')
-                if len(parts) >= 1:
-                    return parts[0]
-        
-        return package_name
-    except Exception as e:
-        print(f"[Slug] {package_name}: {e}", file=sys.stderr)
-        return package_name
+@app.get("/debug/loop-lag")
+async def get_loop_lag() -> Dict[str, Any]:
+    """Event loop lag and the worst recent stalls with the stack that was running"""
+    return loop_monitor.snapshot()
 
-async def detect_apkpure_file_type(package_name: str) -> str:
-    """Detect actual file type from APKPure page (APK or XAPK)"""
-    try:
-        client = get_client()
-        slug = await get_apkpure_app_slug(package_name)
-        if not slug:
-            slug = package_name
-        
-        app_page_url = f"https://apkpure.com/{slug}/{package_name}"
-        response = await client.get(app_page_url, headers=get_headers())
-        
-        if response.status_code != 200:
-            return "apk"
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        page_text = response.text.lower()
-        
-        download_btn = soup.find('a', class_=re.compile(r'download', re.I))
-        if download_btn:
-            btn_text = download_btn.get_text().lower()
-            data_type = str(download_btn.get('data-dt-file-type', '')).lower()
-            
-            if 'xapk' in data_type or 'xapk' in btn_text:
-                print(f"[APKPure] {package_name}: Detected XAPK from button", file=sys.stderr)
-                return "xapk"
-            elif 'apk' in data_type or 'apk' in btn_text:
-                if 'xapk' not in btn_text:
-                    print(f"[APKPure] {package_name}: Detected APK from button", file=sys.stderr)
-                    return "apk"
-        
-        file_info = soup.find('span', class_=re.compile(r'file.?type', re.I))
-        if file_info:
-            info_text = file_info.get_text().lower()
-            if 'xapk' in info_text:
-                print(f"[APKPure] {package_name}: Detected XAPK from file-info", file=sys.stderr)
-                return "xapk"
-            elif 'apk' in info_text:
-                print(f"[APKPure] {package_name}: Detected APK from file-info", file=sys.stderr)
-                return "apk"
-        
-        for elem in soup.find_all(['span', 'div', 'p'], class_=re.compile(r'info|detail|meta', re.I)):
-            text = elem.get_text().lower()
-            if 'xapk' in text and len(text) < 50:
-                print(f"[APKPure] {package_name}: Detected XAPK from metadata", file=sys.stderr)
-                return "xapk"
-        
-        if re.search(r'\bxapk\b', page_text):
-            xapk_count = len(re.findall(r'\bxapk\b', page_text))
-            apk_count = len(re.findall(r'\bapk\b', page_text)) - xapk_count
-            if xapk_count > apk_count:
-                print(f"[APKPure] {package_name}: Detected XAPK from page content (xapk:{xapk_count} vs apk:{apk_count})", file=sys.stderr)
-                return "xapk"
-        
-        print(f"[APKPure] {package_name}: Defaulting to APK", file=sys.stderr)
-        return "apk"
-        
-    except Exception as e:
-        print(f"[APKPure Detect] {package_name}: {e}", file=sys.stderr)
-        return "apk"
+@app.get("/metrics/engines")
+async def get_engine_metrics() -> Dict[str, Any]:
+    return {
+        "engines": list(DOWNLOAD_ENGINES.keys()),
+        "hosts": engine_selector.snapshot()
+    }
 
-async def resolve_apkpure_download_url(package_name: str, file_type: str = "XAPK") -> Optional[str]:
-    try:
-        client = get_client()
-        slug = await get_apkpure_app_slug(package_name)
-        if not slug:
-            slug = package_name
-        
-        download_page_url = f"https://apkpure.com/{slug}/{package_name}/download"
-        
-        response = await client.get(download_page_url, headers=get_headers())
-        
-        if response.status_code != 200:
-            return None
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        download_link = soup.find('a', {'id': 'download_link'})
-        if download_link:
-            href_attr = download_link.get('href')
-            if href_attr:
-                url = str(href_attr)
-                if url.startswith('http'):
-                    return url
-        
-        for a_tag in soup.find_all('a', href=True):
-            href_attr = a_tag.get('href')
-            href = str(href_attr) if href_attr else ''
-            if 'download.apkpure.com' in href or 'd.apkpure.com' in href:
-                if 'token' in href or 'key' in href:
-                    return href
-        
-        iframe = soup.find('iframe', {'id': 'iframe_download'})
-        if iframe:
-            src_attr = iframe.get('src')
-            if src_attr:
-                return str(src_attr)
-        
-        meta_refresh = soup.find('meta', {'http-equiv': 'refresh'})
-        if meta_refresh:
-            content_attr = meta_refresh.get('content')
-            content = str(content_attr) if content_attr else ''
-            match = re.search(r'url=(.+)', content, re.IGNORECASE)
-            if match:
-                return match.group(1).strip()
-        
-        scripts = soup.find_all('script')
-        for script in scripts:
-            script_text = script.string or ''
-            url_match = re.search(r'(https?://[^"\'<>\s]+\.(?:apk|xapk)[^"\'<>\s]*)', script_text, re.IGNORECASE)
-            if url_match:
-                return url_match.group(1)
-        
-        return None
-        
-    except Exception as e:
-        print(f"[APKPure Resolve] {package_name}: {e}", file=sys.stderr)
-        return None
+@app.get("/cluster")
+async def get_cluster_status() -> Dict[str, Any]:
+    return cluster.snapshot()
+
+@app.get("/cluster/owner/{package_name}")
+async def get_package_owner(package_name: str) -> Dict[str, Any]:
+    owner = cluster.owner_of(package_name)
+    return {
+        "package_name": package_name,
+        "owner": owner,
+        "is_self": not cluster.enabled or owner == cluster.self_url,
+        "fallback_order": cluster.ring.owners(package_name)
+    }
+
+@app.get("/queue")
+async def get_queue_status() -> Dict[str, Any]:
+    return download_scheduler.snapshot()
+
+@app.get("/queue/{user_id}")
+async def get_user_queue(user_id: str) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "downloads": download_scheduler.user_status(user_id)
+    }
 
 def get_larger_version_from_versions_page(package_name: str, min_size_mb: int = 150) -> Optional[Dict[str, Any]]:
     """Search versions page for a larger/complete version if latest is too small"""
     try:
-        import cloudscraper
-        scraper = cloudscraper.create_scraper(
-            browser={'browser': 'chrome', 'platform': 'darwin', 'desktop': True}
-        )
+        # The client's shared session, whose connections to apkpure.com are usually already open
+        scraper = APKPureClient(debug=False).scraper
         
         slug = package_name.split('.')[-1]
         versions_url = f"https://apkpure.com/{slug}/{package_name}/versions"
         
-        print(f"[APKPure Versions] Searching for larger version at: {versions_url}", file=sys.stderr)
-        response = scraper.get(versions_url, timeout=30)
+        logger.debug("[APKPure Versions] Searching for larger version at: %s", versions_url)
+        response = upstream_limiter.guard(scraper.get, versions_url, timeout=30)
         
         if response.status_code != 200:
             search_url = f"https://apkpure.com/search?q={package_name}"
-            search_resp = scraper.get(search_url, timeout=30)
+            search_resp = upstream_limiter.guard(scraper.get, search_url, timeout=30)
             if search_resp.status_code == 200:
                 soup = BeautifulSoup(search_resp.text, 'html.parser')
                 for link in soup.find_all('a', href=True):
@@ -440,7 +649,7 @@ def get_larger_version_from_versions_page(package_name: str, min_size_mb: int =
                             slug = parts[0]
                             break
                 versions_url = f"https://apkpure.com/{slug}/{package_name}/versions"
-                response = scraper.get(versions_url, timeout=30)
+                response = upstream_limiter.guard(scraper.get, versions_url, timeout=30)
         
         if response.status_code != 200:
             return None
@@ -480,9 +689,10 @@ def get_larger_version_from_versions_page(package_name: str, min_size_mb: int =
         
         for ver in versions_with_size:
             if ver['size_mb'] >= min_size_mb:
-                print(f"[APKPure Versions] Found latest complete version {ver['version']}: {ver['size_mb']:.1f} MB", file=sys.stderr)
+                logger.info("[APKPure Versions] Found latest complete version %s: %.1f MB",
+                            ver['version'], ver['size_mb'])
                 
-                dl_page_resp = scraper.get(ver['download_page'], timeout=30)
+                dl_page_resp = upstream_limiter.guard(scraper.get, ver['download_page'], timeout=30)
                 if dl_page_resp.status_code == 200:
                     dl_soup = BeautifulSoup(dl_page_resp.text, 'html.parser')
                     
@@ -492,11 +702,13 @@ def get_larger_version_from_versions_page(package_name: str, min_size_mb: int =
                         if download_url.startswith('http'):
                             file_type = 'xapk' if 'xapk' in download_url.lower() else 'apk'
                             
-                            head_resp = scraper.head(download_url, timeout=30, allow_redirects=True)
+                            head_resp = upstream_limiter.guard(scraper.head, download_url, timeout=30,
+                                                               allow_redirects=True)
                             if head_resp.status_code == 200:
                                 content_length = int(head_resp.headers.get('Content-Length', 0))
                                 if content_length > min_size_mb * 1024 * 1024:
-                                    print(f"[APKPure Versions] Verified download URL: {content_length / (1024*1024):.1f} MB", file=sys.stderr)
+                                    logger.info("[APKPure Versions] Verified download URL: %.1f MB",
+                                                content_length / (1024*1024))
                                     return {
                                         "source": "apkpure",
                                         "download_url": download_url,
@@ -508,7 +720,7 @@ def get_larger_version_from_versions_page(package_name: str, min_size_mb: int =
                     for a in dl_soup.find_all('a', href=True):
                         href = a.get('href', '')
                         if 'd.apkpure.com/b/XAPK' in href:
-                            head_resp = scraper.head(href, timeout=30, allow_redirects=True)
+                            head_resp = upstream_limiter.guard(scraper.head, href, timeout=30, allow_redirects=True)
                             if head_resp.status_code == 200:
                                 content_length = int(head_resp.headers.get('Content-Length', 0))
                                 if content_length > min_size_mb * 1024 * 1024:
@@ -523,232 +735,152 @@ def get_larger_version_from_versions_page(package_name: str, min_size_mb: int =
         return None
         
     except Exception as e:
-        print(f"[APKPure Versions] Error: {e}", file=sys.stderr)
-        return None
-
-def get_apkpure_info_sync(package_name: str, min_size_mb: int = 150) -> Optional[Dict[str, Any]]:
-    try:
-        safari_versions = ["safari15_3", "safari15_5", "safari17_0", "safari17_2_macos"]
-        
-        latest_result = None
-        
-        for safari_ver in safari_versions:
-            try:
-                xapk_url = f"https://d.apkpure.com/b/XAPK/{package_name}?version=latest"
-                response = curl_requests.head(
-                    xapk_url,
-                    impersonate=safari_ver,
-                    timeout=30,
-                    allow_redirects=True
-                )
-                
-                if response.status_code == 200:
-                    content_type = response.headers.get('Content-Type', '')
-                    if 'html' not in content_type.lower():
-                        content_length = int(response.headers.get('Content-Length', 0))
-                        size_mb = content_length / (1024 * 1024)
-                        
-                        if size_mb >= min_size_mb:
-                            print(f"[APKPure curl-cffi] Found XAPK for {package_name}: {size_mb:.1f} MB (OK)", file=sys.stderr)
-                            return {
-                                "source": "apkpure",
-                                "download_url": xapk_url,
-                                "size": content_length,
-                                "file_type": "xapk",
-                                "impersonate": safari_ver
-                            }
-                        else:
-                            print(f"[APKPure curl-cffi] Latest XAPK too small: {size_mb:.1f} MB < {min_size_mb} MB", file=sys.stderr)
-                            latest_result = {
-                                "source": "apkpure",
-                                "download_url": xapk_url,
-                                "size": content_length,
-                                "file_type": "xapk"
-                            }
-                
-                apk_url = f"https://d.apkpure.com/b/APK/{package_name}?version=latest"
-                response = curl_requests.head(
-                    apk_url,
-                    impersonate=safari_ver,
-                    timeout=30,
-                    allow_redirects=True
-                )
-                
-                if response.status_code == 200:
-                    content_type = response.headers.get('Content-Type', '')
-                    if 'html' not in content_type.lower():
-                        content_length = int(response.headers.get('Content-Length', 0))
-                        final_url = str(response.url)
-                        size_mb = content_length / (1024 * 1024)
-                        
-                        file_type = 'xapk' if 'xapk' in final_url.lower() else 'apk'
-                        
-                        if size_mb >= min_size_mb:
-                            print(f"[APKPure curl-cffi] Found {file_type.upper()} for {package_name}: {size_mb:.1f} MB (OK)", file=sys.stderr)
-                            return {
-                                "source": "apkpure",
-                                "download_url": apk_url,
-                                "size": content_length,
-                                "file_type": file_type,
-                                "impersonate": safari_ver
-                            }
-                        elif not latest_result:
-                            latest_result = {
-                                "source": "apkpure",
-                                "download_url": apk_url,
-                                "size": content_length,
-                                "file_type": file_type
-                            }
-                
-                break
-                
-            except Exception as e:
-                print(f"[APKPure curl-cffi] {safari_ver} failed: {e}", file=sys.stderr)
-                continue
-        
-        print(f"[APKPure] Searching for larger version in versions page...", file=sys.stderr)
-        larger_version = get_larger_version_from_versions_page(package_name, min_size_mb)
-        if larger_version:
-            return larger_version
-        
-        if latest_result:
-            print(f"[APKPure] Using latest version (small): {latest_result.get('size', 0) / (1024*1024):.1f} MB", file=sys.stderr)
-            return latest_result
-        
-        return None
-    except Exception as e:
-        print(f"[APKPure curl-cffi] {package_name}: {e}", file=sys.stderr)
+        logger.warning("[APKPure Versions] Error: %s", e)
         return None
 
-async def get_apkpure_info(package_name: str) -> Optional[Dict[str, Any]]:
-    try:
-        detected_type = await detect_apkpure_file_type(package_name)
-        print(f"[APKPure] {package_name}: Detected type = {detected_type.upper()}", file=sys.stderr)
-        
-        client = get_client()
-        
-        primary_type = detected_type.upper()
-        fallback_type = "XAPK" if primary_type == "APK" else "APK"
-        
-        primary_url = f"https://d.apkpure.com/b/{primary_type}/{package_name}?version=latest"
-        response = await client.head(primary_url, headers=get_headers(), follow_redirects=True)
-        
-        if response.status_code == 200:
-            content_type = response.headers.get('Content-Type', '')
-            if 'html' not in content_type.lower():
-                content_length = int(response.headers.get('Content-Length', 0))
-                if content_length > 100000:
-                    print(f"[APKPure] {package_name}: Found {primary_type} ({content_length} bytes)", file=sys.stderr)
-                    return {
-                        "source": "apkpure",
-                        "download_url": primary_url,
-                        "size": content_length,
-                        "file_type": detected_type
-                    }
-        
-        fallback_url = f"https://d.apkpure.com/b/{fallback_type}/{package_name}?version=latest"
-        response = await client.head(fallback_url, headers=get_headers(), follow_redirects=True)
-        
-        if response.status_code == 200:
-            content_type = response.headers.get('Content-Type', '')
-            if 'html' not in content_type.lower():
-                content_length = int(response.headers.get('Content-Length', 0))
-                if content_length > 100000:
-                    fallback_file_type = fallback_type.lower()
-                    print(f"[APKPure] {package_name}: Fallback to {fallback_type} ({content_length} bytes)", file=sys.stderr)
-                    return {
-                        "source": "apkpure",
-                        "download_url": fallback_url,
-                        "size": content_length,
-                        "file_type": fallback_file_type
-                    }
-        
-        resolved_url = await resolve_apkpure_download_url(package_name, primary_type)
-        if resolved_url:
-            try:
-                check_response = await client.head(resolved_url, headers=get_headers(), follow_redirects=True)
-                if check_response.status_code == 200:
-                    content_type = check_response.headers.get('Content-Type', '')
-                    content_length = int(check_response.headers.get('Content-Length', 0))
-                    
-                    if 'html' not in content_type.lower() or content_length > 1000000:
-                        file_type = 'xapk' if 'xapk' in resolved_url.lower() else 'apk'
-                        return {
-                            "source": "apkpure",
-                            "download_url": resolved_url,
-                            "size": content_length,
-                            "file_type": file_type
-                        }
-            except Exception as e:
-                pass
-        
-        return None
-    except Exception as e:
-        print(f"[APKPure] {package_name}: {e}", file=sys.stderr)
-        return None
+def remember_download_info(package_name: str, result: Dict[str, Any], now: float):
+    result["package_name"] = package_name
+    url_cache[package_name] = (result, now)
+    app_index.add_package(package_name, downloaded=False, size=result.get('size'),
+                          file_type=result.get('file_type'), version=result.get('version'), resolved_at=now)
 
 async def get_download_info(package_name: str) -> Dict[str, Any]:
-    """Smart download info using unified APKPure client with intelligent type detection"""
-    stats["total_requests"] += 1
+    """Download info from the configured source providers, with APKPure's direct URLs as the last resort"""
+    stats.incr("total_requests")
     cache_key = package_name
     now = time.time()
     
     if cache_key in url_cache:
         cached, timestamp = url_cache[cache_key]
         if now - timestamp < URL_CACHE_TTL:
-            stats["cache_hits"] += 1
-            print(f"[Cache Hit] {package_name} from {cached.get('source', 'unknown')}", file=sys.stderr)
+            stats.incr("cache_hits")
+            logger.debug("[Cache Hit] %s from %s", package_name, cached.get('source', 'unknown'))
             return cached
     
-    result = await asyncio.get_event_loop().run_in_executor(
-        None, 
-        lambda: get_smart_download_info(package_name, debug=True)
-    )
+    try:
+        check_upstream("apkpure.com", "d.apkpure.com")
+    except HTTPException:
+        # An expired URL often still works, and is better than no answer while upstream recovers
+        if cache_key in url_cache:
+            logger.info("[Cache Stale] %s served while APKPure is limiting us", package_name)
+            return {**url_cache[cache_key][0], "stale": True}
+        raise
     
-    if not result:
-        result = await get_apkpure_info(package_name)
+    result = await source_providers.resolve(package_name)
     
     if not result:
-        print(f"[Fallback] Using direct APKPure URL for {package_name}", file=sys.stderr)
-        for file_type in ["XAPK", "APK"]:
-            url = f"https://d.apkpure.com/b/{file_type}/{package_name}?version=latest"
-            try:
-                client = get_client()
-                head_resp = await client.head(url, headers=get_headers(), follow_redirects=True)
-                if head_resp.status_code == 200:
-                    content_type = head_resp.headers.get('Content-Type', '')
-                    content_length = int(head_resp.headers.get('Content-Length', 0))
-                    if 'html' not in content_type.lower() and content_length > 100000:
-                        print(f"[Fallback] Found {file_type}: {content_length / (1024*1024):.2f} MB", file=sys.stderr)
-                        result = {
-                            "source": "apkpure",
-                            "download_url": url,
-                            "size": content_length,
-                            "file_type": file_type.lower()
-                        }
-                        break
-            except Exception as e:
-                print(f"[Fallback] {file_type} check failed: {e}", file=sys.stderr)
-        
-        if not result:
-            result = {
-                "source": "apkpure",
-                "download_url": f"https://d.apkpure.com/b/XAPK/{package_name}?version=latest",
-                "size": 0,
-                "file_type": "xapk"
-            }
+        # The providers already made every lookup they know; another round here would only repeat it
+        check_budget()
+        if "apkpure" not in source_providers:
+            raise HTTPException(status_code=404, detail=f"No source has {package_name}")
+        # Every lookup failed because upstream shut us out or time ran out: do not cache a guess
+        check_upstream("apkpure.com", "d.apkpure.com")
+        logger.info("[Fallback] Using direct APKPure URL for %s", package_name)
+        result = {
+            "source": "apkpure",
+            "download_url": f"https://d.apkpure.com/b/XAPK/{package_name}?version=latest",
+            "size": 0,
+            "file_type": "xapk"
+        }
     
-    result["package_name"] = package_name
-    url_cache[cache_key] = (result, now)
+    remember_download_info(package_name, result, now)
     
     file_type = result.get('file_type', 'unknown').upper()
     size_mb = result.get('size', 0) / (1024*1024)
     detected_from = result.get('detected_from', 'unknown')
-    print(f"[Download Info] {package_name} -> Type: {file_type}, Size: {size_mb:.1f} MB, Detected from: {detected_from}", file=sys.stderr)
+    logger.info("[Download Info] %s -> Type: %s, Size: %.1f MB, Detected from: %s",
+                package_name, file_type, size_mb, detected_from)
     return result
 
+INFO_CONCURRENCY = int(os.environ.get("INFO_CONCURRENCY", 8))
+BULK_INFO_MAX = 200
+
+# Bounds how many package resolutions bulk endpoints run at once, across all requests
+info_semaphore = asyncio.Semaphore(INFO_CONCURRENCY)
+
+def info_answer(package_name: str, info: Dict[str, Any], answered_from: str, **extra) -> Dict[str, Any]:
+    return {
+        "package_name": package_name,
+        "success": True,
+        "size": info.get("size", 0),
+        "file_type": info.get("file_type", "apk"),
+        "version": info.get("version") or "Latest",
+        "source": info.get("source", "apkpure"),
+        "from": answered_from,
+        **extra
+    }
+
+def known_info(package_name: str) -> Optional[Dict[str, Any]]:
+    """Answer from what is already on hand: a fresh URL, a cached file, or the size last seen in the catalog"""
+    cached = url_cache.get(package_name)
+    if cached and time.time() - cached[1] < URL_CACHE_TTL:
+        return info_answer(package_name, cached[0], "url_cache")
+    
+    cache_key = find_cached_package(package_name)
+    if cache_key:
+        entry = file_cache.get(cache_key)
+        if entry:
+            return info_answer(package_name, entry, "file_cache")
+    
+    record = app_index.get(package_name)
+    if record and record.get("size"):
+        seen_at = record.get("resolved_at") or record.get("downloaded_at") or record.get("indexed_at", 0)
+        return info_answer(package_name, record, "catalog", age=round(time.time() - seen_at))
+    return None
+
+async def bulk_info_results(packages: List[str]):
+    """Known answers first, then each remaining package as soon as it resolves"""
+    pending = []
+    for package_name in packages:
+        answer = known_info(package_name)
+        if answer:
+            yield answer
+        else:
+            pending.append(package_name)
+    
+    async def resolve(package_name: str) -> Dict[str, Any]:
+        try:
+            async with info_semaphore:
+                with request_budget(REQUEST_DEADLINE, REQUEST_RETRY_BUDGET, package_name):
+                    return info_answer(package_name, await get_download_info(package_name), "upstream")
+        except Exception as e:
+            return {"package_name": package_name, "success": False, "error": str(getattr(e, 'detail', e))}
+    
+    tasks = [asyncio.ensure_future(resolve(pkg)) for pkg in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.post("/info")
+async def bulk_info(packages: List[str], stream: bool = False):
+    """Size, type and version for many packages; resolution runs INFO_CONCURRENCY at a time"""
+    packages = list(dict.fromkeys(packages))
+    if len(packages) > BULK_INFO_MAX:
+        raise HTTPException(status_code=400, detail=f"Maximum {BULK_INFO_MAX} packages per request")
+    
+    if stream:
+        return StreamingResponse(ndjson_lines(bulk_info_results(packages)), media_type="application/x-ndjson")
+    
+    answers = {result["package_name"]: result async for result in bulk_info_results(packages)}
+    results = [answers[pkg] for pkg in packages]
+    successful = len([r for r in results if r.get("success")])
+    return {
+        "success": True,
+        "total": len(packages),
+        "successful": successful,
+        "failed": len(packages) - successful,
+        "results": results
+    }
+
 @app.get("/info/{package_name}")
-async def get_apk_info(package_name: str) -> Dict[str, Any]:
+async def get_apk_info(package_name: str, request: Request):
+    if package_name not in url_cache:
+        forwarded = await cluster.forward(request, package_name)
+        if forwarded:
+            return forwarded
     try:
         info = await get_download_info(package_name)
         return {
@@ -758,11 +890,17 @@ async def get_apk_info(package_name: str) -> Dict[str, Any]:
             "file_type": info.get("file_type", "apk"),
             "version": info.get("version", "Latest")
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/url/{package_name}")
-async def get_download_url(package_name: str) -> Dict[str, Any]:
+async def get_download_url(package_name: str, request: Request):
+    if package_name not in url_cache:
+        forwarded = await cluster.forward(request, package_name)
+        if forwarded:
+            return forwarded
     try:
         info = await get_download_info(package_name)
         return {
@@ -773,6 +911,8 @@ async def get_download_url(package_name: str) -> Dict[str, Any]:
             "source": info.get('source'),
             "file_type": info.get('file_type', 'apk')
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -811,41 +951,43 @@ async def get_direct_download_url(package_name: str) -> Dict[str, Any]:
             "file_type": file_type,
             "headers": headers_for_download
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[Direct URL Error] {package_name}: {e}", file=sys.stderr)
+        logger.warning("[Direct URL Error] %s: %s", package_name, e)
         raise HTTPException(status_code=500, detail=str(e))
 
-def download_with_aria2(download_url: str, file_path: str, package_name: str) -> bool:
+def aria2_download_options(filename: str) -> Dict[str, Any]:
+    return {
+        "out": filename,
+        "dir": DOWNLOADS_DIR,
+        "max-connection-per-server": "16",
+        "split": "16",
+        "min-split-size": "1M",
+        "header": [
+            f"User-Agent: {random.choice(USER_AGENTS)}",
+            "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language: en-US,en;q=0.9",
+            "Referer: https://apkpure.com/",
+        ],
+        "check-certificate": "false",
+        "allow-overwrite": "true",
+        "auto-file-renaming": "false",
+    }
+
+def download_with_aria2(download_url: str, file_path: str, package_name: str,
+                        progress: Optional[Callable[[int, int], None]] = None) -> bool:
     global aria2_client
     if not aria2_client:
         return False
     
     try:
-        stats["aria2_downloads"] += 1
-        print(f"[aria2] Starting download for {package_name}...", file=sys.stderr)
-        
-        filename = os.path.basename(file_path)
+        stats.incr("aria2_downloads")
+        logger.debug("[aria2] Starting download for %s...", package_name)
         
-        options = {
-            "out": filename,
-            "dir": DOWNLOADS_DIR,
-            "max-connection-per-server": "16",
-            "split": "16",
-            "min-split-size": "1M",
-            "header": [
-                f"User-Agent: {random.choice(USER_AGENTS)}",
-                "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                "Accept-Language: en-US,en;q=0.9",
-                "Referer: https://apkpure.com/",
-            ],
-            "check-certificate": "false",
-            "allow-overwrite": "true",
-            "auto-file-renaming": "false",
-        }
+        download = aria2_client.add_uris([download_url], options=aria2_download_options(os.path.basename(file_path)))
         
-        download = aria2_client.add_uris([download_url], options=options)
-        
-        timeout = 600
+        timeout = budget_timeout(600)
         start_time = time.time()
         last_progress = 0
         
@@ -856,356 +998,560 @@ def download_with_aria2(download_url: str, file_path: str, package_name: str) ->
                 file_size = download.total_length
                 elapsed = time.time() - start_time
                 speed = file_size / elapsed / 1024 / 1024 if elapsed > 0 else 0
-                print(f"[aria2] Downloaded {package_name}: {file_size / 1024 / 1024:.2f} MB in {elapsed:.1f}s ({speed:.2f} MB/s)", file=sys.stderr)
-                stats["aria2_success"] += 1
+                logger.info("[aria2] Downloaded %s: %.2f MB in %.1fs (%.2f MB/s)",
+                            package_name, file_size / 1024 / 1024, elapsed, speed)
+                stats.incr("aria2_success")
                 return True
             
             if download.has_failed:
                 error = download.error_message or "Unknown error"
-                print(f"[aria2] Download failed for {package_name}: {error}", file=sys.stderr)
-                stats["aria2_failed"] += 1
+                logger.warning("[aria2] Download failed for %s: %s", package_name, error)
+                stats.incr("aria2_failed")
                 return False
             
             if download.total_length > 0:
-                progress = (download.completed_length / download.total_length) * 100
-                if progress - last_progress >= 10:
-                    print(f"[aria2] {package_name}: {progress:.0f}% ({download.completed_length / 1024 / 1024:.1f} MB)", file=sys.stderr)
-                    last_progress = progress
+                if progress:
+                    progress(download.completed_length, download.total_length)
+                percent = (download.completed_length / download.total_length) * 100
+                if percent - last_progress >= 10:
+                    logger.debug("[aria2 Progress] %s: %.0f%% (%.1f MB)",
+                                 package_name, percent, download.completed_length / 1024 / 1024)
+                    last_progress = percent
+            
+            if budget_exhausted():
+                # Everyone waiting for it went away; stop the transfer instead of finishing it for nobody
+                logger.warning("[aria2] Download of %s abandoned, removing", package_name)
+                try:
+                    download.remove(force=True, files=True)
+                except:
+                    pass
+                return False
             
             if time.time() - start_time > timeout:
-                print(f"[aria2] Download timeout for {package_name}", file=sys.stderr)
+                logger.warning("[aria2] Download timeout for %s", package_name)
                 try:
                     download.remove(force=True)
                 except:
                     pass
-                stats["aria2_failed"] += 1
+                stats.incr("aria2_failed")
                 return False
             
             time.sleep(0.5)
             
     except Exception as e:
-        print(f"[aria2] Error downloading {package_name}: {e}", file=sys.stderr)
-        stats["aria2_failed"] += 1
+        logger.warning("[aria2] Error downloading %s: %s", package_name, e)
+        stats.incr("aria2_failed")
         return False
 
-MIN_VALID_FILE_SIZE = 500000
-
-def is_html_content(content: bytes) -> bool:
-    """Check if content is HTML (error page) instead of binary file"""
-    if len(content) < MIN_VALID_FILE_SIZE:
-        try:
-            text = content[:1000].decode('utf-8', errors='ignore').lower()
-            if '<html' in text or '<!doctype' in text or '<head' in text:
-                return True
-        except:
-            pass
-    return False
-
-def download_with_curl_cffi(download_url: str, file_path: str, package_name: str) -> bool:
+def download_with_curl_cffi(download_url: str, file_path: str, package_name: str,
+                            progress: Optional[Callable[[int, int], None]] = None) -> Tuple[bool, Optional[StreamValidator]]:
     safari_versions = ["safari15_3", "safari15_5", "safari17_0", "safari17_2_macos"]
+    validator = None
     
     for safari_ver in safari_versions:
+        if budget_exhausted():
+            break
         try:
-            print(f"[curl-cffi] Downloading {package_name} with {safari_ver}...", file=sys.stderr)
-            response = curl_requests.get(
+            logger.debug("[curl-cffi] Downloading %s with %s...", package_name, safari_ver)
+            response = upstream_limiter.guard(
+                curl_get,
                 download_url,
                 impersonate=safari_ver,
                 timeout=300,
-                allow_redirects=True
+                allow_redirects=True,
+                stream=True
             )
             
-            if response.status_code == 200:
-                content = response.content
-                content_type = response.headers.get('Content-Type', '')
-                
-                if is_html_content(content):
-                    print(f"[curl-cffi] {safari_ver} returned HTML page ({len(content)} bytes), trying next...", file=sys.stderr)
-                    continue
-                
-                if len(content) < MIN_VALID_FILE_SIZE:
-                    print(f"[curl-cffi] {safari_ver} file too small ({len(content)} bytes), trying next...", file=sys.stderr)
+            try:
+                if response.status_code != 200:
+                    logger.warning("[curl-cffi] %s returned %s", safari_ver, response.status_code)
                     continue
                 
+                validator = StreamValidator()
+                total = int(response.headers.get('content-length') or 0)
                 with open(file_path, 'wb') as f:
-                    f.write(content)
-                file_size = os.path.getsize(file_path)
-                print(f"[curl-cffi] Downloaded {package_name}: {file_size / 1024 / 1024:.2f} MB", file=sys.stderr)
-                return True
+                    for chunk in response.iter_content(chunk_size=131072):
+                        if not validator.feed(chunk):
+                            break
+                        f.write(chunk)
+                        if progress:
+                            progress(validator.size, total)
+                        check_budget()
+                
+                if not validator.finish():
+                    logger.warning("[curl-cffi] %s: %s, trying next...", safari_ver, validator.error)
+                    continue
+            finally:
+                response.close()
             
-            print(f"[curl-cffi] {safari_ver} returned {response.status_code}", file=sys.stderr)
+            logger.info("[curl-cffi] Downloaded %s: %.2f MB", package_name, validator.size / 1024 / 1024)
+            return True, validator
             
         except Exception as e:
-            print(f"[curl-cffi] {safari_ver} failed: {e}", file=sys.stderr)
+            logger.warning("[curl-cffi] %s failed: %s", safari_ver, e)
             continue
     
-    return False
+    return False, validator
 
-def validate_downloaded_file(file_path: str, package_name: str) -> bool:
-    """Validate downloaded file is not HTML error page"""
-    if not os.path.exists(file_path):
+async def download_with_httpx(download_url: str, file_path: str, package_name: str,
+                              progress: Optional[Callable[[int, int], None]] = None) -> StreamValidator:
+    validator = StreamValidator()
+    # The shared client: its hooks rate-limit and record every hop, and its connections and DNS cache are reused
+    async with get_client().stream("GET", download_url, headers=get_headers(),
+                                   timeout=httpx.Timeout(300.0, connect=30.0)) as response:
+        if response.status_code != 200:
+            validator.error = f"HTTP {response.status_code}"
+            return validator
+        
+        total = int(response.headers.get('content-length') or 0)
+        # Validation runs on the stream itself, so an HTML challenge is dropped after its first chunk
+        async with aiofiles.open(file_path, 'wb') as f:
+            async for chunk in response.aiter_bytes(chunk_size=131072):
+                if not validator.feed(chunk):
+                    return validator
+                await f.write(chunk)
+                if progress:
+                    progress(validator.size, total)
+                check_budget()
+    validator.finish()
+    return validator
+
+def is_cached_file_intact(cached_info: Dict[str, Any]) -> bool:
+    """Cached files were validated while downloading; only confirm they are still whole on disk"""
+    try:
+        return os.path.getsize(cached_info['file_path']) == cached_info.get('size')
+    except OSError:
         return False
+
+def find_cache_entry(file_path: str) -> Dict[str, Any]:
+    return next((info for _, info in file_cache.find('file_path', file_path)), {})
+
+def package_cache_key(package_name: str, version: Optional[str] = None) -> str:
+    """File cache key: one file per package and version, whichever source or URL delivered it"""
+    return f"{package_name}_{version or 'latest'}"
+
+def find_cached_package(package_name: str) -> Optional[str]:
+    """Cache key of an intact cached file for this package, whatever URL it came from"""
+    for cache_key, info in file_cache.find('package_name', package_name):
+        if is_cached_file_intact(info):
+            return cache_key
+    return None
+
+def touch_cache_entry(cache_key: str, delay: int = 30):
+    """Push back the deletion of a cached file that was just used, for every worker"""
+    if not file_cache.raise_field(cache_key, 'expires_at', time.time() + delay):
+        return
     
-    file_size = os.path.getsize(file_path)
-    
-    if file_size < MIN_VALID_FILE_SIZE:
-        print(f"[Validate] {package_name}: File too small ({file_size} bytes)", file=sys.stderr)
-        
-        try:
-            with open(file_path, 'rb') as f:
-                header = f.read(1000)
-            if is_html_content(header):
-                print(f"[Validate] {package_name}: File contains HTML content!", file=sys.stderr)
-                return False
-        except:
-            pass
-        
-        return False
+    # Each worker that touched the file keeps a deletion task, so it goes even if the downloader exits
+    if cache_key not in pending_deletions:
+        entry = file_cache.get(cache_key)
+        if entry:
+            pending_deletions[cache_key] = asyncio.create_task(schedule_file_deletion(entry['file_path'], delay))
+
+def add_to_file_cache(cache_key: str, package_name: str, file_path: str, file_type: str,
+                      validator: StreamValidator, engine: str, version: Optional[str] = None,
+                      source: Optional[str] = None) -> Dict[str, Any]:
+    entry = {
+        'package_name': package_name,
+        'version': version,
+        'source': source,
+        'file_path': file_path,
+        'file_type': file_type,
+        'size': validator.size,
+        'sha256': validator.sha256,
+        'engine': engine,
+        'created_at': time.time(),
+        'expires_at': time.time() + 30
+    }
+    file_cache[cache_key] = entry
+    stats.incr("cached_files")
+    stats.incr("downloads")
     
-    return True
+    deletion_task = asyncio.create_task(schedule_file_deletion(file_path, 30))
+    pending_deletions[cache_key] = deletion_task
+    return entry
+
+async def run_aria2_engine(download_url: str, file_path: str, package_name: str, progress=None):
+    if not aria2_client:
+        return False, "aria2 not available", None
+    spend("aria2 download")
+    ok = await run_blocking(download_with_aria2, download_url, file_path, package_name, progress)
+    if not ok:
+        return False, "aria2 download failed", None
+    # aria2 writes the file itself, so its single validation and hashing pass happens here
+    validator = await run_blocking(validate_file, file_path)
+    return validator.error is None, validator.error or "", validator
+
+async def run_curl_cffi_engine(download_url: str, file_path: str, package_name: str, progress=None):
+    ok, validator = await run_blocking(download_with_curl_cffi, download_url, file_path, package_name, progress)
+    if ok:
+        return True, "", validator
+    return False, (validator.error if validator and validator.error else "error from every profile"), validator
+
+async def run_httpx_engine(download_url: str, file_path: str, package_name: str, progress=None):
+    try:
+        validator = await download_with_httpx(download_url, file_path, package_name, progress)
+    except Exception as e:
+        return False, str(e), None
+    return validator.error is None, validator.error or "", validator
+
+DOWNLOAD_ENGINES = {
+    "aria2": run_aria2_engine,
+    "curl_cffi": run_curl_cffi_engine,
+    "httpx": run_httpx_engine,
+}
 
-async def download_file_to_cache(package_name: str, download_url: str, file_type: str, retry_count: int = 0) -> Optional[str]:
+engine_selector = EngineSelector(list(DOWNLOAD_ENGINES.keys()))
+
+async def download_file_to_cache(package_name: str, download_url: str, file_type: str, retry_count: int = 0,
+                                 user_id: Optional[str] = None, expected_size: int = 0,
+                                 progress: Optional[Callable[[int, int], None]] = None,
+                                 version: Optional[str] = None, source: Optional[str] = None) -> Optional[str]:
     lock = get_download_lock(package_name)
     max_retries = 2
     
     async with lock:
-        cache_key = f"{package_name}_{hashlib.md5(download_url.encode()).hexdigest()[:8]}"
+        cache_key = package_cache_key(package_name, version)
         
         if cache_key in file_cache:
             cached_info = file_cache[cache_key]
             if os.path.exists(cached_info['file_path']):
-                if validate_downloaded_file(cached_info['file_path'], package_name):
-                    if cache_key in pending_deletions:
-                        pending_deletions[cache_key].cancel()
-                        del pending_deletions[cache_key]
-                    
-                    deletion_task = asyncio.create_task(schedule_file_deletion(cached_info['file_path'], 30))
-                    pending_deletions[cache_key] = deletion_task
-                    
+                if is_cached_file_intact(cached_info):
+                    touch_cache_entry(cache_key)
                     return cached_info['file_path']
                 else:
-                    print(f"[Cache] {package_name}: Cached file is invalid, removing...", file=sys.stderr)
-                    try:
-                        os.remove(cached_info['file_path'])
-                    except:
-                        pass
+                    logger.warning("[Cache] %s: Cached file is invalid, removing...", package_name)
+                    await run_quick(remove_file, cached_info['file_path'])
                     del file_cache[cache_key]
         
+        check_file_size(expected_size)
+        check_admission(expected_size)
+        
         file_id = generate_user_file_id(package_name)
         file_path = os.path.join(DOWNLOADS_DIR, f"{file_id}.{file_type}")
         
-        async with download_semaphore:
-            stats["active_downloads"] += 1
+        async with download_scheduler.slot(scheduler_user_key(user_id), package_name, expected_size):
+            stats.incr("active_downloads")
             try:
-                loop = asyncio.get_event_loop()
-                success = await loop.run_in_executor(
-                    None, 
-                    download_with_aria2, 
-                    download_url, 
-                    file_path, 
-                    package_name
-                )
-                
-                if success and not validate_downloaded_file(file_path, package_name):
-                    print(f"[Download] aria2 downloaded invalid file, trying curl-cffi...", file=sys.stderr)
-                    try:
-                        os.remove(file_path)
-                    except:
-                        pass
-                    success = False
-                
-                if not success:
-                    print(f"[Download] aria2 failed, trying curl-cffi...", file=sys.stderr)
-                    success = await loop.run_in_executor(
-                        None, 
-                        download_with_curl_cffi, 
-                        download_url, 
-                        file_path, 
-                        package_name
-                    )
-                
-                if success and not validate_downloaded_file(file_path, package_name):
-                    print(f"[Download] curl-cffi downloaded invalid file, trying httpx...", file=sys.stderr)
-                    try:
-                        os.remove(file_path)
-                    except:
-                        pass
-                    success = False
+                host = urlparse(download_url).hostname or "unknown"
+                # While aria2 is still starting it is left out rather than recorded as failing
+                engines = [e for e in engine_selector.order(host, expected_size) if e != "aria2" or aria2_client]
+                success = False
+                got_html = False
+                last_failure = "no engine available"
                 
-                if not success:
-                    print(f"[Download] curl-cffi failed, trying httpx...", file=sys.stderr)
-                    async with httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=30.0), follow_redirects=True) as client:
-                        async with client.stream("GET", download_url, headers=get_headers()) as response:
-                            if response.status_code != 200:
-                                raise HTTPException(status_code=response.status_code, detail="Download failed")
-                            
-                            content_type = response.headers.get('Content-Type', '')
-                            if 'html' in content_type.lower():
-                                content = await response.aread()
-                                if len(content) < MIN_VALID_FILE_SIZE or is_html_content(content):
-                                    raise HTTPException(status_code=400, detail="Got HTML instead of file")
-                                async with aiofiles.open(file_path, 'wb') as f:
-                                    await f.write(content)
-                            else:
-                                async with aiofiles.open(file_path, 'wb') as f:
-                                    async for chunk in response.aiter_bytes(chunk_size=131072):
-                                        await f.write(chunk)
+                for index, engine in enumerate(engines):
+                    check_budget()
+                    if index > 0:
+                        check_upstream(download_url)
+                        logger.warning("[Download] %s failed, trying %s...", engines[index - 1], engine)
                     
-                    if not validate_downloaded_file(file_path, package_name):
-                        raise HTTPException(status_code=400, detail="Downloaded file is invalid (HTML or too small)")
-                
-                file_size = os.path.getsize(file_path)
-                
-                file_cache[cache_key] = {
-                    'file_path': file_path,
-                    'file_type': file_type,
-                    'size': file_size,
-                    'created_at': time.time()
-                }
-                stats["cached_files"] += 1
-                stats["downloads"] += 1
+                    started = time.time()
+                    success, failure, validator = await DOWNLOAD_ENGINES[engine](download_url, file_path, package_name, progress)
+                    
+                    if not success and validator and validator.error:
+                        logger.warning("[Download] %s rejected: %s", engine, validator.error)
+                    
+                    bytes_done = validator.size if success else 0
+                    engine_selector.record(engine, host, expected_size, success, bytes_done, time.time() - started)
+                    
+                    if success:
+                        break
+                    
+                    last_failure = f"{engine}: {failure}"
+                    if "HTML" in failure:
+                        got_html = True
+                        upstream_limiter.record_throttle(download_url)
+                    await run_quick(remove_file, file_path)
                 
-                deletion_task = asyncio.create_task(schedule_file_deletion(file_path, 30))
-                pending_deletions[cache_key] = deletion_task
+                if not success:
+                    if got_html:
+                        raise HTTPException(status_code=400, detail="Got HTML instead of file")
+                    raise HTTPException(status_code=502, detail=f"Download failed ({last_failure})")
                 
-                print(f"[Download] {package_name}: {file_size / 1024 / 1024:.2f} MB saved to cache", file=sys.stderr)
+                add_to_file_cache(cache_key, package_name, file_path, file_type, validator, engine, version, source)
+                logger.info("[Download] %s: %.2f MB saved to cache", package_name, validator.size / 1024 / 1024)
                 return file_path
                 
+            except asyncio.CancelledError:
+                # The lock and slot are released on the way out; the partial file goes with them
+                await asyncio.shield(run_quick(remove_file, file_path))
+                raise
             except Exception as e:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
+                await run_quick(remove_file, file_path)
                 
                 if retry_count < max_retries and "HTML" in str(e):
-                    print(f"[Download] Got HTML response, clearing cache and retrying ({retry_count + 1}/{max_retries})...", file=sys.stderr)
+                    logger.warning("[Download] Got HTML response, clearing cache and retrying (%s/%s)...",
+                                retry_count + 1, max_retries)
                     if package_name in url_cache:
                         del url_cache[package_name]
                     return None
                 
                 raise e
             finally:
-                stats["active_downloads"] -= 1
+                stats.incr("active_downloads", -1)
 
-async def batch_download_with_aria2(packages: List[Dict[str, Any]]) -> Dict[str, Any]:
-    global aria2_client
-    if not aria2_client:
-        return {"success": False, "error": "aria2 not available", "results": []}
-    
+def download_urls(info: Dict[str, Any]) -> List[str]:
+    """The signed CDN URL while it is still valid, skipping the redirects, then the URL it came from"""
+    if cdn_url_valid(info):
+        return [info['cdn_url'], info['download_url']]
+    return [info['download_url']]
+
+def forget_cdn_url(package_name: str):
+    cached = url_cache.get(package_name)
+    if cached and cached[0].get('cdn_url'):
+        url_cache[package_name] = ({k: v for k, v in cached[0].items() if not k.startswith('cdn_')}, cached[1])
+
+async def download_info_to_cache(package_name: str, info: Dict[str, Any], **kwargs) -> Optional[str]:
+    urls = download_urls(info)
+    for index, url in enumerate(urls):
+        last = index == len(urls) - 1
+        try:
+            file_path = await download_file_to_cache(package_name, url, info.get('file_type', 'apk'),
+                                                     expected_size=info.get('size', 0), version=info.get('version'),
+                                                     source=info.get('source'), **kwargs)
+        except HTTPException as e:
+            # Admission, size and budget answers hold for any URL; only a failed transfer is worth a second try
+            if last or e.status_code not in (400, 502):
+                raise
+            file_path = None
+        if file_path and not last:
+            stats.incr("cdn_url_downloads")
+        if file_path or last:
+            return file_path
+        logger.warning("[Download] %s: CDN URL was refused, following the redirect again", package_name)
+        stats.incr("cdn_url_fallbacks")
+        forget_cdn_url(package_name)
+
+BATCH_TIMEOUT = 600
+BATCH_POLL_INTERVAL = 0.5
+ARIA2_STATUS_KEYS = ["gid", "status", "totalLength", "completedLength", "errorMessage"]
+
+def aria2_multicall(calls: List[Tuple[str, List[Any]]]) -> List[Any]:
+    """Run many aria2 calls in one system.multicall round trip; failed calls come back as exceptions"""
     results = []
-    downloads = []
-    
-    print(f"[aria2 Batch] Starting batch download of {len(packages)} packages...", file=sys.stderr)
+    for item in aria2_client.multicall2(calls):
+        if isinstance(item, dict) and "faultCode" in item:
+            results.append(RuntimeError(item.get("faultString") or "aria2 error"))
+        else:
+            results.append(item[0] if isinstance(item, list) and item else item)
+    return results
+
+async def batch_download_pipeline(packages: List[str]):
+    """
+    Resolve, submit and poll a batch without blocking the event loop, yielding each package's result
+    as soon as it is known. Resolved packages go to aria2 right away, and every submission and status
+    poll is a single multicall round trip run in the executor.
+    """
+    loop = asyncio.get_event_loop()
+    start_time = time.time()
+    last_poll = 0.0
     
-    for pkg in packages:
-        package_name = pkg.get("package_name")
-        download_url = pkg.get("download_url")
-        file_type = pkg.get("file_type", "apk")
-        
-        file_id = generate_user_file_id(package_name)
-        filename = f"{file_id}.{file_type}"
-        file_path = os.path.join(DOWNLOADS_DIR, filename)
-        
+    async def resolve(package_name: str):
+        # The package lock is held until the item finishes, like a single download would hold it
+        held = AsyncExitStack()
         try:
-            options = {
-                "out": filename,
-                "dir": DOWNLOADS_DIR,
-                "max-connection-per-server": "16",
-                "split": "16",
-                "min-split-size": "1M",
-                "header": [
-                    f"User-Agent: {random.choice(USER_AGENTS)}",
-                    "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                    "Accept-Language: en-US,en;q=0.9",
-                    "Referer: https://apkpure.com/",
-                ],
-                "check-certificate": "false",
-                "allow-overwrite": "true",
-                "auto-file-renaming": "false",
-            }
-            
-            download = aria2_client.add_uris([download_url], options=options)
-            downloads.append({
-                "download": download,
-                "package_name": package_name,
-                "file_path": file_path,
-                "file_type": file_type
-            })
-            stats["aria2_downloads"] += 1
-            
-        except Exception as e:
-            print(f"[aria2 Batch] Failed to add {package_name}: {e}", file=sys.stderr)
-            results.append({
-                "package_name": package_name,
-                "success": False,
-                "error": str(e)
-            })
+            await held.enter_async_context(get_download_lock(package_name))
+            cache_key = find_cached_package(package_name)
+            if cache_key:
+                touch_cache_entry(cache_key)
+                await held.aclose()
+                return package_name, file_cache[cache_key], None, True
+            async with info_semaphore:
+                with request_budget(REQUEST_DEADLINE, REQUEST_RETRY_BUDGET, package_name):
+                    return package_name, await get_download_info(package_name), held, False
+        except BaseException as e:
+            await held.aclose()
+            if not isinstance(e, Exception):
+                raise
+            return package_name, e, None, False
     
-    print(f"[aria2 Batch] Added {len(downloads)} downloads to queue", file=sys.stderr)
+    resolving = {asyncio.ensure_future(resolve(pkg)) for pkg in packages}
+    unresolved = set(packages)
+    active: Dict[str, Dict[str, Any]] = {}
     
-    timeout = 600
-    start_time = time.time()
-    completed = set()
+    def failure(package_name: str, error: str) -> Dict[str, Any]:
+        return {"package_name": package_name, "success": False, "error": error}
     
-    while len(completed) < len(downloads):
-        if time.time() - start_time > timeout:
-            print(f"[aria2 Batch] Timeout reached", file=sys.stderr)
-            break
-        
-        for item in downloads:
-            if item["package_name"] in completed:
-                continue
-                
-            try:
-                item["download"].update()
-                
-                if item["download"].is_complete:
-                    file_size = item["download"].total_length
-                    results.append({
-                        "package_name": item["package_name"],
-                        "success": True,
-                        "file_path": item["file_path"],
-                        "file_type": item["file_type"],
-                        "size": file_size
-                    })
-                    completed.add(item["package_name"])
-                    stats["aria2_success"] += 1
-                    print(f"[aria2 Batch] Completed: {item['package_name']} ({file_size / 1024 / 1024:.2f} MB)", file=sys.stderr)
+    async def finish(item: Dict[str, Any]):
+        download_scheduler.unreserve(item["size"])
+        await item["held"].aclose()
+    
+    logger.info("[aria2 Batch] Starting batch download of %s packages...", len(packages))
+    
+    try:
+        while resolving or active:
+            if time.time() - start_time > BATCH_TIMEOUT:
+                logger.warning("[aria2 Batch] Timeout reached")
+                break
+            
+            submissions = []
+            if resolving:
+                done, resolving = await asyncio.wait(
+                    resolving, timeout=BATCH_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    package_name, info, held, cached = task.result()
+                    unresolved.discard(package_name)
+                    if isinstance(info, Exception):
+                        logger.warning("[Batch] Failed to get info for %s: %s", package_name, info)
+                        yield failure(package_name, str(getattr(info, 'detail', info)))
+                        continue
+                    if cached:
+                        stats.incr("cache_hits")
+                        yield {
+                            "package_name": package_name,
+                            "success": True,
+                            "file_path": info["file_path"],
+                            "file_type": info["file_type"],
+                            "size": info["size"],
+                            "sha256": info.get("sha256"),
+                            "cached": True
+                        }
+                        continue
                     
-                elif item["download"].has_failed:
-                    error = item["download"].error_message or "Unknown error"
-                    results.append({
-                        "package_name": item["package_name"],
-                        "success": False,
-                        "error": error
-                    })
-                    completed.add(item["package_name"])
-                    stats["aria2_failed"] += 1
-                    print(f"[aria2 Batch] Failed: {item['package_name']} - {error}", file=sys.stderr)
+                    size = info.get("size", 0)
+                    rejection = f"File too large (limit {MAX_FILE_SIZE_MB} MB)" if is_oversized(size) else None
+                    if not rejection:
+                        try:
+                            check_admission(size)
+                        except HTTPException as e:
+                            rejection = str(e.detail)
+                    if rejection:
+                        await held.aclose()
+                        yield failure(package_name, rejection)
+                        continue
+                    # Counted against free disk space until it finishes, so the next item is checked against the rest
+                    download_scheduler.reserve(size)
                     
+                    file_type = info.get("file_type", "apk")
+                    filename = f"{generate_user_file_id(package_name)}.{file_type}"
+                    submissions.append({
+                        "package_name": package_name,
+                        "download_url": download_urls(info)[0],
+                        "file_path": os.path.join(DOWNLOADS_DIR, filename),
+                        "filename": filename,
+                        "file_type": file_type,
+                        "version": info.get("version"),
+                        "source": info.get("source"),
+                        "size": size,
+                        "held": held
+                    })
+            else:
+                await asyncio.sleep(BATCH_POLL_INTERVAL)
+            
+            if submissions:
+                calls = [("aria2.addUri", [[item["download_url"]], aria2_download_options(item["filename"])])
+                         for item in submissions]
+                try:
+                    gids = await loop.run_in_executor(None, aria2_multicall, calls)
+                except Exception as e:
+                    gids = [e] * len(submissions)
+                
+                for item, gid in zip(submissions, gids):
+                    if isinstance(gid, Exception):
+                        logger.warning("[aria2 Batch] Failed to add %s: %s", item['package_name'], gid)
+                        await finish(item)
+                        yield failure(item["package_name"], str(gid))
+                        continue
+                    active[gid] = item
+                    stats.incr("aria2_downloads")
+                logger.info("[aria2 Batch] Added %s downloads to queue", len(submissions))
+            
+            if not active or time.time() - last_poll < BATCH_POLL_INTERVAL:
+                continue
+            last_poll = time.time()
+            
+            gids = list(active.keys())
+            try:
+                statuses = await loop.run_in_executor(
+                    None, aria2_multicall, [("aria2.tellStatus", [gid, ARIA2_STATUS_KEYS]) for gid in gids]
+                )
             except Exception as e:
-                results.append({
+                logger.warning("[aria2 Batch] Status poll failed: %s", e)
+                continue
+            
+            for gid, status in zip(gids, statuses):
+                item = active[gid]
+                if isinstance(status, Exception):
+                    error = str(status)
+                elif status.get("status") == "complete":
+                    error = None
+                elif status.get("status") in ("error", "removed"):
+                    error = status.get("errorMessage") or "Unknown error"
+                else:
+                    continue
+                del active[gid]
+                
+                if error is None:
+                    validator = await loop.run_in_executor(None, validate_file, item["file_path"])
+                    error = validator.error
+                
+                if error:
+                    stats.incr("aria2_failed")
+                    logger.warning("[aria2 Batch] Failed: %s - %s", item['package_name'], error)
+                    await run_quick(remove_file, item["file_path"])
+                    await finish(item)
+                    yield failure(item["package_name"], error)
+                    continue
+                
+                stats.incr("aria2_success")
+                add_to_file_cache(package_cache_key(item["package_name"], item["version"]), item["package_name"],
+                                  item["file_path"], item["file_type"], validator, "aria2", item["version"],
+                                  item["source"])
+                await finish(item)
+                logger.info("[aria2 Batch] Completed: %s (%.2f MB)", item['package_name'], validator.size / 1024 / 1024)
+                yield {
                     "package_name": item["package_name"],
-                    "success": False,
-                    "error": str(e)
-                })
-                completed.add(item["package_name"])
-                stats["aria2_failed"] += 1
+                    "success": True,
+                    "file_path": item["file_path"],
+                    "file_type": item["file_type"],
+                    "size": validator.size,
+                    "sha256": validator.sha256
+                }
         
-        await asyncio.sleep(0.5)
-    
-    for item in downloads:
-        if item["package_name"] not in completed:
+        for item in active.values():
+            stats.incr("aria2_failed")
+            yield failure(item["package_name"], "Timeout")
+        for package_name in sorted(unresolved):
+            yield failure(package_name, "Timeout")
+    finally:
+        for task in resolving:
+            task.cancel()
+        if active:
+            # Abandoned by a timeout or a client that went away: stop the transfers too
+            calls = [("aria2.forceRemove", [gid]) for gid in active]
             try:
-                item["download"].remove(force=True)
-            except:
-                pass
-            results.append({
-                "package_name": item["package_name"],
-                "success": False,
-                "error": "Timeout"
-            })
-            stats["aria2_failed"] += 1
+                await loop.run_in_executor(None, aria2_multicall, calls)
+            except Exception as e:
+                logger.warning("[aria2 Batch] Removing %s abandoned downloads failed: %s", len(calls), e)
+            for item in active.values():
+                await finish(item)
+
+async def ndjson_lines(results):
+    total = successful = 0
+    async for result in results:
+        total += 1
+        successful += bool(result.get("success"))
+        yield json.dumps(result) + "\n"
+    yield json.dumps({"done": True, "total": total, "successful": successful, "failed": total - successful}) + "\n"
+
+@app.post("/batch-download")
+async def batch_download(packages: List[str], stream: bool = False):
+    if len(packages) > 100:
+        raise HTTPException(status_code=400, detail="Maximum 100 packages per batch")
+    if not aria2_client:
+        return {"success": False, "error": "aria2 not available", "results": []}
+    
+    check_admission(count=len(packages))
+    
+    if stream:
+        # One JSON line per package as it finishes, then a summary line
+        return StreamingResponse(ndjson_lines(batch_download_pipeline(packages)), media_type="application/x-ndjson")
     
+    results = [result async for result in batch_download_pipeline(packages)]
     success_count = len([r for r in results if r.get("success")])
-    print(f"[aria2 Batch] Completed: {success_count}/{len(packages)} successful", file=sys.stderr)
+    logger.info("[aria2 Batch] Completed: %s/%s successful", success_count, len(packages))
     
     return {
         "success": True,
@@ -1215,167 +1561,688 @@ async def batch_download_with_aria2(packages: List[Dict[str, Any]]) -> Dict[str,
         "results": results
     }
 
-@app.post("/batch-download")
-async def batch_download(packages: List[str]) -> Dict[str, Any]:
-    if len(packages) > 100:
-        raise HTTPException(status_code=400, detail="Maximum 100 packages per batch")
-    
-    package_infos = []
-    
-    print(f"[Batch] Fetching info for {len(packages)} packages...", file=sys.stderr)
-    
-    tasks = [get_download_info(pkg) for pkg in packages]
-    infos = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    for pkg, info in zip(packages, infos):
-        if isinstance(info, Exception):
-            print(f"[Batch] Failed to get info for {pkg}: {info}", file=sys.stderr)
-            continue
-        package_infos.append({
-            "package_name": pkg,
-            "download_url": info.get("download_url"),
-            "file_type": info.get("file_type", "apk")
-        })
+APK_MEDIA_TYPE = "application/vnd.android.package-archive"
+
+def serve_cached_file(request: Request, cache_entry: Dict[str, Any], package_name: str, source: str) -> Response:
+    file_type = cache_entry.get('file_type', 'apk')
+    return file_response(
+        request,
+        cache_entry['file_path'],
+        etag=make_etag(cache_entry.get('sha256')),
+        filename=f"{package_name}.{file_type}",
+        media_type=APK_MEDIA_TYPE,
+        headers={
+            "X-Source": source,
+            "X-File-Type": file_type,
+            "X-File-Version": cache_entry.get('version') or '',
+            "X-File-Size": str(cache_entry['size']),
+            "X-Content-SHA256": cache_entry.get('sha256', ''),
+            "Cache-Control": "no-cache"
+        }
+    )
+
+async def download_from_peer(package_name: str, peer: str, user_id: Optional[str] = None,
+                             progress: Optional[Callable[[int, int], None]] = None) -> Optional[Dict[str, Any]]:
+    """Copy a package from the node that owns it instead of going upstream; None if the peer cannot provide it"""
+    async with get_download_lock(package_name):
+        cache_key = find_cached_package(package_name)
+        if cache_key:
+            return file_cache[cache_key]
+        
+        check_admission()
+        file_path = os.path.join(DOWNLOADS_DIR, f"{generate_user_file_id(package_name)}.part")
+        async with download_scheduler.slot(scheduler_user_key(user_id), package_name):
+            stats.incr("active_downloads")
+            try:
+                validator, headers = await cluster.pull(peer, package_name, file_path, progress)
+            finally:
+                stats.incr("active_downloads", -1)
+        
+        if validator.error:
+            logger.warning("[Cluster] Pulling %s from %s failed: %s", package_name, peer, validator.error)
+            await run_quick(remove_file, file_path)
+            return None
+        
+        file_type = headers.get('x-file-type', 'apk')
+        final_path = f"{file_path[:-len('.part')]}.{file_type}"
+        await run_quick(os.replace, file_path, final_path)
+        logger.info("[Cluster] Pulled %s from %s: %.2f MB", package_name, peer, validator.size / 1024 / 1024)
+        version = headers.get('x-file-version') or None
+        return add_to_file_cache(package_cache_key(package_name, version), package_name, final_path,
+                                 file_type, validator, "peer", version, headers.get('x-source') or None)
+
+# Below this, the versions page may have a complete build (the latest is often a small stub)
+MIN_COMPLETE_SIZE_MB = 150
+FUSED_PROFILE = "safari17_0"
+
+def open_fused_get(url: str):
+    """The GET that doubles as the probe: headers are read here, the body only if they are acceptable"""
+    return upstream_limiter.guard(curl_get, url, impersonate=FUSED_PROFILE, timeout=300,
+                                  allow_redirects=True, stream=True)
+
+def stream_fused_body(response, file_path: str, total: int, progress: Optional[Callable[[int, int], None]],
+                      abort: threading.Event) -> StreamValidator:
+    validator = StreamValidator()
+    with open(file_path, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=131072):
+            # The first chunk settles whether this is an archive at all
+            if not validator.feed(chunk) or abort.is_set():
+                return validator
+            f.write(chunk)
+            if progress:
+                progress(validator.size, total)
+            check_budget()
+    validator.finish()
+    return validator
+
+@asynccontextmanager
+async def removing_on_failure(file_path: str):
+    try:
+        yield
+    except BaseException:
+        await asyncio.shield(run_quick(remove_file, file_path))
+        raise
+
+async def fused_fetch(package_name: str, user_id: Optional[str] = None,
+                      progress: Optional[Callable[[int, int], None]] = None
+                      ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Probe and download in one request: GET the XAPK (then APK) URL, decide from the status, headers
+    and first bytes, and keep reading into the cache if it is acceptable. Returns (cache entry, info)
+    when done; (None, info) when the file is better fetched through the normal engines (aria2 is
+    faster for its size, or the versions page has a complete build); (None, None) when neither URL
+    gave a file and the caller should resolve the usual way.
+    """
+    # Only the first call pays for the import, and off the event loop
+    if not (curl_requests.loaded or await run_blocking(bool, curl_requests)):
+        return None, None
+    # The catalog remembers the last size seen, which is enough to pick a scheduler lane
+    expected_size = (app_index.get(package_name) or {}).get("size") or 0
     
-    print(f"[Batch] Got info for {len(package_infos)} packages", file=sys.stderr)
+    async with get_download_lock(package_name):
+        cache_key = find_cached_package(package_name)
+        if cache_key:
+            cached = file_cache[cache_key]
+            return cached, {"source": cached.get("source") or "apkpure", "file_type": cached['file_type']}
+        
+        check_file_size(expected_size)
+        check_admission(expected_size)
+        file_path = os.path.join(DOWNLOADS_DIR, f"{generate_user_file_id(package_name)}.part")
+        
+        async with download_scheduler.slot(scheduler_user_key(user_id), package_name, expected_size), \
+                removing_on_failure(file_path):
+            for requested_type in ("XAPK", "APK"):
+                url = f"https://d.apkpure.com/b/{requested_type}/{package_name}?version=latest"
+                check_budget()
+                check_upstream(url)
+                try:
+                    response = await run_blocking(open_fused_get, url)
+                except (HTTPException, UpstreamUnavailable):
+                    raise
+                except Exception as e:
+                    logger.warning("[Fused] %s: %s GET failed: %s", package_name, requested_type, e)
+                    continue
+                
+                lookup = None
+                abort = threading.Event()
+                try:
+                    content_type = response.headers.get('Content-Type', '')
+                    if is_throttled(response.status_code, response.headers):
+                        # The other URL is behind the same challenge
+                        break
+                    if response.status_code != 200 or 'html' in content_type.lower():
+                        logger.info("[Fused] %s: %s answered %s %s",
+                                    package_name, requested_type, response.status_code, content_type)
+                        continue
+                    
+                    final_url = str(response.url)
+                    size = int(response.headers.get('Content-Length') or 0)
+                    check_file_size(size)
+                    info = {
+                        "source": "apkpure",
+                        "download_url": url,
+                        "size": size,
+                        "file_type": file_type_from_headers(response.headers, final_url),
+                        "detected_from": "fused_get",
+                        **cdn_url_fields(url, final_url)
+                    }
+                    remember_download_info(package_name, info, time.time())
+                    
+                    host = urlparse(final_url).hostname or "unknown"
+                    if aria2_client and size and engine_selector.order_preview(host, size_class(size))[0] == "aria2":
+                        # Headers were all that was needed; aria2's parallel connections win on this file
+                        stats.incr("fused_handoffs")
+                        return None, info
+                    
+                    if size < MIN_COMPLETE_SIZE_MB * 1024 * 1024:
+                        lookup = asyncio.ensure_future(
+                            run_blocking(get_larger_version_from_versions_page, package_name, MIN_COMPLETE_SIZE_MB))
+                        lookup.add_done_callback(
+                            lambda task: not task.cancelled() and not task.exception() and task.result() and abort.set())
+                    
+                    started = time.time()
+                    validator = await run_blocking(stream_fused_body, response, file_path, size, progress, abort)
+                except BaseException:
+                    if lookup:
+                        lookup.cancel()
+                    raise
+                finally:
+                    response.close()
+                
+                if lookup and not lookup.done() and validator.error is None:
+                    # The whole file is in and valid; a slow versions page no longer holds up the answer
+                    lookup.cancel()
+                    lookup = None
+                larger = await lookup if lookup else None
+                if larger:
+                    logger.info("[Fused] %s: versions page has a complete build, fetching that instead", package_name)
+                    await run_quick(remove_file, file_path)
+                    remember_download_info(package_name, larger, time.time())
+                    return None, larger
+                
+                engine_selector.record("curl_cffi", host, size, validator.error is None, validator.size, time.time() - started)
+                if validator.error:
+                    logger.warning("[Fused] %s: %s rejected: %s", package_name, requested_type, validator.error)
+                    await run_quick(remove_file, file_path)
+                    if "HTML" in validator.error:
+                        upstream_limiter.record_throttle(url)
+                    continue
+                
+                final_path = f"{file_path[:-len('.part')]}.{info['file_type']}"
+                await run_quick(os.replace, file_path, final_path)
+                stats.incr("fused_downloads")
+                logger.info("[Fused] %s: %.2f MB in one request", package_name, validator.size / 1024 / 1024)
+                cache_entry = add_to_file_cache(package_cache_key(package_name, info.get('version')), package_name,
+                                                final_path, info['file_type'], validator, "curl_cffi", info.get('version'),
+                                                info.get('source'))
+                return cache_entry, info
     
-    result = await batch_download_with_aria2(package_infos)
-    return result
+    return None, None
 
-@app.get("/download/{package_name}")
-async def download_apk(package_name: str, background_tasks: BackgroundTasks, user_id: Optional[str] = None):
+async def fetch_package_file(package_name: str, user_id: Optional[str] = None,
+                             progress: Optional[Callable[[int, int], None]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Resolve and download a package into the file cache, retrying with a fresh URL; returns (cache entry, info)"""
+    owner = cluster.remote_owner(package_name)
+    if owner:
+        cache_entry = await download_from_peer(package_name, owner, user_id, progress)
+        if cache_entry:
+            return cache_entry, {"source": "peer", "package_name": package_name, "file_type": cache_entry['file_type']}
+    
     max_retries = 3
     last_error = None
     
     for retry in range(max_retries):
         try:
             if retry > 0:
-                print(f"[Download] Retry {retry}/{max_retries} for {package_name}, clearing cache...", file=sys.stderr)
+                check_budget()
+                check_upstream("apkpure.com", "d.apkpure.com")
+                logger.info("[Download] Retry %s/%s for %s, clearing cache...", retry, max_retries, package_name)
                 if package_name in url_cache:
                     del url_cache[package_name]
             
-            info = await get_download_info(package_name)
-            download_url = info['download_url']
-            file_type = info.get('file_type', 'apk')
+            info = None
+            cached = url_cache.get(package_name)
+            if retry == 0 and "apkpure" in source_providers and not (cached and time.time() - cached[1] < URL_CACHE_TTL):
+                # Nothing resolved yet: one GET serves as probe and download, instead of HEADs then a GET
+                cache_entry, info = await fused_fetch(package_name, user_id, progress)
+                if cache_entry:
+                    app_index.add_package(package_name, file_type=cache_entry['file_type'], size=cache_entry['size'])
+                    return cache_entry, info
             
-            file_path = await download_file_to_cache(package_name, download_url, file_type, retry_count=retry)
+            if not info:
+                info = await get_download_info(package_name)
+            file_path = await download_info_to_cache(package_name, info, retry_count=retry,
+                                                     user_id=user_id, progress=progress)
             
             if not file_path or not os.path.exists(file_path):
                 last_error = "Failed to download file"
                 continue
             
-            file_size = os.path.getsize(file_path)
-            if file_size < MIN_VALID_FILE_SIZE:
-                print(f"[Download] File too small ({file_size} bytes), retrying...", file=sys.stderr)
-                try:
-                    os.remove(file_path)
-                except:
-                    pass
-                last_error = f"File too small ({file_size} bytes)"
+            cache_entry = find_cache_entry(file_path)
+            if not cache_entry:
+                last_error = "File left the cache before it could be served"
                 continue
             
-            with open(file_path, 'rb') as f:
-                header = f.read(100)
-            if is_html_content(header + b'\x00' * 900):
-                print(f"[Download] Got HTML content, retrying...", file=sys.stderr)
-                try:
-                    os.remove(file_path)
-                except:
-                    pass
-                last_error = "Got HTML instead of APK"
-                continue
-            
-            filename = f"{package_name}.{file_type}"
-            
-            return FileResponse(
-                path=file_path,
-                filename=filename,
-                media_type="application/vnd.android.package-archive",
-                headers={
-                    "X-Source": str(info.get('source', 'apkpure')),
-                    "X-File-Type": file_type,
-                    "X-File-Size": str(file_size),
-                    "Cache-Control": "no-cache"
-                }
-            )
+            app_index.add_package(package_name, version=info.get('version'),
+                                  file_type=cache_entry['file_type'], size=cache_entry['size'])
+            return cache_entry, info
                 
         except HTTPException:
             raise
         except Exception as e:
             last_error = str(e)
-            print(f"[Error] {package_name} (attempt {retry + 1}): {e}", file=sys.stderr)
+            logger.warning("[Error] %s (attempt %s): %s", package_name, retry + 1, e)
             if retry < max_retries - 1:
                 await asyncio.sleep(1)
     
     raise HTTPException(status_code=500, detail=f"Download failed after {max_retries} attempts: {last_error}")
 
+@app.get("/download/{package_name}")
+async def download_apk(package_name: str, request: Request, user_id: Optional[str] = None):
+    # Resumed and repeated transfers are answered from disk without touching the resolver
+    cache_key = find_cached_package(package_name)
+    if cache_key:
+        touch_cache_entry(cache_key)
+        entry = file_cache[cache_key]
+        return serve_cached_file(request, entry, package_name, str(entry.get('source') or 'apkpure'))
+    
+    forwarded = await cluster.forward(request, package_name)
+    if forwarded:
+        return forwarded
+    
+    fetch = shared_fetches.join(package_name, lambda progress: fetch_package_file(package_name, user_id, progress),
+                                REQUEST_DEADLINE, REQUEST_RETRY_BUDGET)
+    try:
+        cache_entry, info = await shared_fetches.wait(fetch, request.is_disconnected)
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client closed request")
+    return serve_cached_file(request, cache_entry, package_name, str(info.get('source', 'apkpure')))
+
+async def run_download_job(job: DownloadJob):
+    """Background body of a download job; the finished file is kept long enough to be collected"""
+    try:
+        cache_key = find_cached_package(job.package_name)
+        if not cache_key:
+            download_jobs.update(job, status="resolving")
+            # Nobody is waiting on the submitting request, so the job gets its own, longer budget; it holds
+            # the shared fetch until it is cancelled
+            report = download_jobs.progress_callback(job)
+            fetch = shared_fetches.join(
+                job.package_name, lambda progress: fetch_package_file(job.package_name, job.user_id, progress),
+                JOB_DEADLINE, REQUEST_RETRY_BUDGET, progress=report)
+            await shared_fetches.wait(fetch, progress=report)
+            cache_key = find_cached_package(job.package_name)
+            if not cache_key:
+                raise HTTPException(status_code=500, detail="File left the cache before the job finished")
+        
+        cache_entry = file_cache[cache_key]
+        touch_cache_entry(cache_key, JOB_FILE_TTL)
+        download_jobs.update(
+            job,
+            status="done",
+            completed_bytes=cache_entry['size'],
+            total_bytes=cache_entry['size'],
+            file_type=cache_entry.get('file_type'),
+            engine=cache_entry.get('engine'),
+            sha256=cache_entry.get('sha256'),
+            cache_key=cache_key
+        )
+    except asyncio.CancelledError:
+        download_jobs.update(job, status="cancelled")
+    except HTTPException as e:
+        download_jobs.update(job, status="failed", error=str(e.detail))
+    except Exception as e:
+        logger.warning("[Jobs] %s failed: %s", job.package_name, e)
+        download_jobs.update(job, status="failed", error=str(e))
+
+def get_job_or_404(job_id: str) -> DownloadJob:
+    job = download_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+@app.post("/jobs/{package_name}", status_code=202)
+async def submit_download_job(package_name: str, user_id: Optional[str] = None):
+    """Start a download in the background and return its job id at once"""
+    job, created = download_jobs.submit(package_name, user_id, run_download_job)
+    return {
+        "success": True,
+        "created": created,
+        **job.to_dict(),
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+        "file_url": f"/jobs/{job.id}/file"
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_download_job(job_id: str) -> Dict[str, Any]:
+    job = get_job_or_404(job_id)
+    result = job.to_dict()
+    if job.status in ("queued", "resolving", "downloading"):
+        result["queue"] = download_scheduler.user_status(job.user_id) if job.user_id else []
+    return result
+
+@app.get("/jobs/{job_id}/events")
+async def stream_download_job(job_id: str):
+    """Server-sent events with the job's progress until it is done, failed or cancelled"""
+    job = get_job_or_404(job_id)
+    return StreamingResponse(
+        download_jobs.events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/jobs/{job_id}/file")
+async def get_download_job_file(job_id: str, request: Request):
+    job = get_job_or_404(job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}" + (f": {job.error}" if job.error else ""))
+    
+    cache_entry = file_cache.get(job.cache_key or "")
+    if not cache_entry or not is_cached_file_intact(cache_entry):
+        raise HTTPException(status_code=410, detail="File is no longer cached, submit the job again")
+    
+    touch_cache_entry(job.cache_key)
+    return serve_cached_file(request, cache_entry, job.package_name, "job")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_download_job(job_id: str) -> Dict[str, Any]:
+    job = get_job_or_404(job_id)
+    return {"success": download_jobs.cancel(job), **job.to_dict()}
+
 @app.get("/file/{package_name}")
-async def get_cached_file(package_name: str):
+async def get_cached_file(package_name: str, request: Request, user_id: Optional[str] = None):
     try:
         info = await get_download_info(package_name)
-        download_url = info['download_url']
         file_type = info.get('file_type', 'apk')
         
-        file_path = await download_file_to_cache(package_name, download_url, file_type)
+        file_path = await download_info_to_cache(package_name, info, user_id=user_id)
         
         if not file_path or not os.path.exists(file_path):
             raise HTTPException(status_code=500, detail="Failed to get file")
         
-        return {
+        sha256 = find_cache_entry(file_path).get('sha256')
+        etag = make_etag(sha256)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        return JSONResponse({
             "success": True,
             "file_path": file_path,
             "file_type": file_type,
             "size": os.path.getsize(file_path),
+            "sha256": sha256,
+            "etag": etag,
             "package_name": package_name,
             "source": info.get('source')
-        }
+        }, headers={"ETag": etag} if etag else None)
             
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def get_cached_file_entry(package_name: str, user_id: Optional[str] = None) -> str:
+    """Cache key for a package's file, downloading it first if nothing is cached"""
+    cache_key = find_cached_package(package_name)
+    if cache_key:
+        touch_cache_entry(cache_key)
+        return cache_key
+    
+    info = await get_download_info(package_name)
+    file_path = await download_info_to_cache(package_name, info, user_id=user_id)
+    if not file_path or not os.path.exists(file_path):
+        raise HTTPException(status_code=500, detail="Failed to get file")
+    # The entry for the file just written, whatever version key it went under
+    cache_key = next((key for key, _ in file_cache.find('file_path', file_path)), None)
+    if cache_key is None:
+        # Deleted again before we got to it, or the download did not register it
+        raise HTTPException(status_code=503, detail=f"{package_name} left the cache before it could be read; retry")
+    return cache_key
+
+@app.get("/manifest/{package_name}")
+async def get_app_manifest(package_name: str, request: Request, user_id: Optional[str] = None):
+    """Package, version, splits and OBB sizes read from the ZIP central directory of the cached file"""
+    if not find_cached_package(package_name):
+        forwarded = await cluster.forward(request, package_name)
+        if forwarded:
+            return forwarded
+    try:
+        cache_key = await get_cached_file_entry(package_name, user_id)
+        entry = file_cache[cache_key]
+        
+        if 'manifest' not in entry:
+            entry['manifest'] = await asyncio.get_event_loop().run_in_executor(
+                None,
+                read_app_manifest,
+                entry['file_path'],
+                package_name,
+                entry.get('file_type', 'apk')
+            )
+            # Only the new field: a full write-back would undo a concurrent touch of expires_at
+            file_cache.set_field(cache_key, 'manifest', entry['manifest'])
+        
+        return {
+            "success": True,
+            **entry['manifest'],
+            "sha256": entry.get('sha256')
+        }
+    except HTTPException:
+        raise
+    except ZipFormatError as e:
+        raise HTTPException(status_code=422, detail=f"Unreadable archive: {e}")
+    except Exception as e:
+        logger.warning("[Manifest Error] %s: %s", package_name, e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Parsed central directories stay in this process; ZipEntry objects do not go through the shared store
+ZIP_ENTRIES_CACHE_SIZE = 64
+zip_entries_cache: "OrderedDict[str, List[Any]]" = OrderedDict()
+
+@app.get("/member/{package_name}/{member_name:path}")
+async def get_archive_member(package_name: str, member_name: str, request: Request, user_id: Optional[str] = None):
+    """Stream a single split APK or OBB out of a cached XAPK without extracting the archive"""
+    if not find_cached_package(package_name):
+        forwarded = await cluster.forward(request, package_name)
+        if forwarded:
+            return forwarded
+    try:
+        cache_key = await get_cached_file_entry(package_name, user_id)
+        entry = file_cache[cache_key]
+        loop = asyncio.get_event_loop()
+        
+        zip_entries = zip_entries_cache.get(entry['file_path'])
+        if zip_entries is None:
+            zip_entries = await loop.run_in_executor(None, read_central_directory, entry['file_path'])
+            zip_entries_cache[entry['file_path']] = zip_entries
+            while len(zip_entries_cache) > ZIP_ENTRIES_CACHE_SIZE:
+                zip_entries_cache.popitem(last=False)
+        
+        member = next((e for e in zip_entries if e.name == member_name), None)
+        if member is None:
+            raise HTTPException(status_code=404, detail=f"{member_name} not found in {package_name}")
+        
+        # Opened before responding so the 30s cache deletion cannot pull the file out from under the stream
+        f, data_offset = await loop.run_in_executor(None, open_member, entry['file_path'], member)
+        
+        logger.info("[Member] %s/%s: %.2f MB (%s)",
+                    package_name, member_name, member.uncompressed_size / 1024 / 1024, 'stored' if member.method == 0 else 'deflated')
+        
+        media_type = APK_MEDIA_TYPE if member_name.endswith('.apk') else "application/octet-stream"
+        etag = make_etag(entry.get('sha256'), f"{member.crc:08x}")
+        
+        if member.method == 0:
+            # Stored members are a byte range of the archive, so ranges and sendfile apply to them too;
+            # the response reads through the descriptor opened above, not the path
+            fd = os.dup(f.fileno())
+            f.close()
+            return file_response(
+                request,
+                entry['file_path'],
+                etag=etag,
+                filename=os.path.basename(member_name),
+                media_type=media_type,
+                headers={"X-Member-Compression": "stored", "X-Member-CRC32": f"{member.crc:08x}",
+                         "Cache-Control": "no-cache"},
+                base_offset=data_offset,
+                length=member.uncompressed_size,
+                fd=fd
+            )
+        
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            f.close()
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        # The CRC is only known to match once the last byte has gone out; a mismatch then just cuts the
+        # connection, so the expected value is sent up front for clients to check the member against
+        return StreamingResponse(
+            iter_member(f, member, data_offset),
+            media_type=media_type,
+            headers={
+                "Content-Length": str(member.uncompressed_size),
+                "Content-Disposition": f'attachment; filename="{os.path.basename(member_name)}"',
+                "X-Member-Compression": "deflated",
+                "X-Member-CRC32": f"{member.crc:08x}",
+                "Accept-Ranges": "none",
+                **({"ETag": etag} if etag else {}),
+                "Cache-Control": "no-cache"
+            }
+        )
+    except HTTPException:
+        raise
+    except ZipFormatError as e:
+        raise HTTPException(status_code=422, detail=f"Unreadable archive: {e}")
+    except Exception as e:
+        logger.warning("[Member Error] %s/%s: %s", package_name, member_name, e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def delete_cached_files():
+    for filename in os.listdir(DOWNLOADS_DIR):
+        remove_file(os.path.join(DOWNLOADS_DIR, filename))
+
 @app.delete("/cache")
 async def clear_cache():
-    global url_cache, file_cache
     
     for task in pending_deletions.values():
         task.cancel()
     pending_deletions.clear()
     
-    for filename in os.listdir(DOWNLOADS_DIR):
-        try:
-            os.remove(os.path.join(DOWNLOADS_DIR, filename))
-        except:
-            pass
+    await run_quick(delete_cached_files)
     
-    url_cache = {}
-    file_cache = {}
+    url_cache.clear()
+    file_cache.clear()
     
     return {"status": "cache_cleared", "source": "apkpure"}
 
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 600))
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 500))
+
+APP_INDEX_FRESH_FOR = int(os.environ.get("APP_INDEX_FRESH_FOR", 86400))
+APP_INDEX_MAX_APPS = int(os.environ.get("APP_INDEX_MAX_APPS", 50000))
+
+search_cache = SearchCache(ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_SIZE)
+search_client: Optional[APKPureClient] = None
+app_index = AppIndex(os.path.join(DATA_DIR, "app_index.json"), fresh_for=APP_INDEX_FRESH_FOR,
+                     max_apps=APP_INDEX_MAX_APPS, lock=lambda: shared_state.file_lock("app-index"))
+index_refreshes: Dict[str, asyncio.Task] = {}
+
+async def fetch_search_results(query: str, limit: int) -> List[Dict[str, Any]]:
+    global search_client
+    if search_client is None:
+        search_client = APKPureClient()
+    results = await run_blocking(search_client.search, query, limit=limit)
+    app_index.add_results(results)
+    # One transaction for the whole page, off the event loop
+    await run_quick(icon_sources.set_many, {result['appId']: result['icon'] for result in results
+                                            if result.get('icon') and result.get('appId')})
+    return results
+
+def refresh_index_in_background(query: str, limit: int):
+    """Top the index up from upstream without making the caller wait"""
+    key = normalize_query(query)
+    if key in index_refreshes:
+        return
+    
+    async def refresh():
+        try:
+            await search_cache.get_or_fetch(query, limit, fetch_search_results)
+        except Exception as e:
+            logger.warning("[Search] Background refresh of '%s' failed: %s", query, e)
+        finally:
+            index_refreshes.pop(key, None)
+    
+    index_refreshes[key] = asyncio.create_task(refresh())
+
 @app.get("/search/{query}")
-async def search_apps(query: str, limit: int = 20):
-    """Search for apps on APKPure"""
+async def search_apps(query: str, limit: int = 20, refresh: bool = False):
+    """Search for apps, from the local index when it knows enough and APKPure otherwise"""
+    limit = max(1, min(limit, 100))
     try:
-        from apkpure_client import APKPureClient
-        client = APKPureClient(debug=True)
+        local = app_index.search(query, limit)
+        if local.complete and not refresh:
+            if local.stale:
+                refresh_index_in_background(query, limit)
+            return {
+                "success": True,
+                "query": query,
+                "count": len(local.results),
+                "results": with_icon_proxy(local.results),
+                "source": "index",
+                "cached": True
+            }
         
-        results = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: client.search(query, limit=limit)
-        )
+        results, cache_status = await search_cache.get_or_fetch(query, limit, fetch_search_results)
+        results = [{**r, "freshness": "live" if cache_status == "miss" else "cached"} for r in results]
+        
+        # Upstream came back short: fill in with what the index already knows
+        if len(results) < limit:
+            seen = {r['appId'] for r in results}
+            results += [r for r in local.results if r['appId'] not in seen][:limit - len(results)]
         
         return {
             "success": True,
             "query": query,
             "count": len(results),
-            "results": results,
-            "source": "apkpure"
+            "results": with_icon_proxy(results),
+            "source": "apkpure",
+            "cached": cache_status != "miss"
         }
     except Exception as e:
-        print(f"[Search Error] {query}: {e}", file=sys.stderr)
+        logger.warning("[Search Error] %s: %s", query, e)
         raise HTTPException(status_code=500, detail=str(e))
 
+ICON_CACHE_MAX_MB = int(os.environ.get("ICON_CACHE_MAX_MB", 200))
+
+icon_cache = IconCache(os.path.join(DATA_DIR, "icons"), max_bytes=ICON_CACHE_MAX_MB * 1024 * 1024)
+icon_sources = shared_state.dict("icon_sources")
+
+def with_icon_proxy(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Point clients at /icon instead of the upstream image, which they would fetch and resize themselves"""
+    return [{**r, "icon_proxy": f"/icon/{r['appId']}"} if r.get('icon') else r for r in results]
+
+async def fetch_icon(url: str) -> bytes:
+    client = get_client()
+    async with client.stream("GET", url, headers={'User-Agent': random.choice(USER_AGENTS), 'Accept': 'image/*'}) as response:
+        if response.status_code != 200:
+            raise HTTPException(status_code=502, detail=f"Icon source returned HTTP {response.status_code}")
+        if not response.headers.get('content-type', '').startswith('image/'):
+            raise HTTPException(status_code=502, detail="Icon source did not return an image")
+        data = bytearray()
+        async for chunk in response.aiter_bytes():
+            data += chunk
+            if len(data) > MAX_ICON_BYTES:
+                raise HTTPException(status_code=502, detail="Icon is too large")
+        return bytes(data)
+
+@app.get("/icon/{package_name}")
+async def get_icon(request: Request, package_name: str, size: int = 512, format: str = "webp",
+                   src: Optional[str] = None):
+    """App icon resized to one of ICON_SIZES as WebP or JPEG, cached on disk after the first request"""
+    if size not in ICON_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(ICON_SIZES)}")
+    if format not in ICON_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(ICON_FORMATS)}")
+    
+    source = src or icon_sources.get(package_name) or (app_index.get(package_name) or {}).get('icon')
+    if not source:
+        raise HTTPException(status_code=404, detail="No known icon for this package, search for it first or pass src")
+    if not icon_source_allowed(source):
+        raise HTTPException(status_code=400, detail="Icon source host is not allowed")
+    
+    try:
+        path, media_type, st = await icon_cache.get(source, size, format, fetch_icon)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.warning("[Icon] %s: %s: %s", package_name, type(e).__name__, e)
+        raise HTTPException(status_code=502, detail="Icon could not be fetched or resized")
+    
+    etag = make_etag(f"{os.path.basename(path)}-{st.st_size:x}-{int(st.st_mtime):x}")
+    return file_response(request, path, etag=etag, media_type=media_type, length=st.st_size,
+                         headers={"Cache-Control": "public, max-age=604800"})
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info", workers=1)
+    # Per-run state from a previous start points at files that are gone; URLs stay valid for their TTL
+    shared_state.reset("file_cache", "jobs")
+    uvicorn.run(app if API_WORKERS == 1 else "api_server:app", host="0.0.0.0", port=int(os.environ.get("PORT", 8000)),
+                log_level=os.environ.get("LOG_LEVEL", "info").lower(), workers=API_WORKERS)
@@ -5,40 +5,34 @@ Detects the actual file type from APKPure page and downloads the correct version
 With session refresh to prevent HTML responses after long periods
 """
 
+import logging
 import sys
 import os
 import re
 import time
+import threading
 import hashlib
 import random
+from collections import OrderedDict
 from typing import Optional, Dict, Any, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
-try:
-    import cloudscraper
-except ImportError:
-    cloudscraper = None
+from lazy_imports import lazy_import
+from rate_limit import upstream_limiter, is_throttled, UpstreamUnavailable
+from budget import budget_timeout, BudgetExceeded
+from upstream import curl_get, curl_head, cdn_url_fields
+from providers import SourceProvider
+from structured_log import get_logger
 
-try:
-    from bs4 import BeautifulSoup
-except ImportError:
-    BeautifulSoup = None
+logger = get_logger("apkpure_client")
 
-try:
-    from curl_cffi import requests as curl_requests
-except ImportError:
-    curl_requests = None
-
-try:
-    import httpx
-except ImportError:
-    httpx = None
-
-try:
-    import requests as fallback_requests
-except ImportError:
-    fallback_requests = None
+# Imported on first use; each is falsy when the package is not installed
+cloudscraper = lazy_import("cloudscraper")
+BeautifulSoup = lazy_import("bs4", "BeautifulSoup")
+curl_requests = lazy_import("curl_cffi.requests")
+httpx = lazy_import("httpx")
+fallback_requests = lazy_import("requests")
 
 
 class FileType(Enum):
@@ -75,10 +69,59 @@ _session_cache = {
 SESSION_MAX_AGE = 1800
 SESSION_MAX_REQUESTS = 50
 
+LOG_LEVELS = {"INFO": logging.INFO, "WARN": logging.WARNING, "ERROR": logging.ERROR}
+
+
+def file_type_from_headers(headers: Dict[str, str], url: str) -> str:
+    """
+    Detect file type from HTTP headers using Content-Disposition and Content-Type
+    Priority: 1) Content-Disposition filename, 2) URL _fn parameter (base64), 3) URL path, 4) Content-Type
+    """
+    content_disposition = headers.get('Content-Disposition', '')
+    if content_disposition:
+        filename_match = re.search(r'filename[^;=\n]*=(["\']?)([^"\'\n;]+)\1', content_disposition, re.I)
+        if filename_match:
+            filename = filename_match.group(2).lower()
+            if '.xapk' in filename:
+                return "xapk"
+            elif '.apks' in filename:
+                return "apks"
+            elif '.apk' in filename:
+                return "apk"
+
+    fn_match = re.search(r'[?&]_fn=([^&]+)', url)
+    if fn_match:
+        try:
+            import base64
+            encoded_fn = fn_match.group(1)
+            decoded_fn = base64.b64decode(encoded_fn).decode('utf-8', errors='ignore').lower()
+            if '.xapk' in decoded_fn:
+                return "xapk"
+            elif '.apks' in decoded_fn:
+                return "apks"
+            elif '.apk' in decoded_fn:
+                return "apk"
+        except Exception:
+            pass
+
+    url_lower = url.lower()
+    if '/b/xapk/' in url_lower or '.xapk' in url_lower:
+        return "xapk"
+    elif '/b/apk/' in url_lower or '.apk' in url_lower:
+        return "apk"
+
+    content_type = headers.get('Content-Type', '').lower()
+    if 'xapk' in content_type:
+        return "xapk"
 
-class APKPureClient:
+    return "apk"
+
+
+class APKPureClient(SourceProvider):
     """Smart APKPure client that detects file type from page and downloads correctly"""
     
+    name = "apkpure"
+    
     SAFARI_VERSIONS = ["safari15_3", "safari15_5", "safari17_0", "safari17_2", "safari17_2_macos"]
     
     USER_AGENTS = [
@@ -94,15 +137,28 @@ class APKPureClient:
     
     MIN_VALID_SIZE = 100000
     MIN_GAME_SIZE_MB = 150
+    # The resolver keeps one client for the life of the process; only recent redirects are worth keeping
+    MAX_FINAL_URLS = 256
     
-    def __init__(self, debug: bool = True):
+    def __init__(self, debug: bool = False):
         self.debug = debug
         self._scraper = None
         self._last_request_time = 0
+        # Verified URL -> where its redirects ended, so downloads can go straight to the CDN
+        self.final_urls: "OrderedDict[str, str]" = OrderedDict()
+        self._final_urls_lock = threading.Lock()
     
-    def log(self, message: str, level: str = "INFO"):
-        if self.debug:
-            print(f"[APKPure {level}] {message}", file=sys.stderr)
+    def _remember_final_url(self, url: str, final_url: str):
+        with self._final_urls_lock:
+            self.final_urls[url] = final_url
+            self.final_urls.move_to_end(url)
+            while len(self.final_urls) > self.MAX_FINAL_URLS:
+                self.final_urls.popitem(last=False)
+    
+    def log(self, message: str, *args, level: str = "INFO"):
+        """Lazily formatted; detection steps are debug-level output unless this client was made with debug=True"""
+        levelno = logging.DEBUG if level == "INFO" and not self.debug else LOG_LEVELS[level]
+        logger.log(levelno, "[APKPure Client] " + message, *args)
     
     def _needs_session_refresh(self) -> bool:
         """Check if session needs to be refreshed to prevent HTML responses"""
@@ -114,11 +170,12 @@ class APKPureClient:
         
         age = now - _session_cache['created_at']
         if age > SESSION_MAX_AGE:
-            self.log(f"Session expired (age: {age:.0f}s > {SESSION_MAX_AGE}s)", "WARN")
+            self.log("Session expired (age: %.0fs > %ss)", age, SESSION_MAX_AGE, level="WARN")
             return True
         
         if _session_cache['request_count'] > SESSION_MAX_REQUESTS:
-            self.log(f"Session request limit reached ({_session_cache['request_count']} > {SESSION_MAX_REQUESTS})", "WARN")
+            self.log("Session request limit reached (%s > %s)",
+                     _session_cache['request_count'], SESSION_MAX_REQUESTS, level="WARN")
             return True
         
         return False
@@ -170,20 +227,34 @@ class APKPureClient:
         
         for attempt in range(max_retries):
             if self.scraper:
+                # Raises UpstreamUnavailable while the host's circuit is open, BudgetExceeded once the request is out of time
+                upstream_limiter.acquire_blocking(url)
+                if 'timeout' in kwargs:
+                    kwargs['timeout'] = budget_timeout(kwargs['timeout'])
                 try:
                     response = self.scraper.get(url, **kwargs)
                     
+                    content_type = response.headers.get('Content-Type', '').lower()
+                    text = response.text if 'html' in content_type and not kwargs.get('stream') else None
+                    if upstream_limiter.record(url, response.status_code, response.headers, text):
+                        # Retrying with a fresh session is exactly the extra traffic a throttling host punishes
+                        self.log("Throttled by upstream (HTTP %s), not retrying", response.status_code, level="WARN")
+                        return None
+                    
                     if response and response.status_code == 200:
-                        content_type = response.headers.get('Content-Type', '').lower()
                         if 'html' in content_type and len(response.text) < 50000:
                             if 'download' in url.lower() or 'd.apkpure.com' in url.lower():
-                                self.log(f"Got HTML instead of file on attempt {attempt + 1}, refreshing session...", "WARN")
+                                self.log("Got HTML instead of file on attempt %s, refreshing session...",
+                                         attempt + 1, level="WARN")
                                 self._refresh_session()
                                 continue
                     
                     return response
+                except (BudgetExceeded, UpstreamUnavailable):
+                    raise
                 except Exception as e:
-                    self.log(f"Scraper GET failed (attempt {attempt + 1}): {e}", "WARN")
+                    upstream_limiter.record_failure(url)
+                    self.log("Scraper GET failed (attempt %s): %s", attempt + 1, e, level="WARN")
                     if attempt < max_retries - 1:
                         self._refresh_session()
         
@@ -195,19 +266,29 @@ class APKPureClient:
         
         for attempt in range(max_retries):
             if self.scraper:
+                upstream_limiter.acquire_blocking(url)
+                if 'timeout' in kwargs:
+                    kwargs['timeout'] = budget_timeout(kwargs['timeout'])
                 try:
                     response = self.scraper.head(url, **kwargs)
                     
+                    if upstream_limiter.record(url, response.status_code, response.headers):
+                        self.log("Throttled by upstream (HTTP %s), not retrying", response.status_code, level="WARN")
+                        return None
+                    
                     if response and response.status_code == 200:
                         content_type = response.headers.get('Content-Type', '').lower()
                         if 'html' in content_type:
-                            self.log(f"Got HTML content-type on HEAD, refreshing session...", "WARN")
+                            self.log("Got HTML content-type on HEAD, refreshing session...", level="WARN")
                             self._refresh_session()
                             continue
                     
                     return response
+                except (BudgetExceeded, UpstreamUnavailable):
+                    raise
                 except Exception as e:
-                    self.log(f"Scraper HEAD failed (attempt {attempt + 1}): {e}", "WARN")
+                    upstream_limiter.record_failure(url)
+                    self.log("Scraper HEAD failed (attempt %s): %s", attempt + 1, e, level="WARN")
                     if attempt < max_retries - 1:
                         self._refresh_session()
         
@@ -232,18 +313,18 @@ class APKPureClient:
         """
         try:
             if not BeautifulSoup:
-                self.log("BeautifulSoup not available for search", "ERROR")
+                self.log("BeautifulSoup not available for search", level="ERROR")
                 return []
             
             import urllib.parse
             encoded_query = urllib.parse.quote(query)
             search_url = f"{self.BASE_URL}/search?q={encoded_query}"
             
-            self.log(f"Searching APKPure: {query}")
+            self.log("Searching APKPure: %s", query)
             response = self._safe_get(search_url, timeout=30)
             
             if not response or response.status_code != 200:
-                self.log(f"Search failed: {response.status_code if response else 'No response'}", "WARN")
+                self.log("Search failed: %s", response.status_code if response else 'No response', level="WARN")
                 return []
             
             soup = BeautifulSoup(response.text, 'html.parser')
@@ -329,7 +410,7 @@ class APKPureClient:
                             if score_match:
                                 try:
                                     score = float(score_match.group(1))
-                                except:
+                                except Exception:
                                     pass
                     
                     results.append({
@@ -342,14 +423,18 @@ class APKPureClient:
                         'source': 'apkpure'
                     })
                     
+                except (BudgetExceeded, UpstreamUnavailable):
+                    raise
                 except Exception as e:
                     continue
             
-            self.log(f"Found {len(results)} apps for '{query}'")
+            self.log("Found %s apps for '%s'", len(results), query)
             return results
             
+        except (BudgetExceeded, UpstreamUnavailable):
+            raise
         except Exception as e:
-            self.log(f"Search error: {e}", "ERROR")
+            self.log("Search error: %s", e, level="ERROR")
             return []
     
     def get_app_slug(self, package_name: str) -> str:
@@ -378,12 +463,14 @@ class APKPureClient:
                     if len(parts) >= 2 and parts[-1] == package_name:
                         slug = parts[-2]
                         if slug and slug != package_name and not slug.startswith('http'):
-                            self.log(f"Found slug: {slug} for {package_name}")
+                            self.log("Found slug: %s for %s", slug, package_name)
                             return slug
             
             return package_name
+        except (BudgetExceeded, UpstreamUnavailable):
+            raise
         except Exception as e:
-            self.log(f"Slug lookup failed: {e}", "WARN")
+            self.log("Slug lookup failed: %s", e, level="WARN")
             return package_name
     
     def detect_file_type_from_page(self, package_name: str) -> DetectionResult:
@@ -398,12 +485,12 @@ class APKPureClient:
             slug = self.get_app_slug(package_name)
             app_url = f"{self.BASE_URL}/{slug}/{package_name}"
             
-            self.log(f"Detecting file type from: {app_url}")
+            self.log("Detecting file type from: %s", app_url)
             response = self._safe_get(app_url, timeout=30)
             
             if not response or response.status_code != 200:
                 status = response.status_code if response else "No response"
-                self.log(f"Page not accessible: {status}", "WARN")
+                self.log("Page not accessible: %s", status, level="WARN")
                 return DetectionResult(FileType.UNKNOWN, 0.0, "error", "Page not accessible")
             
             soup = BeautifulSoup(response.text, 'html.parser')
@@ -414,27 +501,27 @@ class APKPureClient:
                 data_type = str(download_btn.get('data-dt-file-type', '')).lower()
                 if data_type:
                     if 'xapk' in data_type:
-                        self.log(f"Detected XAPK from button data-dt-file-type attribute")
+                        self.log("Detected XAPK from button data-dt-file-type attribute")
                         return DetectionResult(FileType.XAPK, 1.0, "button_data_attr", f"data-dt-file-type={data_type}")
                     elif 'apk' in data_type:
-                        self.log(f"Detected APK from button data-dt-file-type attribute")
+                        self.log("Detected APK from button data-dt-file-type attribute")
                         return DetectionResult(FileType.APK, 1.0, "button_data_attr", f"data-dt-file-type={data_type}")
                 
                 btn_text = download_btn.get_text().lower().strip()
                 if 'xapk' in btn_text:
-                    self.log(f"Detected XAPK from button text: {btn_text}")
+                    self.log("Detected XAPK from button text: %s", btn_text)
                     return DetectionResult(FileType.XAPK, 0.95, "button_text", btn_text)
                 elif 'apk' in btn_text and 'xapk' not in btn_text:
-                    self.log(f"Detected APK from button text: {btn_text}")
+                    self.log("Detected APK from button text: %s", btn_text)
                     return DetectionResult(FileType.APK, 0.95, "button_text", btn_text)
             
             for span in soup.find_all('span', class_=re.compile(r'file.?type|ftype|info-sdk', re.I)):
                 span_text = span.get_text().lower().strip()
                 if 'xapk' in span_text:
-                    self.log(f"Detected XAPK from file-type span: {span_text}")
+                    self.log("Detected XAPK from file-type span: %s", span_text)
                     return DetectionResult(FileType.XAPK, 0.9, "file_type_span", span_text)
                 elif 'apk' in span_text and 'xapk' not in span_text:
-                    self.log(f"Detected APK from file-type span: {span_text}")
+                    self.log("Detected APK from file-type span: %s", span_text)
                     return DetectionResult(FileType.APK, 0.9, "file_type_span", span_text)
             
             skip_patterns = ['how to install', 'install xapk', 'what is xapk', 'xapk installer', 
@@ -446,7 +533,7 @@ class APKPureClient:
                     if any(skip in text for skip in skip_patterns):
                         continue
                     if re.search(r'\bxapk\b', text) and not re.search(r'\bapk\b(?!\s*/)', text):
-                        self.log(f"Detected XAPK from metadata: {text[:50]}")
+                        self.log("Detected XAPK from metadata: %s", text[:50])
                         return DetectionResult(FileType.XAPK, 0.85, "metadata", text[:50])
             
             download_href = ""
@@ -458,60 +545,20 @@ class APKPureClient:
             
             if download_href:
                 if 'xapk' in download_href.lower():
-                    self.log(f"Detected XAPK from download href")
+                    self.log("Detected XAPK from download href")
                     return DetectionResult(FileType.XAPK, 0.85, "download_href", download_href)
             
-            self.log(f"Could not determine type from page, will probe URLs")
+            self.log("Could not determine type from page, will probe URLs")
             return DetectionResult(FileType.UNKNOWN, 0.0, "none", "No clear signals found")
             
+        except (BudgetExceeded, UpstreamUnavailable):
+            raise
         except Exception as e:
-            self.log(f"Detection error: {e}", "ERROR")
+            self.log("Detection error: %s", e, level="ERROR")
             return DetectionResult(FileType.UNKNOWN, 0.0, "error", str(e))
     
     def _detect_file_type_from_headers(self, headers: Dict[str, str], url: str) -> str:
-        """
-        Detect file type from HTTP headers using Content-Disposition and Content-Type
-        Priority: 1) Content-Disposition filename, 2) URL _fn parameter (base64), 3) URL path, 4) Content-Type
-        """
-        content_disposition = headers.get('Content-Disposition', '')
-        if content_disposition:
-            filename_match = re.search(r'filename[^;=\n]*=(["\']?)([^"\'\n;]+)\1', content_disposition, re.I)
-            if filename_match:
-                filename = filename_match.group(2).lower()
-                if '.xapk' in filename:
-                    return "xapk"
-                elif '.apks' in filename:
-                    return "apks"
-                elif '.apk' in filename:
-                    return "apk"
-        
-        fn_match = re.search(r'[?&]_fn=([^&]+)', url)
-        if fn_match:
-            try:
-                import base64
-                encoded_fn = fn_match.group(1)
-                decoded_fn = base64.b64decode(encoded_fn).decode('utf-8', errors='ignore').lower()
-                self.log(f"Decoded filename from URL: {decoded_fn}")
-                if '.xapk' in decoded_fn:
-                    return "xapk"
-                elif '.apks' in decoded_fn:
-                    return "apks"
-                elif '.apk' in decoded_fn:
-                    return "apk"
-            except Exception:
-                pass
-        
-        url_lower = url.lower()
-        if '/b/xapk/' in url_lower or '.xapk' in url_lower:
-            return "xapk"
-        elif '/b/apk/' in url_lower or '.apk' in url_lower:
-            return "apk"
-        
-        content_type = headers.get('Content-Type', '').lower()
-        if 'xapk' in content_type:
-            return "xapk"
-        
-        return "apk"
+        return file_type_from_headers(headers, url)
     
     def verify_download_url(self, url: str) -> Tuple[bool, int, str]:
         """
@@ -523,12 +570,16 @@ class APKPureClient:
             if curl_requests:
                 for safari_ver in self.SAFARI_VERSIONS:
                     try:
-                        response = curl_requests.head(
+                        response = upstream_limiter.guard(
+                            curl_head,
                             url,
                             impersonate=safari_ver,
                             timeout=30,
                             allow_redirects=True
                         )
+                        if is_throttled(response.status_code, response.headers):
+                            # Another browser profile will not get past a challenge, it only adds load
+                            return False, 0, "unknown"
                         if response.status_code == 200:
                             content_type = response.headers.get('Content-Type', '')
                             content_length = int(response.headers.get('Content-Length', 0))
@@ -536,8 +587,12 @@ class APKPureClient:
                             if 'html' not in content_type.lower() and content_length > self.MIN_VALID_SIZE:
                                 final_url = str(response.url) if hasattr(response, 'url') else url
                                 file_type = self._detect_file_type_from_headers(dict(response.headers), final_url)
+                                self._remember_final_url(url, final_url)
                                 return True, content_length, file_type
-                    except:
+                    except (BudgetExceeded, UpstreamUnavailable):
+                        # Out of time, or the host shut us out: no other URL or profile will fare better
+                        raise
+                    except Exception:
                         continue
             
             response = self._safe_head(url, timeout=30, allow_redirects=True)
@@ -548,14 +603,32 @@ class APKPureClient:
                 if 'html' not in content_type.lower() and content_length > self.MIN_VALID_SIZE:
                     final_url = str(response.url) if hasattr(response, 'url') else url
                     file_type = self._detect_file_type_from_headers(dict(response.headers), final_url)
+                    self._remember_final_url(url, final_url)
                     return True, content_length, file_type
             
             return False, 0, "unknown"
             
+        except (BudgetExceeded, UpstreamUnavailable):
+            raise
         except Exception as e:
-            self.log(f"URL verification failed: {e}", "WARN")
+            self.log("URL verification failed: %s", e, level="WARN")
             return False, 0, "unknown"
     
+    def resolve(self, package_name: str) -> Optional[Dict[str, Any]]:
+        """Download info as a dictionary, for the provider interface"""
+        info = self.get_download_info(package_name)
+        if not info:
+            return None
+        return {
+            "source": info.source,
+            "download_url": info.download_url,
+            "size": info.size,
+            "file_type": info.file_type,
+            "version": info.version,
+            "detected_from": info.detected_from,
+            **cdn_url_fields(info.download_url, self.final_urls.get(info.download_url))
+        }
+    
     def get_download_info(self, package_name: str, prefer_complete: bool = True) -> Optional[DownloadInfo]:
         """
         Smart download info retrieval:
@@ -567,7 +640,7 @@ class APKPureClient:
         detection = self.detect_file_type_from_page(package_name)
         
         if detection.file_type == FileType.UNKNOWN or detection.confidence < 0.8:
-            self.log(f"Low confidence detection ({detection.confidence:.2f}), probing both types...")
+            self.log("Low confidence detection (%.2f), probing both types...", detection.confidence)
             return self._probe_both_types_and_pick_best(package_name, prefer_complete)
         
         if detection.file_type == FileType.XAPK:
@@ -582,10 +655,10 @@ class APKPureClient:
         
         if is_valid:
             size_mb = size / (1024 * 1024)
-            self.log(f"Found {primary_type}: {size_mb:.1f} MB")
+            self.log("Found %s: %.1f MB", primary_type, size_mb)
             
             if prefer_complete and size_mb < self.MIN_GAME_SIZE_MB:
-                self.log(f"Size seems small ({size_mb:.1f} MB), checking for complete version...")
+                self.log("Size seems small (%.1f MB), checking for complete version...", size_mb)
                 larger = self._find_larger_version(package_name, self.MIN_GAME_SIZE_MB)
                 if larger:
                     return larger
@@ -602,7 +675,7 @@ class APKPureClient:
         
         if is_valid:
             size_mb = size / (1024 * 1024)
-            self.log(f"Fallback to {fallback_type}: {size_mb:.1f} MB")
+            self.log("Fallback to %s: %.1f MB", fallback_type, size_mb)
             
             if prefer_complete and size_mb < self.MIN_GAME_SIZE_MB:
                 larger = self._find_larger_version(package_name, self.MIN_GAME_SIZE_MB)
@@ -620,7 +693,7 @@ class APKPureClient:
         if resolved:
             return resolved
         
-        self.log(f"All methods failed for {package_name}", "ERROR")
+        self.log("All methods failed for %s", package_name, level="ERROR")
         return None
     
     def _probe_both_types_and_pick_best(self, package_name: str, prefer_complete: bool = True) -> Optional[DownloadInfo]:
@@ -636,7 +709,7 @@ class APKPureClient:
             
             if is_valid and size > self.MIN_VALID_SIZE:
                 size_mb = size / (1024 * 1024)
-                self.log(f"Probed {file_type}: {size_mb:.1f} MB (valid)")
+                self.log("Probed %s: %.1f MB (valid)", file_type, size_mb)
                 results.append({
                     "url": url,
                     "file_type": detected_type,
@@ -644,7 +717,7 @@ class APKPureClient:
                     "type_requested": file_type
                 })
             else:
-                self.log(f"Probed {file_type}: invalid or too small")
+                self.log("Probed %s: invalid or too small", file_type)
         
         if not results:
             resolved = self._resolve_from_download_page(package_name)
@@ -657,10 +730,10 @@ class APKPureClient:
         
         actual_file_type = best["file_type"]
         
-        self.log(f"Best option: {best['type_requested']} with {size_mb:.1f} MB")
+        self.log("Best option: %s with %.1f MB", best['type_requested'], size_mb)
         
         if prefer_complete and size_mb < self.MIN_GAME_SIZE_MB:
-            self.log(f"Size seems small ({size_mb:.1f} MB), checking for complete version...")
+            self.log("Size seems small (%.1f MB), checking for complete version...", size_mb)
             larger = self._find_larger_version(package_name, self.MIN_GAME_SIZE_MB)
             if larger:
                 return larger
@@ -681,7 +754,7 @@ class APKPureClient:
             slug = self.get_app_slug(package_name)
             versions_url = f"{self.BASE_URL}/{slug}/{package_name}/versions"
             
-            self.log(f"Searching versions page for larger version...")
+            self.log("Searching versions page for larger version...")
             response = self._safe_get(versions_url, timeout=30)
             
             if not response or response.status_code != 200:
@@ -718,7 +791,7 @@ class APKPureClient:
                                     if download_url.startswith('http'):
                                         is_valid, size, detected_type = self.verify_download_url(download_url)
                                         if is_valid and size > min_size_mb * 1024 * 1024:
-                                            self.log(f"Found larger version {version}: {size / (1024*1024):.1f} MB")
+                                            self.log("Found larger version %s: %.1f MB", version, size / (1024*1024))
                                             return DownloadInfo(
                                                 download_url=download_url,
                                                 file_type=detected_type,
@@ -729,8 +802,10 @@ class APKPureClient:
             
             return None
             
+        except (BudgetExceeded, UpstreamUnavailable):
+            raise
         except Exception as e:
-            self.log(f"Version search failed: {e}", "WARN")
+            self.log("Version search failed: %s", e, level="WARN")
             return None
     
     def _resolve_from_download_page(self, package_name: str) -> Optional[DownloadInfo]:
@@ -742,7 +817,7 @@ class APKPureClient:
             slug = self.get_app_slug(package_name)
             download_page_url = f"{self.BASE_URL}/{slug}/{package_name}/download"
             
-            self.log(f"Resolving from download page: {download_page_url}")
+            self.log("Resolving from download page: %s", download_page_url)
             response = self._safe_get(download_page_url, timeout=30)
             
             if not response or response.status_code != 200:
@@ -805,8 +880,10 @@ class APKPureClient:
             
             return None
             
+        except (BudgetExceeded, UpstreamUnavailable):
+            raise
         except Exception as e:
-            self.log(f"Download page resolution failed: {e}", "WARN")
+            self.log("Download page resolution failed: %s", e, level="WARN")
             return None
     
     def download_file(self, package_name: str, output_dir: str = None) -> Optional[str]:
@@ -814,7 +891,7 @@ class APKPureClient:
         info = self.get_download_info(package_name)
         
         if not info:
-            self.log(f"Could not get download info for {package_name}", "ERROR")
+            self.log("Could not get download info for %s", package_name, level="ERROR")
             return None
         
         if output_dir is None:
@@ -824,13 +901,13 @@ class APKPureClient:
         filename = f"{package_name}.{info.file_type}"
         file_path = os.path.join(output_dir, filename)
         
-        self.log(f"Downloading {info.file_type.upper()} ({info.size / (1024*1024):.1f} MB) to {file_path}")
+        self.log("Downloading %s (%.1f MB) to %s", info.file_type.upper(), info.size / (1024*1024), file_path)
         
         try:
             if curl_requests:
                 for safari_ver in self.SAFARI_VERSIONS:
                     try:
-                        response = curl_requests.get(
+                        response = curl_get(
                             info.download_url,
                             impersonate=safari_ver,
                             timeout=600,
@@ -844,10 +921,12 @@ class APKPureClient:
                                     f.write(response.content)
                                 
                                 actual_size = os.path.getsize(file_path)
-                                self.log(f"Downloaded successfully: {actual_size / (1024*1024):.2f} MB")
+                                self.log("Downloaded successfully: %.2f MB", actual_size / (1024*1024))
                                 return file_path
+                    except (BudgetExceeded, UpstreamUnavailable):
+                        raise
                     except Exception as e:
-                        self.log(f"curl-cffi {safari_ver} failed: {e}", "WARN")
+                        self.log("curl-cffi %s failed: %s", safari_ver, e, level="WARN")
                         continue
             
             if self.scraper:
@@ -860,34 +939,24 @@ class APKPureClient:
                                 f.write(chunk)
                     
                     actual_size = os.path.getsize(file_path)
-                    self.log(f"Downloaded successfully: {actual_size / (1024*1024):.2f} MB")
+                    self.log("Downloaded successfully: %.2f MB", actual_size / (1024*1024))
                     return file_path
             
             return None
             
+        except (BudgetExceeded, UpstreamUnavailable):
+            raise
         except Exception as e:
-            self.log(f"Download failed: {e}", "ERROR")
+            self.log("Download failed: %s", e, level="ERROR")
             return None
 
 
-def get_smart_download_info(package_name: str, debug: bool = True) -> Optional[Dict[str, Any]]:
+def get_smart_download_info(package_name: str, debug: bool = False) -> Optional[Dict[str, Any]]:
     """
     Convenience function to get download info as a dictionary
     This is the main entry point for other modules
     """
-    client = APKPureClient(debug=debug)
-    info = client.get_download_info(package_name)
-    
-    if info:
-        return {
-            "source": info.source,
-            "download_url": info.download_url,
-            "size": info.size,
-            "file_type": info.file_type,
-            "version": info.version,
-            "detected_from": info.detected_from
-        }
-    return None
+    return APKPureClient(debug=debug).resolve(package_name)
 
 
 if __name__ == "__main__":
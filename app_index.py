@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Local app index - every app seen in search results or downloads is kept in an inverted index with
+prefix and typo-tolerant token matching, persisted to JSON so common searches never leave the process
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Optional, Dict, Any, List, Set, Tuple, Callable, Iterable
+
+from search_cache import normalize_query
+from structured_log import get_logger
+
+logger = get_logger("app_index")
+
+RESULT_FIELDS = ("appId", "title", "developer", "icon", "score", "url", "source")
+
+# Package name segments that say nothing about the app
+GENERIC_SEGMENTS = {"com", "org", "net", "io", "app", "apps", "android", "mobile", "free", "co", "www"}
+
+# Field weights: a title hit ranks above a package segment, which ranks above the developer
+TITLE, PACKAGE, DEVELOPER = 3.0, 2.0, 1.0
+EXACT, PREFIX, FUZZY = 1.0, 0.7, 0.4
+
+
+def max_edits(token: str) -> int:
+    """Typos tolerated for a token: none for short words, one up to 7 letters, two beyond"""
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+def deletions(token: str, depth: int) -> Set[str]:
+    """The token and every string made by deleting up to `depth` characters from it"""
+    variants = {token}
+    frontier = {token}
+    for _ in range(depth):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up with limit + 1 as soon as it is exceeded"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def tokenize(text: str) -> List[str]:
+    return normalize_query(text or "").split()
+
+
+def document_tokens(record: Dict[str, Any]) -> Dict[str, float]:
+    """token -> field weight for everything searchable in a record"""
+    tokens: Dict[str, float] = {}
+
+    def add(words: Iterable[str], weight: float):
+        for word in words:
+            if weight > tokens.get(word, 0):
+                tokens[word] = weight
+
+    app_id = record["appId"].lower()
+    add(tokenize(record.get("developer", "")), DEVELOPER)
+    add([app_id], PACKAGE)
+    add([part for part in app_id.replace("_", ".").split(".") if part and part not in GENERIC_SEGMENTS], PACKAGE)
+    add(tokenize(record.get("title", "")), TITLE)
+    return tokens
+
+
+class IndexResult:
+    """Matches for one query; `complete` means enough strong (exact or prefix) matches to skip upstream"""
+
+    def __init__(self, results: List[Dict[str, Any]], strong: int, limit: int, stale: bool):
+        self.results = results
+        self.strong = strong
+        self.complete = strong >= limit
+        self.stale = stale
+
+
+class AppIndex:
+    """In-process inverted index of known apps, merged with the JSON file other workers write"""
+
+    def __init__(self, path: str, fresh_for: float = 86400.0, max_apps: int = 50000,
+                 lock: Optional[Callable[[], Any]] = None):
+        self.path = path
+        self.fresh_for = fresh_for
+        self.max_apps = max_apps
+        self._file_lock = lock or nullcontext
+        self._lock = threading.RLock()
+        self._apps: Dict[str, Dict[str, Any]] = {}
+        self._doc_tokens: Dict[str, Dict[str, float]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._sorted_tokens: List[str] = []
+        self._variants: Dict[str, Set[str]] = {}
+        self._dirty = False
+        self.lookups = 0
+        self.answered = 0
+
+    def __len__(self) -> int:
+        return len(self._apps)
+
+    def __contains__(self, app_id: str) -> bool:
+        return app_id in self._apps
+
+    def get(self, app_id: str) -> Optional[Dict[str, Any]]:
+        return self._apps.get(app_id)
+
+    # --- maintenance -------------------------------------------------------
+
+    def _index_token(self, token: str, app_id: str):
+        posting = self._postings.get(token)
+        if posting is None:
+            posting = self._postings[token] = set()
+            bisect.insort(self._sorted_tokens, token)
+            variants = self._variants
+            for variant in deletions(token, max_edits(token)):
+                if variant in variants:
+                    variants[variant].add(token)
+                else:
+                    variants[variant] = {token}
+        posting.add(app_id)
+
+    def _unindex_token(self, token: str, app_id: str):
+        posting = self._postings.get(token)
+        if posting is None:
+            return
+        posting.discard(app_id)
+        if posting:
+            return
+        del self._postings[token]
+        index = bisect.bisect_left(self._sorted_tokens, token)
+        if index < len(self._sorted_tokens) and self._sorted_tokens[index] == token:
+            del self._sorted_tokens[index]
+        for variant in deletions(token, max_edits(token)):
+            tokens = self._variants.get(variant)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._variants[variant]
+
+    def _put(self, record: Dict[str, Any]):
+        app_id = record["appId"]
+        new_tokens = document_tokens(record)
+        old_tokens = self._doc_tokens.get(app_id, {})
+        for token in old_tokens.keys() - new_tokens.keys():
+            self._unindex_token(token, app_id)
+        for token in new_tokens.keys() - old_tokens.keys():
+            self._index_token(token, app_id)
+        self._apps[app_id] = record
+        self._doc_tokens[app_id] = new_tokens
+
+    def _remove(self, app_id: str):
+        for token in self._doc_tokens.pop(app_id, {}):
+            self._unindex_token(token, app_id)
+        self._apps.pop(app_id, None)
+
+    def _evict(self):
+        if len(self._apps) <= self.max_apps:
+            return
+        oldest = sorted(self._apps.values(), key=lambda r: r.get("indexed_at", 0))
+        for record in oldest[:len(self._apps) - self.max_apps]:
+            self._remove(record["appId"])
+
+    def add_results(self, results: List[Dict[str, Any]]):
+        """Record apps from an upstream search; their details replace what was known"""
+        now = time.time()
+        with self._lock:
+            for result in results:
+                if not result.get("appId"):
+                    continue
+                previous = self._apps.get(result["appId"], {})
+                record = {**previous, **{k: result.get(k) for k in RESULT_FIELDS if k in result}}
+                record["indexed_at"] = now
+                self._put(record)
+            self._evict()
+            self._dirty = True
+
+    def add_package(self, package_name: str, downloaded: bool = True, **details):
+        """Record an app seen through a download or resolution, keeping whatever search already said about it"""
+        now = time.time()
+        with self._lock:
+            record = dict(self._apps.get(package_name) or {"appId": package_name, "indexed_at": now})
+            record.update({k: v for k, v in details.items() if v})
+            if downloaded:
+                record["downloads"] = record.get("downloads", 0) + 1
+                record["downloaded_at"] = now
+            self._put(record)
+            self._evict()
+            self._dirty = True
+
+    # --- lookup ------------------------------------------------------------
+
+    def _matches(self, query_token: str) -> Dict[str, float]:
+        """Index token -> match quality for one query token"""
+        found: Dict[str, float] = {}
+        if query_token in self._postings:
+            found[query_token] = EXACT
+        if len(query_token) >= 2:
+            index = bisect.bisect_left(self._sorted_tokens, query_token)
+            while index < len(self._sorted_tokens) and self._sorted_tokens[index].startswith(query_token):
+                found.setdefault(self._sorted_tokens[index], PREFIX)
+                index += 1
+        edits = max_edits(query_token)
+        if edits:
+            for variant in deletions(query_token, edits):
+                for token in self._variants.get(variant, ()):
+                    if token not in found and edit_distance(query_token, token, edits) <= edits:
+                        found[token] = FUZZY
+        return found
+
+    def search(self, query: str, limit: int = 20) -> IndexResult:
+        """Apps matching every query token, best first, tagged with how fresh their details are"""
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        self.lookups += 1
+        if not query_tokens:
+            return IndexResult([], 0, limit, False)
+
+        with self._lock:
+            scores: Optional[Dict[str, float]] = None
+            weakest: Dict[str, float] = {}
+            for query_token in query_tokens:
+                token_scores: Dict[str, Tuple[float, float]] = {}
+                for token, quality in self._matches(query_token).items():
+                    for app_id in self._postings[token]:
+                        score = quality * self._doc_tokens[app_id][token]
+                        if score > token_scores.get(app_id, (0.0, 0.0))[0]:
+                            token_scores[app_id] = (score, quality)
+                if scores is None:
+                    scores = {app_id: s for app_id, (s, _) in token_scores.items()}
+                else:
+                    scores = {app_id: scores[app_id] + s for app_id, (s, _) in token_scores.items() if app_id in scores}
+                for app_id, (_, quality) in token_scores.items():
+                    weakest[app_id] = min(weakest.get(app_id, EXACT), quality)
+                if not scores:
+                    break
+
+            ranked = sorted(
+                scores or {},
+                key=lambda app_id: (-scores[app_id], -(self._apps[app_id].get("downloads") or 0),
+                                    -(self._apps[app_id].get("score") or 0)),
+            )[:limit]
+            now = time.time()
+            results = []
+            stale = False
+            for app_id in ranked:
+                record = self._apps[app_id]
+                age = now - record.get("indexed_at", 0)
+                stale = stale or age > self.fresh_for
+                result = {k: record.get(k) for k in RESULT_FIELDS}
+                result["title"] = result["title"] or app_id
+                result["source"] = result["source"] or "apkpure"
+                result["freshness"] = "stale" if age > self.fresh_for else "fresh"
+                result["indexed_at"] = record.get("indexed_at")
+                results.append(result)
+            strong = sum(1 for app_id in ranked if weakest.get(app_id, 0) >= PREFIX)
+
+        if strong >= limit:
+            self.answered += 1
+        return IndexResult(results, strong, limit, stale)
+
+    # --- persistence -------------------------------------------------------
+
+    def _read_file(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.path) as f:
+                return json.load(f).get("apps", [])
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.warning("[AppIndex] Ignoring unreadable %s: %s", self.path, e)
+            return []
+
+    def _merge(self, records: List[Dict[str, Any]]) -> int:
+        merged = 0
+        for record in records:
+            app_id = record.get("appId")
+            if not app_id:
+                continue
+            current = self._apps.get(app_id)
+            if current is None or record.get("indexed_at", 0) > current.get("indexed_at", 0):
+                if current:
+                    record = {**record, "downloads": max(record.get("downloads", 0), current.get("downloads", 0))}
+                self._put(record)
+                merged += 1
+        return merged
+
+    def load(self) -> int:
+        with self._file_lock():
+            records = self._read_file()
+        merged = 0
+        # In batches, so searches are not held up while a large index is rebuilt
+        for start in range(0, len(records), 500):
+            with self._lock:
+                merged += self._merge(records[start:start + 500])
+        with self._lock:
+            self._evict()
+        logger.info("[AppIndex] Loaded %s apps from %s", merged, self.path)
+        return merged
+
+    def save(self, force: bool = False) -> bool:
+        """Merge with the file on disk (other workers add to it too) and write it back atomically"""
+        if not (self._dirty or force):
+            return False
+        with self._file_lock():
+            records = self._read_file()
+            with self._lock:
+                self._merge(records)
+                self._evict()
+                snapshot = list(self._apps.values())
+                self._dirty = False
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": 1, "saved_at": time.time(), "apps": snapshot}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "apps": len(self._apps),
+            "tokens": len(self._postings),
+            "lookups": self.lookups,
+            "answered_locally": self.answered,
+            "fresh_for": self.fresh_for,
+        }
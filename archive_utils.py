@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+ZIP/APK archive helpers - inline validation and hashing of download streams,
+and reading XAPK metadata straight from the ZIP central directory
+"""
+
+import hashlib
+import json
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List
+
+ZIP_LOCAL_HEADER = b'PK\x03\x04'
+ZIP_EOCD_SIGNATURE = b'PK\x05\x06'
+ZIP_EOCD_SIZE = 22
+# The EOCD record is followed by at most a 64 KiB comment
+ZIP_EOCD_SEARCH = ZIP_EOCD_SIZE + 0xFFFF
+ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+ZIP64_EOCD_SIGNATURE = b'PK\x06\x06'
+ZIP_CENTRAL_SIGNATURE = b'PK\x01\x02'
+ZIP_LOCAL_HEADER_SIZE = 30
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+MAX_MANIFEST_SIZE = 4 * 1024 * 1024
+
+HEAD_SNIFF_SIZE = 1024
+MIN_VALID_FILE_SIZE = 500000
+
+
+def sniff_html(data: bytes) -> bool:
+    text = data[:HEAD_SNIFF_SIZE].decode('utf-8', errors='ignore').lower()
+    return '<html' in text or '<!doctype' in text or '<head' in text
+
+
+class StreamValidator:
+    """
+    Validates an APK/XAPK while it streams to disk:
+    ZIP magic and HTML sniffing on the first bytes, SHA-256 as bytes arrive,
+    and the ZIP end-of-central-directory record at completion
+    """
+
+    def __init__(self, min_size: int = MIN_VALID_FILE_SIZE):
+        self.min_size = min_size
+        self.size = 0
+        self.error: Optional[str] = None
+        self._sha256 = hashlib.sha256()
+        self._head = b''
+        self._head_checked = False
+        self._tail = bytearray()
+
+    def _check_head(self):
+        if self._head.startswith(ZIP_LOCAL_HEADER):
+            self._head_checked = True
+        elif sniff_html(self._head):
+            self.error = "Got HTML instead of file"
+        elif len(self._head) >= len(ZIP_LOCAL_HEADER):
+            self.error = f"Not a ZIP archive (starts with {self._head[:4]!r})"
+
+    def feed(self, chunk: bytes) -> bool:
+        """Consume the next chunk; returns False as soon as the stream is known to be bad"""
+        if self.error:
+            return False
+        if not self._head_checked:
+            self._head += chunk[:HEAD_SNIFF_SIZE - len(self._head)]
+            self._check_head()
+            if self.error:
+                return False
+
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+
+        self._tail += chunk
+        if len(self._tail) > 2 * ZIP_EOCD_SEARCH:
+            del self._tail[:-ZIP_EOCD_SEARCH]
+        return True
+
+    def finish(self) -> bool:
+        """Final checks once the stream ended; sets error and returns False if the file is unusable"""
+        if self.error:
+            return False
+        if not self._head_checked:
+            self.error = "Got HTML instead of file" if sniff_html(self._head) else "Empty or truncated response"
+        elif self.size < self.min_size:
+            self.error = f"File too small ({self.size} bytes)"
+        elif self._find_eocd() < 0:
+            self.error = "Truncated ZIP (no end-of-central-directory record)"
+        return self.error is None
+
+    def _find_eocd(self) -> int:
+        tail = bytes(self._tail[-ZIP_EOCD_SEARCH:])
+        position = tail.rfind(ZIP_EOCD_SIGNATURE)
+        while position >= 0:
+            # The comment length must account exactly for the bytes after the record
+            if position + ZIP_EOCD_SIZE <= len(tail):
+                comment_length = int.from_bytes(tail[position + 20:position + 22], 'little')
+                if position + ZIP_EOCD_SIZE + comment_length == len(tail):
+                    return position
+            position = tail.rfind(ZIP_EOCD_SIGNATURE, 0, position)
+        return -1
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+
+def validate_file(file_path: str, chunk_size: int = 1024 * 1024) -> StreamValidator:
+    """Run a file written by an external downloader (aria2) through the same validator, in one pass"""
+    validator = StreamValidator()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk or not validator.feed(chunk):
+                break
+    validator.finish()
+    return validator
+
+
+class ZipFormatError(Exception):
+    pass
+
+
+@dataclass
+class ZipEntry:
+    name: str
+    method: int
+    compressed_size: int
+    uncompressed_size: int
+    header_offset: int
+    crc: int
+
+
+def _locate_central_directory(f, file_size: int):
+    """Returns (offset, size, entry_count) of the central directory, handling ZIP64"""
+    search = min(file_size, ZIP_EOCD_SEARCH)
+    f.seek(file_size - search)
+    tail = f.read(search)
+    position = tail.rfind(ZIP_EOCD_SIGNATURE)
+    if position < 0:
+        raise ZipFormatError("No end-of-central-directory record")
+
+    (_, _, _, _, entries, cd_size, cd_offset, _) = struct.unpack('<4sHHHHIIH', tail[position:position + ZIP_EOCD_SIZE])
+
+    if entries == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        locator_pos = position - 20
+        if locator_pos < 0 or tail[locator_pos:locator_pos + 4] != ZIP64_LOCATOR_SIGNATURE:
+            raise ZipFormatError("ZIP64 locator missing")
+        zip64_eocd_offset = struct.unpack('<Q', tail[locator_pos + 8:locator_pos + 16])[0]
+        f.seek(zip64_eocd_offset)
+        record = f.read(56)
+        if record[:4] != ZIP64_EOCD_SIGNATURE:
+            raise ZipFormatError("ZIP64 end-of-central-directory record missing")
+        entries, cd_size, cd_offset = struct.unpack('<QQQ', record[32:56])
+
+    return cd_offset, cd_size, entries
+
+
+def read_central_directory(file_path: str) -> List[ZipEntry]:
+    """Read the entry table of a ZIP without touching any member data"""
+    with open(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        cd_offset, cd_size, entry_count = _locate_central_directory(f, file_size)
+        f.seek(cd_offset)
+        directory = f.read(cd_size)
+
+    entries = []
+    position = 0
+    for _ in range(entry_count):
+        if directory[position:position + 4] != ZIP_CENTRAL_SIGNATURE:
+            raise ZipFormatError(f"Bad central directory entry at offset {cd_offset + position}")
+        (flags, method, crc, compressed, uncompressed,
+         name_len, extra_len, comment_len, header_offset) = struct.unpack(
+            '<8xHH4xIIIHHH8xI', directory[position:position + 46])
+        name_bytes = directory[position + 46:position + 46 + name_len]
+        extra = directory[position + 46 + name_len:position + 46 + name_len + extra_len]
+        name = name_bytes.decode('utf-8' if flags & 0x800 else 'cp437', errors='replace')
+
+        if 0xFFFFFFFF in (compressed, uncompressed, header_offset):
+            uncompressed, compressed, header_offset = _apply_zip64_extra(extra, uncompressed, compressed, header_offset)
+
+        entries.append(ZipEntry(name, method, compressed, uncompressed, header_offset, crc))
+        position += 46 + name_len + extra_len + comment_len
+
+    return entries
+
+
+def _apply_zip64_extra(extra: bytes, uncompressed: int, compressed: int, header_offset: int):
+    position = 0
+    while position + 4 <= len(extra):
+        tag, size = struct.unpack('<HH', extra[position:position + 4])
+        if tag == 0x0001:
+            values = extra[position + 4:position + 4 + size]
+            index = 0
+            # Only the fields that overflowed are present, in this fixed order
+            if uncompressed == 0xFFFFFFFF:
+                uncompressed = struct.unpack('<Q', values[index:index + 8])[0]
+                index += 8
+            if compressed == 0xFFFFFFFF:
+                compressed = struct.unpack('<Q', values[index:index + 8])[0]
+                index += 8
+            if header_offset == 0xFFFFFFFF:
+                header_offset = struct.unpack('<Q', values[index:index + 8])[0]
+            break
+        position += 4 + size
+    return uncompressed, compressed, header_offset
+
+
+def entry_data_offset(f, entry: ZipEntry) -> int:
+    """Offset of a member's data, past its local header (whose extra field may differ from the central one)"""
+    f.seek(entry.header_offset)
+    header = f.read(ZIP_LOCAL_HEADER_SIZE)
+    if header[:4] != ZIP_LOCAL_HEADER:
+        raise ZipFormatError(f"Bad local header for {entry.name}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    return entry.header_offset + ZIP_LOCAL_HEADER_SIZE + name_len + extra_len
+
+
+def read_entry(file_path: str, entry: ZipEntry, max_size: int = MAX_MANIFEST_SIZE) -> bytes:
+    """Read one small member into memory; only meant for metadata like manifest.json"""
+    if entry.uncompressed_size > max_size:
+        raise ZipFormatError(f"{entry.name} is too large to read ({entry.uncompressed_size} bytes)")
+    with open(file_path, 'rb') as f:
+        f.seek(entry_data_offset(f, entry))
+        data = f.read(entry.compressed_size)
+    if entry.method == ZIP_STORED:
+        return data
+    if entry.method == ZIP_DEFLATED:
+        return zlib.decompress(data, -15)
+    raise ZipFormatError(f"Unsupported compression method {entry.method} for {entry.name}")
+
+
+def iter_member(f, entry: ZipEntry, data_offset: int, chunk_size: int = 256 * 1024):
+    """
+    Yield one member's uncompressed bytes from an open archive
+    Stored members are a plain byte range of the archive; deflated ones go through a streaming decompressor
+    """
+    try:
+        f.seek(data_offset)
+        remaining = entry.compressed_size
+        decompressor = zlib.decompressobj(-15) if entry.method == ZIP_DEFLATED else None
+        crc = 0
+
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                raise ZipFormatError(f"Archive ended inside {entry.name}")
+            remaining -= len(chunk)
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            if chunk:
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+
+        if decompressor:
+            chunk = decompressor.flush()
+            if chunk:
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+
+        if crc != entry.crc:
+            raise ZipFormatError(f"CRC mismatch for {entry.name}")
+    finally:
+        f.close()
+
+
+def open_member(file_path: str, entry: ZipEntry):
+    """Open the archive positioned for streaming a member; returns (file, data_offset)"""
+    if entry.method not in (ZIP_STORED, ZIP_DEFLATED):
+        raise ZipFormatError(f"Unsupported compression method {entry.method} for {entry.name}")
+    f = open(file_path, 'rb')
+    try:
+        return f, entry_data_offset(f, entry)
+    except Exception:
+        f.close()
+        raise
+
+
+def read_app_manifest(file_path: str, package_name: str, file_type: str) -> Dict[str, Any]:
+    """
+    Package metadata for an APK/XAPK/APKS, built from the central directory plus manifest.json
+    Split and OBB sizes come from the directory, so nothing is extracted
+    """
+    entries = read_central_directory(file_path)
+    by_name = {e.name: e for e in entries}
+    archive_size = os.path.getsize(file_path)
+
+    manifest: Dict[str, Any] = {}
+    if 'manifest.json' in by_name:
+        try:
+            manifest = json.loads(read_entry(file_path, by_name['manifest.json']).decode('utf-8-sig'))
+        except (ValueError, ZipFormatError):
+            manifest = {}
+
+    splits = []
+    obbs = []
+
+    if file_type == 'apk' and 'AndroidManifest.xml' in by_name:
+        splits.append({"id": "base", "file": os.path.basename(file_path), "size": archive_size})
+    else:
+        listed = manifest.get('split_apks') or []
+        if listed:
+            for split in listed:
+                entry = by_name.get(split.get('file', ''))
+                splits.append({
+                    "id": split.get('id'),
+                    "file": split.get('file'),
+                    "size": entry.uncompressed_size if entry else None,
+                    "compressed_size": entry.compressed_size if entry else None,
+                })
+        else:
+            for entry in entries:
+                if entry.name.endswith('.apk') and '/' not in entry.name:
+                    splits.append({
+                        "id": entry.name[:-4],
+                        "file": entry.name,
+                        "size": entry.uncompressed_size,
+                        "compressed_size": entry.compressed_size,
+                    })
+
+        expansions = {e.get('file'): e for e in manifest.get('expansions') or []}
+        for entry in entries:
+            if entry.name.lower().endswith('.obb'):
+                expansion = expansions.get(entry.name, {})
+                obbs.append({
+                    "file": entry.name,
+                    "install_path": expansion.get('install_path', entry.name),
+                    "size": entry.uncompressed_size,
+                })
+
+    total_installed = sum(s["size"] or 0 for s in splits) + sum(o["size"] for o in obbs)
+
+    return {
+        "package_name": manifest.get('package_name', package_name),
+        "name": manifest.get('name'),
+        "version_name": manifest.get('version_name'),
+        "version_code": manifest.get('version_code'),
+        "min_sdk_version": manifest.get('min_sdk_version'),
+        "target_sdk_version": manifest.get('target_sdk_version'),
+        "file_type": file_type,
+        "archive_size": archive_size,
+        "entries": len(entries),
+        "has_manifest": bool(manifest),
+        "splits": splits,
+        "obbs": obbs,
+        "obb_size": sum(o["size"] for o in obbs),
+        "total_installed_size": total_installed,
+    }
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark - measures import time and time until /health/live and /health/ready answer
+Usage: python3 benchmark_startup.py [--runs 5] [--max-ready 1.5]
+Exits non-zero when the median time to ready exceeds --max-ready, so it can guard against regressions
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time() -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import api_server"], cwd=HERE, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def wait_for(url: str, started: float, timeout: float) -> float:
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except Exception:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f"{url} did not answer within {timeout}s")
+
+
+def measure_once(timeout: float) -> dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, PORT=str(port),
+                   APP_CACHE_DIR=os.path.join(scratch, "app_cache"), DATA_DIR=os.path.join(scratch, "data"))
+        os.makedirs(env["APP_CACHE_DIR"])
+        started = time.perf_counter()
+        server = subprocess.Popen([sys.executable, "api_server.py"], cwd=HERE, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            live = wait_for(f"http://127.0.0.1:{port}/health/live", started, timeout)
+            ready = wait_for(f"http://127.0.0.1:{port}/health/ready", started, timeout)
+            return {"live": live, "ready": ready}
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-ready", type=float, default=None,
+                        help="fail when the median seconds to /health/ready exceed this")
+    args = parser.parse_args()
+
+    imports = [import_time() for _ in range(args.runs)]
+    runs = [measure_once(args.timeout) for _ in range(args.runs)]
+    live = [r["live"] for r in runs]
+    ready = [r["ready"] for r in runs]
+
+    print(f"import api_server   median {statistics.median(imports):.3f}s  min {min(imports):.3f}s")
+    print(f"/health/live        median {statistics.median(live):.3f}s  min {min(live):.3f}s")
+    print(f"/health/ready       median {statistics.median(ready):.3f}s  min {min(ready):.3f}s")
+
+    if args.max_ready is not None and statistics.median(ready) > args.max_ready:
+        print(f"FAIL: median time to ready {statistics.median(ready):.3f}s > {args.max_ready}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
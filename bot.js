@@ -985,6 +985,42 @@ function formatSearchResults(results) {
     return text;
 }
 
+async function getIconSticker(appId, iconUrl) {
+    // The API keeps a resized 512px WebP of every icon, so it is fetched and encoded once for all users
+    const API_URL = process.env.API_URL || 'http://localhost:8000';
+    try {
+        const { statusCode, body } = await request(`${API_URL}/icon/${appId}?size=512&format=webp&src=${encodeURIComponent(iconUrl)}`, {
+            method: 'GET',
+            headersTimeout: 10000,
+            bodyTimeout: 10000
+        });
+        if (statusCode === 200) {
+            return Buffer.from(await body.arrayBuffer());
+        }
+        await body.dump();
+    } catch (error) {
+        console.log('⚠️ أيقونة API ما خدماتش:', error.message);
+    }
+
+    const { statusCode, body } = await request(iconUrl, {
+        method: 'GET',
+        headersTimeout: 10000,
+        bodyTimeout: 10000
+    });
+    if (statusCode !== 200) {
+        await body.dump();
+        return null;
+    }
+    const iconData = Buffer.from(await body.arrayBuffer());
+    return await sharp(iconData)
+        .resize(512, 512, {
+            fit: 'contain',
+            background: { r: 255, g: 255, b: 255, alpha: 0 }
+        })
+        .webp()
+        .toBuffer();
+}
+
 async function handleZArchiverDownload(sock, remoteJid, userId, senderPhone, msg, session) {
     session.isDownloading = true;
     startDownloadTracking(senderPhone);
@@ -1001,20 +1037,8 @@ async function handleZArchiverDownload(sock, remoteJid, userId, senderPhone, msg
         // إرسال الأيقونة كاستيكر
         if (appDetails.icon) {
             try {
-                const { statusCode, body } = await request(appDetails.icon, {
-                    method: 'GET',
-                    headersTimeout: 10000,
-                    bodyTimeout: 10000
-                });
-                if (statusCode === 200) {
-                    const iconData = Buffer.from(await body.arrayBuffer());
-                    const stickerBuffer = await sharp(iconData)
-                        .resize(512, 512, {
-                            fit: 'contain',
-                            background: { r: 255, g: 255, b: 255, alpha: 0 }
-                        })
-                        .webp()
-                        .toBuffer();
+                const stickerBuffer = await getIconSticker(ZARCHIVER_PACKAGE, appDetails.icon);
+                if (stickerBuffer) {
                     await sendBotMessage(sock, remoteJid, {
                         sticker: stickerBuffer
                     }, msg);
@@ -1032,7 +1056,8 @@ async function handleZArchiverDownload(sock, remoteJid, userId, senderPhone, msg
         console.log(`📥 كننزّل ZArchiver كـ APK...`);
 
         // استخدام endpoint مخصص يفرض APK
-        const { statusCode, headers, body } = await request(`${API_URL}/download/${ZARCHIVER_PACKAGE}`, {
+        const userQuery = senderPhone ? `?user_id=${encodeURIComponent(senderPhone)}` : '';
+        const { statusCode, headers, body } = await request(`${API_URL}/download/${ZARCHIVER_PACKAGE}${userQuery}`, {
             method: 'GET',
             headersTimeout: 600000,
             bodyTimeout: 600000
@@ -1099,7 +1124,7 @@ async function handleZArchiverDownload(sock, remoteJid, userId, senderPhone, msg
     }
 }
 
-async function downloadAPKWithAxios(packageName, appTitle) {
+async function downloadAPKWithAxios(packageName, appTitle, senderPhone) {
     const API_URL = process.env.API_URL || 'http://localhost:8000';
 
     console.log(`📥 كننزّل باستعمال Axios (سريع)...`);
@@ -1112,6 +1137,8 @@ async function downloadAPKWithAxios(packageName, appTitle) {
             const response = await axios({
                 method: 'GET',
                 url: `${API_URL}/download/${packageName}`,
+                // المستعمل كيتحسب بوحدو فالطابور باش ما يحبسش الآخرين
+                params: senderPhone ? { user_id: senderPhone } : undefined,
                 responseType: 'arraybuffer',
                 timeout: 600000,
                 maxContentLength: MAX_FILE_SIZE,
@@ -1941,20 +1968,8 @@ async function handleAppDownload(sock, remoteJid, userId, senderPhone, msg, appI
 
         if (appDetails.icon) {
             try {
-                const { statusCode, body } = await request(appDetails.icon, {
-                    method: 'GET',
-                    headersTimeout: 10000,
-                    bodyTimeout: 10000
-                });
-                if (statusCode === 200) {
-                    const iconData = Buffer.from(await body.arrayBuffer());
-                    const stickerBuffer = await sharp(iconData)
-                        .resize(512, 512, {
-                            fit: 'contain',
-                            background: { r: 255, g: 255, b: 255, alpha: 0 }
-                        })
-                        .webp()
-                        .toBuffer();
+                const stickerBuffer = await getIconSticker(appId, appDetails.icon);
+                if (stickerBuffer) {
                     await sendBotMessage(sock, remoteJid, {
                         sticker: stickerBuffer
                     }, msg);
@@ -1966,7 +1981,7 @@ async function handleAppDownload(sock, remoteJid, userId, senderPhone, msg, appI
 
         await sock.sendMessage(remoteJid, { react: { text: '📥', key: msg.key } });
 
-        const apkStream = await downloadAPKWithAxios(appDetails.appId, appDetails.title);
+        const apkStream = await downloadAPKWithAxios(appDetails.appId, appDetails.title, senderPhone);
 
         if (apkStream) {
             if (apkStream.size > MAX_FILE_SIZE) {
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Request budgets - one deadline and one allowance of upstream attempts per request, carried in a
+context variable so every retry loop (endpoint, engine fallback, browser profiles, session retries)
+draws from the same pool and the request fails fast once it is spent
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any
+
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class BudgetExceeded(HTTPException):
+    """The request ran out of time or attempts; surfaces as 504 with the reason"""
+
+    def __init__(self, reason: str):
+        super().__init__(status_code=504, detail=f"Gave up: {reason}")
+        self.reason = reason
+
+
+class RequestBudget:
+    def __init__(self, deadline: float, attempts: int, label: str = ""):
+        self.started = time.monotonic()
+        self.seconds = deadline
+        self.deadline = self.started + deadline
+        self.attempts = attempts
+        self.used = 0
+        self.label = label
+        self.last_stage = ""
+        self.exhausted: Optional[str] = None
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def check(self):
+        """Raise if the budget is spent; once spent it stays spent, so swallowed errors still fail fast"""
+        if self.exhausted is None and self.remaining() <= 0:
+            self.exhausted = f"deadline of {self.seconds:.0f}s passed" + (
+                f" during {self.last_stage}" if self.last_stage else "")
+        if self.exhausted:
+            raise BudgetExceeded(self.exhausted)
+
+    def spend(self, stage: str):
+        """Account for one upstream attempt"""
+        self.check()
+        if self.used >= self.attempts:
+            self.exhausted = f"all {self.attempts} upstream attempts used (last: {self.last_stage or stage})"
+            raise BudgetExceeded(self.exhausted)
+        self.used += 1
+        self.last_stage = stage
+
+    def cancel(self, reason: str):
+        """Spend whatever is left, so work still running in worker threads stops at its next check"""
+        if self.exhausted is None:
+            self.exhausted = reason
+
+    def timeout(self, default: Optional[float]) -> Optional[float]:
+        """A per-call timeout that cannot outlive the request"""
+        self.check()
+        remaining = max(0.1, self.remaining())
+        return remaining if default is None else min(default, remaining)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "elapsed": round(time.monotonic() - self.started, 2),
+            "remaining": round(self.remaining(), 2),
+            "attempts_used": self.used,
+            "attempts": self.attempts,
+            "exhausted": self.exhausted,
+        }
+
+
+_current: contextvars.ContextVar[Optional[RequestBudget]] = contextvars.ContextVar("request_budget", default=None)
+
+
+def current_budget() -> Optional[RequestBudget]:
+    return _current.get()
+
+
+def spend(stage: str):
+    budget = _current.get()
+    if budget:
+        budget.spend(stage)
+
+
+def check_budget():
+    budget = _current.get()
+    if budget:
+        budget.check()
+
+
+def budget_timeout(default: Optional[float]) -> Optional[float]:
+    budget = _current.get()
+    return budget.timeout(default) if budget else default
+
+
+def budget_exhausted() -> bool:
+    budget = _current.get()
+    return bool(budget and (budget.exhausted or budget.remaining() <= 0))
+
+
+@contextmanager
+def request_budget(deadline: float, attempts: int, label: str = "", inherit: bool = True):
+    """
+    A fresh budget for the enclosed work, never outliving the one it is nested in unless `inherit` is
+    False (background work that merely started inside a request)
+    """
+    parent = _current.get()
+    if parent and inherit:
+        deadline = max(0.0, min(deadline, parent.remaining()))
+    budget = RequestBudget(deadline, attempts, label)
+    token = _current.set(budget)
+    try:
+        yield budget
+    finally:
+        _current.reset(token)
+
+
+class BudgetMiddleware:
+    """Gives every HTTP request its own budget; tasks the handler starts inherit it"""
+
+    def __init__(self, app: ASGIApp, deadline: float, attempts: int):
+        self.app = app
+        self.deadline = deadline
+        self.attempts = attempts
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with request_budget(self.deadline, self.attempts, f"{scope['method']} {scope['path']}"):
+            await self.app(scope, receive, send)
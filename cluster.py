@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Cluster mode - every package is owned by one node on a consistent-hash ring built from a static
+peer list; other nodes forward requests to the owner or pull its cached file instead of going upstream
+"""
+
+import bisect
+import hashlib
+import os
+import time
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+import aiofiles
+import httpx
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse, RedirectResponse
+
+from archive_utils import StreamValidator
+from structured_log import get_logger
+
+logger = get_logger("cluster")
+
+FORWARDED_HEADER = "X-Cluster-Forwarded"
+
+# Conditional and range headers must reach the owner so 206/304 answers still work through a proxy
+FORWARD_REQUEST_HEADERS = ("range", "if-range", "if-none-match", "accept", "user-agent")
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade",
+}
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+def normalize_node(url: str) -> str:
+    url = url.strip().rstrip("/")
+    if url and "://" not in url:
+        url = f"http://{url}"
+    return url
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes, so adding a node only moves about 1/N of the packages"""
+
+    def __init__(self, nodes: List[str], vnodes: int = 64):
+        self.nodes = sorted(set(nodes))
+        self._ring: List[Tuple[int, str]] = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes)
+        )
+        self._keys = [point for point, _ in self._ring]
+
+    def owners(self, key: str) -> List[str]:
+        """Every node in ring order starting from the key's owner, for fallback"""
+        if not self._ring:
+            return []
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._ring)
+        result: List[str] = []
+        for offset in range(len(self._ring)):
+            node = self._ring[(index + offset) % len(self._ring)][1]
+            if node not in result:
+                result.append(node)
+                if len(result) == len(self.nodes):
+                    break
+        return result
+
+    def owner(self, key: str) -> Optional[str]:
+        owners = self.owners(key)
+        return owners[0] if owners else None
+
+
+class Cluster:
+    """Membership, ownership and peer health for a static list of API nodes"""
+
+    def __init__(self, self_url: str, peers: List[str], redirect: bool = False,
+                 retry_down_after: float = 30.0, vnodes: int = 64):
+        self.self_url = normalize_node(self_url)
+        nodes = [normalize_node(p) for p in peers if p.strip()]
+        if self.self_url and self.self_url not in nodes:
+            nodes.append(self.self_url)
+        self.enabled = bool(self.self_url) and len(nodes) > 1
+        self.ring = HashRing(nodes, vnodes)
+        self.redirect = redirect
+        self.retry_down_after = retry_down_after
+        self._down_until: Dict[str, float] = {}
+        self.forwarded = 0
+        self.pulled = 0
+        self.fallbacks = 0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def from_env(cls) -> "Cluster":
+        return cls(
+            os.environ.get("CLUSTER_SELF", ""),
+            os.environ.get("CLUSTER_PEERS", "").split(","),
+            redirect=os.environ.get("CLUSTER_REDIRECT", "").lower() in ("1", "true", "yes"),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # The owner may queue and download before its first byte, hence the long read timeout
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(900.0, connect=5.0))
+        return self._client
+
+    async def close(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    def is_up(self, node: str) -> bool:
+        return time.time() >= self._down_until.get(node, 0)
+
+    def mark_down(self, node: str, reason: str):
+        self._down_until[node] = time.time() + self.retry_down_after
+        self.fallbacks += 1
+        logger.info("[Cluster] %s unreachable (%s), serving locally for %.0fs", node, reason, self.retry_down_after)
+
+    def is_peer(self, node: Optional[str]) -> bool:
+        """Whether a node URL (as sent in FORWARDED_HEADER) is another member of this cluster"""
+        node = normalize_node(node or "")
+        return self.enabled and node != self.self_url and node in self.ring.nodes
+
+    def owner_of(self, package_name: str) -> Optional[str]:
+        return self.ring.owner(package_name)
+
+    def remote_owner(self, package_name: str, request: Optional[Request] = None) -> Optional[str]:
+        """The peer that should handle this package, or None to handle it here"""
+        if not self.enabled:
+            return None
+        if request is not None and request.headers.get(FORWARDED_HEADER):
+            # Already forwarded once: never bounce again, even if the rings disagree
+            return None
+        owner = self.owner_of(package_name)
+        if owner == self.self_url or not self.is_up(owner):
+            return None
+        return owner
+
+    async def forward(self, request: Request, package_name: str) -> Optional[Response]:
+        """Proxy (or redirect) the request to the package's owner; None means handle it locally"""
+        owner = self.remote_owner(package_name, request)
+        if not owner:
+            return None
+
+        url = owner + request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        if self.redirect:
+            self.forwarded += 1
+            return RedirectResponse(url, status_code=307)
+
+        headers = {name: request.headers[name] for name in FORWARD_REQUEST_HEADERS if name in request.headers}
+        headers[FORWARDED_HEADER] = self.self_url
+        try:
+            upstream = await self.client.send(
+                self.client.build_request(request.method, url, headers=headers), stream=True
+            )
+        except httpx.TransportError as e:
+            self.mark_down(owner, type(e).__name__)
+            return None
+
+        self.forwarded += 1
+        response_headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        response_headers["X-Cluster-Node"] = owner
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers=response_headers,
+            background=BackgroundTask(upstream.aclose),
+        )
+
+    async def pull(self, peer: str, package_name: str, file_path: str,
+                   progress: Optional[Callable[[int, int], None]] = None) -> Tuple[StreamValidator, Dict[str, str]]:
+        """Copy a package's file from a peer's cache (the peer downloads it first if it has to)"""
+        validator = StreamValidator()
+        headers = {FORWARDED_HEADER: self.self_url}
+        try:
+            async with self.client.stream("GET", f"{peer}/download/{package_name}", headers=headers) as response:
+                if response.status_code != 200:
+                    validator.error = f"peer returned HTTP {response.status_code}"
+                    return validator, {}
+                total = int(response.headers.get("content-length") or 0)
+                async with aiofiles.open(file_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(chunk_size=262144):
+                        if not validator.feed(chunk):
+                            return validator, {}
+                        await f.write(chunk)
+                        if progress:
+                            progress(validator.size, total)
+                peer_headers = dict(response.headers)
+        except httpx.TransportError as e:
+            self.mark_down(peer, type(e).__name__)
+            validator.error = f"peer unreachable: {e}"
+            return validator, {}
+
+        if validator.finish():
+            expected = peer_headers.get("x-content-sha256")
+            if expected and expected != validator.sha256:
+                validator.error = "checksum mismatch with peer"
+            else:
+                self.pulled += 1
+        return validator, peer_headers
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "self": self.self_url,
+            "mode": "redirect" if self.redirect else "proxy",
+            "nodes": {node: "up" if self.is_up(node) else "down" for node in self.ring.nodes},
+            "forwarded": self.forwarded,
+            "pulled_from_peers": self.pulled,
+            "local_fallbacks": self.fallbacks,
+        }
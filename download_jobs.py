@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Asynchronous download jobs - submit returns a job id at once, progress is pushed to subscribers
+With a shared store, jobs started by one worker process can be followed and cancelled from any other
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from collections.abc import MutableMapping
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+TERMINAL_STATES = ("done", "failed", "cancelled")
+
+PROGRESS_INTERVAL = 0.5
+REMOTE_POLL_INTERVAL = 1.0
+
+
+@dataclass
+class DownloadJob:
+    package_name: str
+    user_id: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    completed_bytes: int = 0
+    total_bytes: int = 0
+    file_type: Optional[str] = None
+    engine: Optional[str] = None
+    sha256: Optional[str] = None
+    cache_key: Optional[str] = None
+    error: Optional[str] = None
+    task: Optional[asyncio.Task] = None
+    subscribers: List[asyncio.Queue] = field(default_factory=list)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        progress = (self.completed_bytes / self.total_bytes * 100) if self.total_bytes else 0.0
+        return {
+            "job_id": self.id,
+            "package_name": self.package_name,
+            "status": self.status,
+            "completed_bytes": self.completed_bytes,
+            "total_bytes": self.total_bytes,
+            "progress": round(min(progress, 100.0), 1),
+            "file_type": self.file_type,
+            "engine": self.engine,
+            "sha256": self.sha256,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        return {**self.to_dict(), "user_id": self.user_id, "cache_key": self.cache_key}
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "DownloadJob":
+        fields = {key: record.get(key) for key in (
+            "package_name", "user_id", "status", "created_at", "updated_at", "completed_bytes",
+            "total_bytes", "file_type", "engine", "sha256", "cache_key", "error")}
+        return cls(id=record["job_id"], **fields)
+
+    @property
+    def remote(self) -> bool:
+        """Owned by another worker process; known here only through the shared store"""
+        return self.task is None
+
+
+class JobManager:
+    """Tracks download jobs, deduplicates them per package and fans progress out to subscribers"""
+
+    def __init__(self, finished_ttl: float = 600.0, store: Optional[MutableMapping] = None,
+                 stale_after: float = 900.0):
+        self.finished_ttl = finished_ttl
+        self.store = store
+        self.stale_after = stale_after
+        self.jobs: Dict[str, DownloadJob] = {}
+        self.active_by_package: Dict[str, str] = {}
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        if job_id in self.jobs:
+            return self.jobs[job_id]
+        if self.store is None or not job_id:
+            return None
+        record = self.store.get(job_id)
+        return DownloadJob.from_record(record) if record else None
+
+    def _active_elsewhere(self, package_name: str) -> Optional[DownloadJob]:
+        if self.store is None:
+            return None
+        job = self.get(self.store.get(f"active:{package_name}") or "")
+        # A worker that died mid-download leaves its job behind; stop deduplicating against it eventually
+        if job and not job.finished and time.time() - job.updated_at < self.stale_after:
+            return job
+        return None
+
+    def _persist(self, job: DownloadJob):
+        if self.store is None:
+            return
+        self.store[job.id] = job.to_record()
+        if job.finished and self.store.get(f"active:{job.package_name}") == job.id:
+            self.store.pop(f"active:{job.package_name}", None)
+
+    def submit(self, package_name: str, user_id: Optional[str],
+               runner: Callable[[DownloadJob], Any]) -> Tuple[DownloadJob, bool]:
+        """Start a job, or return the one already running for this package; the flag is True if new"""
+        self.prune()
+        existing = self.jobs.get(self.active_by_package.get(package_name, ""))
+        if existing and not existing.finished:
+            return existing, False
+        existing = self._active_elsewhere(package_name)
+        if existing:
+            return existing, False
+
+        job = DownloadJob(package_name=package_name, user_id=user_id)
+        self.jobs[job.id] = job
+        self.active_by_package[package_name] = job.id
+        job.task = asyncio.create_task(runner(job))
+        if self.store is not None:
+            self.store[f"active:{package_name}"] = job.id
+            self._persist(job)
+            asyncio.create_task(self._watch_remote_cancel(job))
+        return job, True
+
+    def update(self, job: DownloadJob, **fields):
+        for key, value in fields.items():
+            setattr(job, key, value)
+        job.updated_at = time.time()
+        if job.finished and self.active_by_package.get(job.package_name) == job.id:
+            del self.active_by_package[job.package_name]
+
+        self._persist(job)
+
+        snapshot = job.to_dict()
+        for queue in job.subscribers:
+            queue.put_nowait(snapshot)
+
+    def progress_callback(self, job: DownloadJob) -> Callable[[int, int], None]:
+        """A (completed, total) callback that download engines may call from worker threads"""
+        loop = asyncio.get_running_loop()
+        last_sent = [0.0]
+
+        def report(completed: int, total: int):
+            now = time.time()
+            if now - last_sent[0] < PROGRESS_INTERVAL and completed < total:
+                return
+            last_sent[0] = now
+            loop.call_soon_threadsafe(apply, completed, total)
+
+        def apply(completed: int, total: int):
+            # Late progress from a worker thread must not reopen a finished job
+            if not job.finished:
+                self.update(job, status="downloading", completed_bytes=completed,
+                            total_bytes=total or job.total_bytes)
+        return report
+
+    def cancel(self, job: DownloadJob) -> bool:
+        if job.finished:
+            return False
+        if job.remote:
+            if self.store is None:
+                return False
+            # The owning worker picks the request up in _watch_remote_cancel
+            self.store[f"cancel:{job.id}"] = True
+            return True
+        job.task.cancel()
+        return True
+
+    async def _watch_remote_cancel(self, job: DownloadJob):
+        while not job.finished:
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            if self.store.pop(f"cancel:{job.id}", None):
+                job.task.cancel()
+                return
+
+    async def events(self, job: DownloadJob, heartbeat: float = 15.0):
+        """Server-sent events stream of job snapshots, ending once the job reaches a final state"""
+        if job.remote:
+            async for event in self._remote_events(job, heartbeat):
+                yield event
+            return
+
+        queue: asyncio.Queue = asyncio.Queue()
+        job.subscribers.append(queue)
+        try:
+            # Subscribed before the first snapshot, so no update can fall between the two
+            snapshot = job.to_dict()
+            yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+            while snapshot["status"] not in TERMINAL_STATES:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+        finally:
+            job.subscribers.remove(queue)
+
+    async def _remote_events(self, job: DownloadJob, heartbeat: float):
+        """Events for a job owned by another worker, polled from the shared store"""
+        snapshot = job.to_dict()
+        yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+        last_sent = time.time()
+        while snapshot["status"] not in TERMINAL_STATES:
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            latest = self.get(job.id)
+            if latest is None:
+                return
+            if latest.updated_at != snapshot["updated_at"]:
+                snapshot = latest.to_dict()
+                yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+                last_sent = time.time()
+            elif time.time() - last_sent >= heartbeat:
+                yield ": keep-alive\n\n"
+                last_sent = time.time()
+
+    def _all_records(self) -> List[Dict[str, Any]]:
+        if self.store is None:
+            return [job.to_record() for job in self.jobs.values()]
+        return [record for key, record in self.store.items() if ":" not in key]
+
+    def prune(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and now - job.updated_at > self.finished_ttl:
+                del self.jobs[job_id]
+        if self.store is not None:
+            for record in self._all_records():
+                if record["status"] in TERMINAL_STATES and now - record["updated_at"] > self.finished_ttl:
+                    self.store.pop(record["job_id"], None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        records = self._all_records()
+        counts: Dict[str, int] = {}
+        for record in records:
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return {"total": len(records), "by_status": counts}
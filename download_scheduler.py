@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Fair download scheduler - per-user concurrency quotas with round-robin dispatch
+Small files go through a fast lane so they are never stuck behind multi-GB games
+"""
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Deque
+
+from structured_log import get_logger
+
+logger = get_logger("download_scheduler")
+
+FAST_LANE = "fast"
+BULK_LANE = "bulk"
+
+# Keys under this prefix (other cluster nodes) are scheduled fairly but not held to the per-user quota,
+# since each of them carries many users' requests
+INTERNAL_PREFIX = "internal:"
+
+DEFAULT_THROUGHPUT = 5 * 1024 * 1024
+EWMA_ALPHA = 0.2
+
+_ticket_ids = itertools.count(1)
+
+
+@dataclass
+class DownloadTicket:
+    user_id: str
+    package_name: str
+    size: int
+    lane: str
+    id: int = field(default_factory=lambda: next(_ticket_ids))
+    enqueued_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    granted: Optional[asyncio.Future] = None
+
+
+class _Lane:
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.active: Dict[int, DownloadTicket] = {}
+        self.queues: "OrderedDict[str, Deque[DownloadTicket]]" = OrderedDict()
+        self.last_served: Dict[str, int] = {}
+        self.serve_seq = 0
+        self.throughput = float(DEFAULT_THROUGHPUT)
+        self.avg_size = 0.0
+        self.completed = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def users_by_turn(self) -> List[str]:
+        """Waiting users, least recently served first"""
+        return sorted(self.queues.keys(), key=lambda user_id: self.last_served.get(user_id, -1))
+
+    def dispatch_order(self) -> List[DownloadTicket]:
+        """Queued tickets in the order round-robin dispatch would start them"""
+        queues = [list(self.queues[user_id]) for user_id in self.users_by_turn()]
+        order = []
+        for round_items in itertools.zip_longest(*queues):
+            order.extend(t for t in round_items if t is not None)
+        return order
+
+
+class DownloadScheduler:
+    """Two-lane scheduler with per-user quotas and round-robin fairness between users"""
+
+    def __init__(self, fast_slots: int = 150, bulk_slots: int = 50,
+                 per_user_limit: int = 3, fast_lane_max_bytes: int = 100 * 1024 * 1024):
+        self.per_user_limit = per_user_limit
+        self.fast_lane_max_bytes = fast_lane_max_bytes
+        self.lanes: Dict[str, _Lane] = {
+            FAST_LANE: _Lane(FAST_LANE, fast_slots),
+            BULK_LANE: _Lane(BULK_LANE, bulk_slots),
+        }
+        self.user_active: Dict[str, int] = {}
+        self.outside_bytes = 0
+
+    def lane_for_size(self, size: int) -> str:
+        if 0 < size <= self.fast_lane_max_bytes:
+            return FAST_LANE
+        return BULK_LANE
+
+    def _user_has_quota(self, user_id: str) -> bool:
+        return user_id.startswith(INTERNAL_PREFIX) or self.user_active.get(user_id, 0) < self.per_user_limit
+
+    def _start(self, lane: _Lane, ticket: DownloadTicket):
+        ticket.started_at = time.time()
+        lane.active[ticket.id] = ticket
+        lane.serve_seq += 1
+        lane.last_served[ticket.user_id] = lane.serve_seq
+        self.user_active[ticket.user_id] = self.user_active.get(ticket.user_id, 0) + 1
+        if ticket.granted and not ticket.granted.done():
+            ticket.granted.set_result(True)
+
+    def _dispatch(self):
+        """Fill free slots, rotating through users that still have quota left"""
+        for lane in self.lanes.values():
+            while len(lane.active) < lane.capacity and lane.queues:
+                started = False
+                for user_id in lane.users_by_turn():
+                    if not self._user_has_quota(user_id):
+                        continue
+                    queue = lane.queues[user_id]
+                    ticket = queue.popleft()
+                    if not queue:
+                        del lane.queues[user_id]
+                    self._start(lane, ticket)
+                    started = True
+                    break
+                if not started:
+                    break
+
+    def _remove_queued(self, ticket: DownloadTicket) -> bool:
+        lane = self.lanes[ticket.lane]
+        queue = lane.queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del lane.queues[ticket.user_id]
+            return True
+        return False
+
+    async def acquire(self, user_id: str, package_name: str, size: int = 0) -> DownloadTicket:
+        lane = self.lanes[self.lane_for_size(size)]
+        ticket = DownloadTicket(user_id=user_id, package_name=package_name, size=size, lane=lane.name)
+        ticket.granted = asyncio.get_running_loop().create_future()
+
+        lane.queues.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+
+        if not ticket.granted.done():
+            position = self.position(ticket.id)
+            logger.info("[Scheduler] %s queued in %s lane for %s (position %s, ~%.0fs)",
+                        package_name, lane.name, user_id, position['position'], position['expected_wait'])
+        try:
+            await ticket.granted
+        except asyncio.CancelledError:
+            if not self._remove_queued(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: DownloadTicket, bytes_done: int = 0):
+        lane = self.lanes[ticket.lane]
+        if lane.active.pop(ticket.id, None) is None:
+            return
+
+        remaining = self.user_active.get(ticket.user_id, 1) - 1
+        if remaining > 0:
+            self.user_active[ticket.user_id] = remaining
+        else:
+            self.user_active.pop(ticket.user_id, None)
+            if ticket.user_id not in lane.queues:
+                lane.last_served.pop(ticket.user_id, None)
+
+        elapsed = time.time() - (ticket.started_at or time.time())
+        size = bytes_done or ticket.size
+        if size > 0 and elapsed > 0.5:
+            lane.throughput = (1 - EWMA_ALPHA) * lane.throughput + EWMA_ALPHA * (size / elapsed)
+        if size > 0:
+            lane.avg_size = size if lane.completed == 0 else (1 - EWMA_ALPHA) * lane.avg_size + EWMA_ALPHA * size
+        lane.completed += 1
+
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, package_name: str, size: int = 0):
+        ticket = await self.acquire(user_id, package_name, size)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _ticket_size(self, lane: _Lane, ticket: DownloadTicket) -> float:
+        if ticket.size > 0:
+            return float(ticket.size)
+        return lane.avg_size or float(self.fast_lane_max_bytes)
+
+    def _expected_wait(self, lane: _Lane, ahead: List[DownloadTicket]) -> float:
+        """Seconds until a slot frees up, from the bytes still owed to active and queued-ahead downloads"""
+        if len(lane.active) < lane.capacity and not ahead:
+            return 0.0
+        now = time.time()
+        active_remaining = 0.0
+        for ticket in lane.active.values():
+            done = (now - (ticket.started_at or now)) * lane.throughput
+            active_remaining += max(0.0, self._ticket_size(lane, ticket) - done)
+        ahead_bytes = sum(self._ticket_size(lane, t) for t in ahead)
+        return (active_remaining + ahead_bytes) / (lane.throughput * max(1, lane.capacity))
+
+    def _active_entry(self, lane: _Lane, ticket: DownloadTicket) -> Dict[str, Any]:
+        return {"ticket": ticket.id, "package_name": ticket.package_name, "lane": lane.name,
+                "state": "active", "position": 0, "expected_wait": 0.0}
+
+    def _queued_entry(self, lane: _Lane, order: List[DownloadTicket], index: int) -> Dict[str, Any]:
+        ticket = order[index]
+        return {"ticket": ticket.id, "package_name": ticket.package_name, "lane": lane.name,
+                "state": "queued", "position": index + 1,
+                "expected_wait": round(self._expected_wait(lane, order[:index]), 1)}
+
+    def position(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        for lane in self.lanes.values():
+            if ticket_id in lane.active:
+                return self._active_entry(lane, lane.active[ticket_id])
+            order = lane.dispatch_order()
+            for index, ticket in enumerate(order):
+                if ticket.id == ticket_id:
+                    return self._queued_entry(lane, order, index)
+        return None
+
+    def user_status(self, user_id: str) -> List[Dict[str, Any]]:
+        # One dispatch order per lane, however many tickets the user has queued
+        entries = []
+        for lane in self.lanes.values():
+            entries.extend(self._active_entry(lane, t) for t in lane.active.values() if t.user_id == user_id)
+            if user_id in lane.queues:
+                order = lane.dispatch_order()
+                entries.extend(self._queued_entry(lane, order, index)
+                               for index, t in enumerate(order) if t.user_id == user_id)
+        return entries
+
+    @property
+    def queued(self) -> int:
+        return sum(lane.queued for lane in self.lanes.values())
+
+    def reserve(self, size: int):
+        """Count a download that runs outside the lanes (aria2 batches) in reserved_bytes() until unreserved"""
+        self.outside_bytes += max(0, size)
+
+    def unreserve(self, size: int):
+        self.outside_bytes = max(0, self.outside_bytes - max(0, size))
+
+    def reserved_bytes(self) -> int:
+        """Expected bytes of every active and queued download, for disk space accounting"""
+        total = self.outside_bytes
+        for lane in self.lanes.values():
+            total += sum(t.size for t in lane.active.values())
+            total += sum(t.size for q in lane.queues.values() for t in q)
+        return total
+
+    def expected_wait_for(self, size: int = 0) -> float:
+        """Expected wait for a new request of the given size if it were queued now"""
+        lane = self.lanes[self.lane_for_size(size)]
+        return self._expected_wait(lane, lane.dispatch_order())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "per_user_limit": self.per_user_limit,
+            "fast_lane_max_mb": round(self.fast_lane_max_bytes / (1024 * 1024), 1),
+            "active_users": len(self.user_active),
+            "lanes": {
+                lane.name: {
+                    "capacity": lane.capacity,
+                    "active": len(lane.active),
+                    "queued": lane.queued,
+                    "waiting_users": len(lane.queues),
+                    "throughput_mb_s": round(lane.throughput / (1024 * 1024), 2),
+                    "expected_wait": round(self._expected_wait(lane, lane.dispatch_order()), 1),
+                }
+                for lane in self.lanes.values()
+            }
+        }
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Adaptive download engine selection - rolling success rate and throughput per engine,
+upstream host and size class, used to order the engine fallback chain
+"""
+
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Deque, Tuple
+
+from structured_log import get_logger
+
+logger = get_logger("engine_stats")
+
+SIZE_CLASSES = [
+    ("small", 50 * 1024 * 1024),
+    ("medium", 500 * 1024 * 1024),
+    ("large", None),
+]
+
+
+def size_class(size: int) -> str:
+    for name, limit in SIZE_CLASSES:
+        if limit is None or size < limit:
+            return name
+    return SIZE_CLASSES[-1][0]
+
+
+class _EngineWindow:
+    """Last N attempts of one engine against one host and size class"""
+
+    def __init__(self, window: int):
+        self.samples: Deque[Tuple[float, bool, int, float]] = deque(maxlen=window)
+        self.last_probe = 0.0
+
+    def add(self, success: bool, bytes_done: int, elapsed: float):
+        self.samples.append((time.time(), success, bytes_done, elapsed))
+
+    @property
+    def attempts(self) -> int:
+        return len(self.samples)
+
+    @property
+    def success_rate(self) -> float:
+        # Laplace smoothing so a single early failure does not sink an engine
+        successes = sum(1 for s in self.samples if s[1])
+        return (successes + 1) / (len(self.samples) + 2)
+
+    @property
+    def throughput(self) -> float:
+        ok = [(b, e) for _, success, b, e in self.samples if success and e > 0]
+        if not ok:
+            return 0.0
+        return sum(b for b, _ in ok) / sum(e for _, e in ok)
+
+
+class EngineSelector:
+    """Orders download engines by observed performance, skipping degraded ones until a probe succeeds"""
+
+    def __init__(self, engines: List[str], window: int = 20, min_samples: int = 4,
+                 degraded_below: float = 0.3, probe_interval: float = 120.0):
+        self.engines = list(engines)
+        self.window = window
+        self.min_samples = min_samples
+        self.degraded_below = degraded_below
+        self.probe_interval = probe_interval
+        self._windows: Dict[Tuple[str, str, str], _EngineWindow] = {}
+
+    def _get(self, engine: str, host: str, size: int) -> _EngineWindow:
+        key = (engine, host or "unknown", size_class(size))
+        if key not in self._windows:
+            self._windows[key] = _EngineWindow(self.window)
+        return self._windows[key]
+
+    def is_degraded(self, window: _EngineWindow) -> bool:
+        return window.attempts >= self.min_samples and window.success_rate < self.degraded_below
+
+    def _score(self, engine: str, window: _EngineWindow) -> float:
+        # Static order wins until there is data; afterwards expected useful throughput decides
+        prior = len(self.engines) - self.engines.index(engine)
+        if window.attempts < self.min_samples:
+            return prior
+        return len(self.engines) + window.success_rate * (1 + window.throughput / (1024 * 1024))
+
+    def order(self, host: Optional[str], size: int = 0) -> List[str]:
+        now = time.time()
+        healthy, degraded, probes = [], [], []
+
+        for engine in self.engines:
+            window = self._get(engine, host, size)
+            if not self.is_degraded(window):
+                healthy.append(engine)
+            elif now - window.last_probe >= self.probe_interval:
+                window.last_probe = now
+                probes.append(engine)
+            else:
+                degraded.append(engine)
+
+        healthy.sort(key=lambda e: self._score(e, self._get(e, host, size)), reverse=True)
+        if probes:
+            logger.info("[Engines] Probing degraded engine(s) %s for %s", probes, host)
+        if not healthy and not probes:
+            # Everything is degraded: still try all of them, best first, rather than failing outright
+            return sorted(degraded, key=lambda e: self._get(e, host, size).success_rate, reverse=True)
+        return probes + healthy
+
+    def record(self, engine: str, host: Optional[str], size: int, success: bool,
+               bytes_done: int = 0, elapsed: float = 0.0):
+        window = self._get(engine, host, size)
+        was_degraded = self.is_degraded(window)
+        if success and was_degraded:
+            # A successful recovery probe brings the engine straight back
+            window.samples.clear()
+            logger.info("[Engines] %s recovered for %s", engine, host)
+        window.add(success, bytes_done, elapsed)
+        if not was_degraded and self.is_degraded(window):
+            window.last_probe = time.time()
+            logger.warning("[Engines] %s degraded for %s (%s): success rate %.0f%%",
+                           engine, host, size_class(size), window.success_rate * 100)
+
+    def snapshot(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        for (engine, host, cls), window in self._windows.items():
+            if not window.attempts:
+                continue
+            result.setdefault(host, {}).setdefault(cls, {})[engine] = {
+                "attempts": window.attempts,
+                "success_rate": round(window.success_rate, 3),
+                "throughput_mb_s": round(window.throughput / (1024 * 1024), 2),
+                "degraded": self.is_degraded(window),
+            }
+        for host, classes in result.items():
+            for cls in classes:
+                classes[cls]["order"] = self.order_preview(host, cls)
+        return result
+
+    def order_preview(self, host: str, cls: str) -> List[str]:
+        """Current order for a host and size class, without consuming a probe"""
+        size = 0
+        for name, limit in SIZE_CLASSES:
+            if name == cls:
+                break
+            size = limit
+        windows = {e: self._get(e, host, size) for e in self.engines}
+        healthy = [e for e in self.engines if not self.is_degraded(windows[e])]
+        healthy.sort(key=lambda e: self._score(e, windows[e]), reverse=True)
+        return healthy + [e for e in self.engines if e not in healthy]
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+File responses with byte ranges, strong ETags and conditional GET
+Uses the ASGI zero-copy send extension when the server offers it, pread in a worker thread otherwise
+"""
+
+import os
+import re
+from typing import Optional, Dict, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 256 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def make_etag(sha256: Optional[str], suffix: str = "") -> Optional[str]:
+    if not sha256:
+        return None
+    return f'"{sha256}{"-" + suffix if suffix else ""}"'
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(header: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match uses the weak comparison: W/"x" matches "x" (RFC 9110 13.1.2)"""
+    if not header or not etag:
+        return False
+    if header.strip() == '*':
+        return True
+    return _opaque_tag(etag) in [_opaque_tag(tag) for tag in header.split(',')]
+
+
+def parse_range(header: Optional[str], size: int) -> Tuple[Optional[Tuple[int, int]], bool]:
+    """
+    Parse a single-range Range header into an inclusive (start, end)
+    Returns (None, True) when the range cannot be satisfied; multi-range requests are served whole
+    """
+    if not header:
+        return None, False
+    match = _RANGE_RE.match(header.strip().replace(' ', ''))
+    if not match:
+        return None, False
+    first, last = match.groups()
+    if not first and not last:
+        return None, False
+    if not first:
+        length = int(last)
+        if length == 0:
+            return None, True
+        return (max(0, size - length), size - 1), False
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return None, True
+    return (start, min(end, size - 1)), False
+
+
+class SendfileResponse(Response):
+    """
+    Sends [offset, offset + count) of a file; zero-copy when the ASGI server supports it
+    A descriptor passed in is owned by the response and closed once it has been sent
+    """
+
+    def __init__(self, path: str, offset: int, count: int, status_code: int = 200,
+                 headers: Optional[Dict[str, str]] = None, media_type: Optional[str] = None,
+                 fd: Optional[int] = None):
+        super().__init__(content=None, status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.fd = fd
+        self.headers["content-length"] = str(count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        fd = self.fd if self.fd is not None else os.open(self.path, os.O_RDONLY)
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope.get("method") == "HEAD" or self.count == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            extensions = scope.get("extensions") or {}
+            if "http.response.zerocopysend" in extensions:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": fd,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+            # The path may no longer be the file a passed-in descriptor refers to
+            if "http.response.pathsend" in extensions and self.fd is None and self.offset == 0 \
+                    and self.count == os.fstat(fd).st_size:
+                await send({"type": "http.response.pathsend", "path": self.path})
+                return
+
+            position = self.offset
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(CHUNK_SIZE, remaining), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+
+def file_response(request: Request, path: str, etag: Optional[str] = None, filename: Optional[str] = None,
+                  media_type: str = "application/octet-stream", headers: Optional[Dict[str, str]] = None,
+                  base_offset: int = 0, length: Optional[int] = None, fd: Optional[int] = None) -> Response:
+    """
+    Serve a file (or the byte range [base_offset, base_offset + length) of it) honouring
+    If-None-Match, Range and If-Range
+    With fd, bytes come from that already open descriptor, which the response takes over, so the path
+    being deleted or replaced in the meantime does not matter
+    """
+    try:
+        response = _file_response(request, path, etag, filename, media_type, headers, base_offset, length, fd)
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        raise
+    if fd is not None and not isinstance(response, SendfileResponse):
+        os.close(fd)
+    return response
+
+
+def _file_response(request: Request, path: str, etag: Optional[str], filename: Optional[str], media_type: str,
+                   headers: Optional[Dict[str, str]], base_offset: int, length: Optional[int],
+                   fd: Optional[int]) -> Response:
+    if length is not None:
+        size = length
+    else:
+        size = (os.fstat(fd).st_size if fd is not None else os.path.getsize(path)) - base_offset
+    response_headers = dict(headers or {})
+    response_headers["Accept-Ranges"] = "bytes"
+    if etag:
+        response_headers["ETag"] = etag
+    if filename:
+        response_headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={k: v for k, v in response_headers.items()
+                                                  if k in ("ETag", "Cache-Control", "Accept-Ranges")})
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A stale If-Range means the client's partial copy is of different content: send it all again
+    if range_header and if_range and (not etag or if_range.strip() != etag):
+        range_header = None
+
+    byte_range, unsatisfiable = parse_range(range_header, size)
+    if unsatisfiable:
+        response_headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=response_headers)
+
+    if byte_range:
+        start, end = byte_range
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return SendfileResponse(path, base_offset + start, end - start + 1, status_code=206,
+                                headers=response_headers, media_type=media_type, fd=fd)
+
+    return SendfileResponse(path, base_offset, size, headers=response_headers, media_type=media_type, fd=fd)
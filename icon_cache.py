@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Icon proxy cache - each upstream icon is fetched once and the downscaled WebP/JPEG variants the bot
+sends are rendered once, then served from a size-bounded LRU directory on disk
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+from urllib.parse import urlparse
+
+from lazy_imports import lazy_import
+
+Image = lazy_import("PIL.Image")
+
+ICON_SIZES = (96, 192, 512)
+ICON_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+
+# Only image CDNs that search results actually point at, so the endpoint is not an open proxy
+ICON_HOSTS = ("winudf.com", "apkpure.com", "apkpure.net", "googleusercontent.com", "ggpht.com")
+
+MAX_ICON_BYTES = 5 * 1024 * 1024
+
+
+def icon_source_allowed(url: str) -> bool:
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme in ("http", "https") and any(host == h or host.endswith("." + h) for h in ICON_HOSTS)
+
+
+def sniff_image_type(data: bytes) -> str:
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+
+def render_icon(data: bytes, size: int, fmt: str) -> bytes:
+    """Scale to fit a size x size square on a transparent canvas, like sharp's fit: 'contain'"""
+    with Image.open(io.BytesIO(data)) as source:
+        source.draft("RGB", (size, size))
+        image = source.convert("RGBA")
+    scale = min(size / image.width, size / image.height)
+    fitted = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+    canvas = Image.new("RGBA", (size, size), (255, 255, 255, 0))
+    canvas.paste(fitted, ((size - fitted.width) // 2, (size - fitted.height) // 2), fitted)
+
+    out = io.BytesIO()
+    if fmt == "jpeg":
+        # No alpha in JPEG: flatten onto white
+        flat = Image.new("RGB", canvas.size, (255, 255, 255))
+        flat.paste(canvas, mask=canvas.getchannel("A"))
+        flat.save(out, "JPEG", quality=85, optimize=True)
+    else:
+        canvas.save(out, "WEBP", quality=80, method=4)
+    return out.getvalue()
+
+
+def _write_atomic(path: str, data: bytes) -> os.stat_result:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    st = os.stat(tmp_path)
+    os.replace(tmp_path, path)
+    return st
+
+
+class IconCache:
+    """Originals and rendered variants in one directory, evicted least recently used first"""
+
+    def __init__(self, directory: str, max_bytes: int = 200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        # Per source: the lock and how many requests hold or wait for it, so it is dropped only when unused
+        self._locks: Dict[str, list] = {}
+        self.hits = 0
+        self.fetches = 0
+        self.renders = 0
+        self.evictions = 0
+        self._scan()
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, name, st.st_size))
+            except OSError:
+                pass
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._total += size
+
+    def _track(self, name: str, size: int):
+        self._total += size - self._files.pop(name, 0)
+        self._files[name] = size
+
+    def _evict(self, keep: str) -> List[str]:
+        """Drop least recently used files until under the limit; returns the paths to delete"""
+        doomed = []
+        while self._total > self.max_bytes and len(self._files) > 1:
+            name, size = next(iter(self._files.items()))
+            if name == keep:
+                self._files.move_to_end(name)
+                continue
+            del self._files[name]
+            self._total -= size
+            self.evictions += 1
+            doomed.append(os.path.join(self.directory, name))
+        return doomed
+
+    async def _stat(self, name: str) -> Optional[os.stat_result]:
+        """The file's stat, taken in a worker thread, or None when it is not on disk"""
+        st = await asyncio.get_event_loop().run_in_executor(None, self._stat_path, os.path.join(self.directory, name))
+        if st is not None:
+            if name in self._files:
+                self._files.move_to_end(name)
+            return st
+        # Evicted by another worker
+        self._total -= self._files.pop(name, 0)
+        return None
+
+    async def get(self, src: str, size: int, fmt: str,
+                  fetch: Callable[[str], Awaitable[bytes]]) -> Tuple[str, str, os.stat_result]:
+        """Path, media type and stat of the icon at the requested size, fetching and rendering it on first use"""
+        key = hashlib.sha256(src.encode()).hexdigest()[:24]
+        pillow = bool(Image)
+        # Without Pillow the original is served as is
+        name = f"{key}_{size}.{fmt}" if pillow else f"{key}.src"
+        path = os.path.join(self.directory, name)
+
+        st = await self._stat(name)
+        if st is not None:
+            self.hits += 1
+        else:
+            entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    st = await self._stat(name)
+                    if st is not None:
+                        self.hits += 1
+                    else:
+                        st = await self._build(key, src, size, fmt, fetch, pillow)
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+        if pillow:
+            return path, ICON_FORMATS[fmt][1], st
+        return path, await asyncio.get_event_loop().run_in_executor(None, self._sniff, path), st
+
+    async def _build(self, key: str, src: str, size: int, fmt: str,
+                     fetch: Callable[[str], Awaitable[bytes]], pillow: bool) -> os.stat_result:
+        loop = asyncio.get_event_loop()
+        original = f"{key}.src"
+        original_path = os.path.join(self.directory, original)
+        st = await self._stat(original)
+        if st is not None:
+            data = await loop.run_in_executor(None, self._read, original_path)
+        else:
+            data = await fetch(src)
+            self.fetches += 1
+            st = await loop.run_in_executor(None, _write_atomic, original_path, data)
+            self._track(original, len(data))
+
+        name = original
+        if pillow:
+            rendered = await loop.run_in_executor(None, render_icon, data, size, fmt)
+            self.renders += 1
+            name = f"{key}_{size}.{fmt}"
+            st = await loop.run_in_executor(None, _write_atomic, os.path.join(self.directory, name), rendered)
+            self._track(name, len(rendered))
+
+        doomed = self._evict(name)
+        if doomed:
+            await loop.run_in_executor(None, self._remove, doomed)
+        return st
+
+    @staticmethod
+    def _remove(paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _stat_path(path: str) -> Optional[os.stat_result]:
+        try:
+            return os.stat(path)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _sniff(path: str) -> str:
+        with open(path, "rb") as f:
+            return sniff_image_type(f.read(16))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "files": len(self._files),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "fetches": self.fetches,
+            "renders": self.renders,
+            "evictions": self.evictions,
+            "resizing": "pillow" if Image else "passthrough",
+        }
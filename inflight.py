@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Shared in-flight fetches - every requester of a package waits on one fetch task, and when the last of
+them goes away (client disconnect, cancelled job) the fetch is cancelled unless it is nearly finished
+"""
+
+import asyncio
+import time
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+
+from budget import RequestBudget, request_budget
+from structured_log import get_logger
+
+logger = get_logger("inflight")
+
+ProgressCallback = Callable[[int, int], None]
+
+
+class ClientDisconnected(Exception):
+    """The requester went away while waiting for a fetch"""
+
+
+class InflightFetch:
+    def __init__(self, key: str):
+        self.key = key
+        self.task: Optional[asyncio.Task] = None
+        self.budget: Optional[RequestBudget] = None
+        self.holders = 0
+        self.completed = 0
+        self.total = 0
+        self.started_at = time.time()
+        self.listeners: List[ProgressCallback] = []
+
+    def progress(self, completed: int, total: int):
+        """Engine progress, possibly from a worker thread, passed on to every interested requester"""
+        self.completed = completed
+        self.total = total or self.total
+        for listener in tuple(self.listeners):
+            listener(completed, total)
+
+    def remaining_bytes(self) -> Optional[int]:
+        return self.total - self.completed if self.total else None
+
+
+class SharedFetches:
+    """Refcounted fetch tasks keyed by package; the work is cancelled once nobody is left to collect it"""
+
+    def __init__(self, keep_ratio: float = 0.9, keep_bytes: int = 16 * 1024 * 1024, poll_interval: float = 1.0):
+        self.keep_ratio = keep_ratio
+        self.keep_bytes = keep_bytes
+        self.poll_interval = poll_interval
+        self._fetches: Dict[str, InflightFetch] = {}
+        self.started = 0
+        self.joined = 0
+        self.disconnects = 0
+        self.cancelled = 0
+        self.kept = 0
+
+    def join(self, key: str, start: Callable[[ProgressCallback], Awaitable[Any]],
+             deadline: float, attempts: int, progress: Optional[ProgressCallback] = None) -> InflightFetch:
+        """Hold the running fetch for `key`, starting it if there is none"""
+        fetch = self._fetches.get(key)
+        if fetch is None or fetch.task.done():
+            fetch = self._fetches[key] = InflightFetch(key)
+            fetch.task = asyncio.create_task(self._run(fetch, start, deadline, attempts))
+            fetch.task.add_done_callback(lambda task, fetch=fetch: self._finished(fetch, task))
+            self.started += 1
+        else:
+            self.joined += 1
+        fetch.holders += 1
+        if progress:
+            fetch.listeners.append(progress)
+        return fetch
+
+    async def _run(self, fetch: InflightFetch, start: Callable[[ProgressCallback], Awaitable[Any]],
+                   deadline: float, attempts: int) -> Any:
+        # Its own budget rather than the first requester's: that one may leave while others still wait
+        with request_budget(deadline, attempts, f"fetch {fetch.key}", inherit=False) as budget:
+            fetch.budget = budget
+            return await start(fetch.progress)
+
+    def _finished(self, fetch: InflightFetch, task: asyncio.Task):
+        if self._fetches.get(fetch.key) is fetch:
+            del self._fetches[fetch.key]
+        # Nobody may be left to look at the outcome of a fetch that was kept running
+        if not task.cancelled():
+            task.exception()
+
+    async def wait(self, fetch: InflightFetch, disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                   progress: Optional[ProgressCallback] = None) -> Any:
+        """The fetch's result; raises ClientDisconnected if `disconnected` reports the requester gone"""
+        try:
+            while True:
+                done, _ = await asyncio.wait({fetch.task}, timeout=self.poll_interval if disconnected else None)
+                if done:
+                    return fetch.task.result()
+                if await disconnected():
+                    self.disconnects += 1
+                    raise ClientDisconnected(fetch.key)
+        finally:
+            self.release(fetch, progress)
+
+    def release(self, fetch: InflightFetch, progress: Optional[ProgressCallback] = None):
+        if progress in fetch.listeners:
+            fetch.listeners.remove(progress)
+        fetch.holders -= 1
+        if fetch.holders > 0 or fetch.task.done():
+            return
+        remaining = fetch.remaining_bytes()
+        if remaining is not None and (remaining <= self.keep_bytes or fetch.completed >= fetch.total * self.keep_ratio):
+            # Cheaper to finish and cache it for the retry that usually follows than to throw it away
+            self.kept += 1
+            logger.info("[Inflight] %s: abandoned at %.0f%%, finishing anyway",
+                        fetch.key, fetch.completed / fetch.total * 100)
+            return
+        self.cancelled += 1
+        logger.info("[Inflight] %s: abandoned by every requester, cancelling", fetch.key)
+        if fetch.budget:
+            fetch.budget.cancel("every requester went away")
+        fetch.task.cancel()
+        # Whoever asks next starts afresh instead of joining a fetch on its way out
+        if self._fetches.get(fetch.key) is fetch:
+            del self._fetches[fetch.key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "active": {
+                key: {
+                    "holders": fetch.holders,
+                    "completed_bytes": fetch.completed,
+                    "total_bytes": fetch.total,
+                    "elapsed": round(time.time() - fetch.started_at, 1),
+                }
+                for key, fetch in list(self._fetches.items())
+            },
+            "started": self.started,
+            "joined": self.joined,
+            "disconnects": self.disconnects,
+            "cancelled": self.cancelled,
+            "kept": self.kept,
+        }
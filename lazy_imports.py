@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Deferred imports - heavy optional dependencies are imported on first use instead of at startup
+"""
+
+import importlib
+import threading
+from typing import Any, Optional
+
+_MISSING = object()
+
+
+class LazyImport:
+    """
+    Stands in for a module (or one attribute of it) until first use
+    Truthiness imports it and is False when it is not installed, like the `x = None` fallback idiom
+    """
+
+    def __init__(self, module: str, attr: Optional[str] = None):
+        self._module = module
+        self._attr = attr
+        self._target: Any = _MISSING
+        self._error: Optional[ImportError] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Any:
+        if self._target is _MISSING:
+            with self._lock:
+                if self._target is _MISSING and self._error is None:
+                    try:
+                        target = importlib.import_module(self._module)
+                        self._target = getattr(target, self._attr) if self._attr else target
+                    except ImportError as e:
+                        self._error = e
+        if self._error is not None:
+            raise self._error
+        return self._target
+
+    @property
+    def loaded(self) -> bool:
+        return self._target is not _MISSING
+
+    def __bool__(self) -> bool:
+        try:
+            self._load()
+            return True
+        except ImportError:
+            return False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        name = f"{self._module}.{self._attr}" if self._attr else self._module
+        return f"<LazyImport {name} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def lazy_import(module: str, attr: Optional[str] = None) -> LazyImport:
+    return LazyImport(module, attr)
+
+
+def preload(*imports: LazyImport):
+    """Import deferred modules ahead of first use, e.g. from a background thread after startup"""
+    for item in imports:
+        bool(item)
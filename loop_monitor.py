@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Event loop lag monitor - a ticker measures how late the loop wakes up, and a watchdog thread
+captures the loop thread's stack while it is stalled so the worst stalls can be traced to code
+"""
+
+import asyncio
+import heapq
+import itertools
+import sys
+import threading
+import time
+import traceback
+from typing import Optional, Dict, Any, List, Tuple
+
+from structured_log import get_logger
+
+logger = get_logger("loop_monitor")
+
+EWMA_ALPHA = 0.1
+
+
+class LoopMonitor:
+    """Records event loop lag and keeps the top N worst stalls together with the stack that caused them"""
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, keep: int = 10):
+        self.interval = interval
+        self.threshold = threshold
+        self.keep = keep
+        self.avg_lag = 0.0
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self._worst: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._seq = itertools.count()
+        self._last_beat = time.monotonic()
+        self._stall_stack: Optional[List[str]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+            lag = max(0.0, now - expected)
+            self.avg_lag = (1 - EWMA_ALPHA) * self.avg_lag + EWMA_ALPHA * lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._record_stall(lag)
+
+    def _watch(self):
+        """Runs in its own thread; samples the loop thread's stack once per stall"""
+        while not self._stop.wait(self.interval / 2):
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for < self.threshold or self._stall_stack is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._stall_stack = [line.rstrip() for line in traceback.format_stack(frame)]
+
+    def _record_stall(self, lag: float):
+        stack, self._stall_stack = self._stall_stack, None
+        self.stall_count += 1
+        stall = {"lag_ms": round(lag * 1000, 1), "at": time.time(), "stack": stack or []}
+        logger.warning("[LoopMonitor] Event loop stalled for %.0f ms%s", lag * 1000,
+                       f" in {stack[-1].strip().splitlines()[0]}" if stack else "")
+
+        entry = (lag, next(self._seq), stall)
+        if len(self._worst) < self.keep:
+            heapq.heappush(self._worst, entry)
+        elif lag > self._worst[0][0]:
+            heapq.heapreplace(self._worst, entry)
+
+    def snapshot(self, include_stacks: bool = True) -> Dict[str, Any]:
+        worst = [stall for _, _, stall in sorted(self._worst, reverse=True)]
+        if not include_stacks:
+            worst = [{k: v for k, v in stall.items() if k != "stack"} for stall in worst]
+        return {
+            "interval_ms": round(self.interval * 1000, 1),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "avg_lag_ms": round(self.avg_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stall_count,
+            "worst": worst,
+        }
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Source providers - every place an APK can come from implements one small interface, and the resolver
+orders them per package by observed latency and success, hedging with the next one when the
+favourite is slow. Providers are listed in APK_PROVIDERS as "module:attr" entries.
+"""
+
+import asyncio
+import contextvars
+import functools
+import importlib
+import inspect
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+from budget import BudgetExceeded
+from structured_log import get_logger
+
+logger = get_logger("providers")
+
+DEFAULT_PROVIDERS = "apkpure_client:APKPureClient"
+EWMA_ALPHA = 0.3
+
+
+class SourceProvider(ABC):
+    """
+    A source of APK/XAPK files. `resolve` may be a plain or an async method; it returns a download info
+    dict (download_url, size, file_type and, when known, version) or None when it has nothing
+    """
+
+    name = "unknown"
+
+    @abstractmethod
+    def resolve(self, package_name: str) -> Optional[Dict[str, Any]]:
+        ...
+
+
+class StaticProvider(SourceProvider):
+    """
+    Answers from a fixed package -> info table, optionally after a delay or by failing; a local mirror
+    of known URLs, and the stub the resolver's hedging and scoring are exercised with
+    """
+
+    def __init__(self, name: str, answers: Optional[Dict[str, Dict[str, Any]]] = None, delay: float = 0.0,
+                 error: Optional[Exception] = None):
+        self.name = name
+        self.answers = dict(answers or {})
+        self.delay = delay
+        self.error = error
+        self.calls: List[str] = []
+
+    async def resolve(self, package_name: str) -> Optional[Dict[str, Any]]:
+        self.calls.append(package_name)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.answers.get(package_name)
+
+
+def load_provider(spec: str) -> SourceProvider:
+    """"module:attr" -> provider; a class or factory is called without arguments"""
+    module_name, _, attr = spec.strip().partition(":")
+    target = getattr(importlib.import_module(module_name), attr or "provider")
+    if inspect.isclass(target) or (callable(target) and not hasattr(target, "resolve")):
+        target = target()
+    if not callable(getattr(target, "resolve", None)):
+        raise TypeError(f"{spec} is not a source provider")
+    return target
+
+
+class _ProviderStats:
+    """Latency EWMA and smoothed success rate of one provider, overall or for one package"""
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+
+    def add(self, success: bool, elapsed: float):
+        if success:
+            self.successes += 1
+            self.latency = elapsed if self.latency is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.latency
+        else:
+            self.failures += 1
+
+    @property
+    def success_rate(self) -> float:
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+
+class ProviderResolver:
+    """Resolves packages across providers, best expected time-to-answer first, hedging the slow ones"""
+
+    def __init__(self, providers: List[SourceProvider], hedge_delay: float = 5.0, min_hedge_delay: float = 1.0,
+                 max_packages: int = 5000):
+        self.providers = list(providers)
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_packages = max_packages
+        self._overall: Dict[str, _ProviderStats] = {p.name: _ProviderStats() for p in self.providers}
+        self._per_package: "OrderedDict[Tuple[str, str], _ProviderStats]" = OrderedDict()
+        self.hedges = 0
+
+    @classmethod
+    def from_spec(cls, spec: str, **kwargs) -> "ProviderResolver":
+        providers = []
+        for entry in filter(None, (part.strip() for part in spec.split(","))):
+            try:
+                providers.append(load_provider(entry))
+            except Exception as e:
+                logger.warning("[Providers] Skipping %s: %s", entry, e)
+        if not providers:
+            raise RuntimeError(f"No usable source provider in {spec!r}")
+        return cls(providers, **kwargs)
+
+    def __contains__(self, name: str) -> bool:
+        return any(p.name == name for p in self.providers)
+
+    def _package_stats(self, provider: SourceProvider, package_name: str) -> Optional[_ProviderStats]:
+        key = (provider.name, package_name)
+        stats = self._per_package.get(key)
+        if stats:
+            self._per_package.move_to_end(key)
+        return stats
+
+    def _record(self, provider: SourceProvider, package_name: str, success: bool, elapsed: float):
+        self._overall[provider.name].add(success, elapsed)
+        key = (provider.name, package_name)
+        if key not in self._per_package:
+            self._per_package[key] = _ProviderStats()
+            while len(self._per_package) > self.max_packages:
+                self._per_package.popitem(last=False)
+        self._per_package[key].add(success, elapsed)
+
+    def expected_time(self, provider: SourceProvider, package_name: str) -> float:
+        """Latency divided by the chance of success: what trying this provider is expected to cost"""
+        stats = self._package_stats(provider, package_name)
+        if stats is None or stats.latency is None and stats.failures == 0:
+            stats = self._overall[provider.name]
+        latency = stats.latency if stats.latency is not None else self.hedge_delay
+        return latency / stats.success_rate
+
+    def order(self, package_name: str) -> List[SourceProvider]:
+        # Ties (no data yet) keep the configured order
+        return sorted(self.providers, key=lambda p: self.expected_time(p, package_name))
+
+    def _delay(self, provider: SourceProvider) -> float:
+        """How long the favourite gets before the next provider is started alongside it"""
+        latency = self._overall[provider.name].latency
+        if latency is None:
+            return self.hedge_delay
+        return min(self.hedge_delay, max(self.min_hedge_delay, latency * 1.5))
+
+    async def _attempt(self, provider: SourceProvider, package_name: str) -> Optional[Dict[str, Any]]:
+        started = time.monotonic()
+        try:
+            if inspect.iscoroutinefunction(provider.resolve):
+                result = await provider.resolve(package_name)
+            else:
+                context = contextvars.copy_context()
+                result = await asyncio.get_event_loop().run_in_executor(
+                    None, functools.partial(context.run, provider.resolve, package_name))
+        except (asyncio.CancelledError, BudgetExceeded):
+            # Our own deadline running out says nothing about the provider
+            raise
+        except Exception as e:
+            logger.warning("[Providers] %s failed for %s: %s", provider.name, package_name, e)
+            result = None
+        self._record(provider, package_name, bool(result), time.monotonic() - started)
+        if result:
+            result = {**result, "source": provider.name}
+        return result
+
+    async def resolve(self, package_name: str) -> Optional[Dict[str, Any]]:
+        """First answer from any provider; the next one starts when the current favourite is slow or fails"""
+        waiting = self.order(package_name)
+        running: Dict[asyncio.Future, SourceProvider] = {}
+        try:
+            while waiting or running:
+                if waiting:
+                    provider = waiting.pop(0)
+                    if running:
+                        self.hedges += 1
+                    running[asyncio.ensure_future(self._attempt(provider, package_name))] = provider
+                done, _ = await asyncio.wait(running, timeout=self._delay(provider) if waiting else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    del running[task]
+                    if task.result():
+                        return task.result()
+            return None
+        finally:
+            # A blocking provider keeps running in its thread; only its answer is dropped
+            for task in running:
+                task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "providers": {
+                p.name: {
+                    "latency_ewma": round(self._overall[p.name].latency, 3)
+                    if self._overall[p.name].latency is not None else None,
+                    "success_rate": round(self._overall[p.name].success_rate, 3),
+                    "successes": self._overall[p.name].successes,
+                    "failures": self._overall[p.name].failures,
+                }
+                for p in self.providers
+            },
+            "tracked_packages": len(self._per_package),
+            "hedges": self.hedges,
+        }
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Upstream protection for the APKPure hosts - an adaptive (AIMD) token bucket per host that backs off on
+Cloudflare challenges, 429 and 503, and a circuit breaker that stops all traffic to a host after
+sustained failure until a probe gets through. Usable from the event loop and from scraper threads.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, Callable, Mapping
+from urllib.parse import urlparse
+
+from budget import spend, budget_timeout, budget_exhausted
+from structured_log import get_logger
+
+logger = get_logger("rate_limit")
+
+# Hosts that are limited, and the aliases that share their budget; everything else passes through
+GUARDED_HOSTS = {
+    "apkpure.com": "apkpure.com",
+    "www.apkpure.com": "apkpure.com",
+    "m.apkpure.com": "apkpure.com",
+    "d.apkpure.com": "d.apkpure.com",
+    "download.apkpure.com": "d.apkpure.com",
+}
+
+THROTTLE_STATUSES = (429, 503)
+CHALLENGE_MARKERS = ("just a moment", "cf-chl", "challenge-platform", "cf_chl_opt", "attention required")
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of sending a request to a host whose circuit is open or that asked us to wait"""
+
+    def __init__(self, host: str, retry_after: float, reason: str = "circuit open"):
+        super().__init__(f"{host} unavailable ({reason}), retry in {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def host_key(url_or_host: str) -> str:
+    host = urlparse(url_or_host).hostname if "://" in url_or_host else url_or_host
+    host = (host or "").lower().rstrip(".")
+    return GUARDED_HOSTS.get(host, host)
+
+
+def is_throttled(status: int, headers: Optional[Mapping[str, str]] = None, text: Optional[str] = None) -> bool:
+    """429/503, a Cloudflare challenge header, or an HTML challenge page"""
+    if status in THROTTLE_STATUSES:
+        return True
+    headers = headers or {}
+    if (headers.get("cf-mitigated") or "").lower() == "challenge":
+        return True
+    if status == 403 and "cloudflare" in (headers.get("server") or "").lower():
+        return True
+    if text:
+        head = text[:4096].lower()
+        return any(marker in head for marker in CHALLENGE_MARKERS)
+    return False
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> float:
+    try:
+        return max(0.0, float((headers or {}).get("retry-after") or 0))
+    except ValueError:
+        return 0.0
+
+
+class TokenBucket:
+    """
+    Reservation-style token bucket: each caller takes a token immediately and is told how long to wait
+    for it, so waiters are spaced out evenly in arrival order. The rate grows additively on success and
+    halves on throttling (at most once a second, so one burst of rejections counts once).
+    """
+
+    def __init__(self, rate: float, burst: float, min_rate: float = 0.2, max_rate: Optional[float] = None,
+                 increase: float = 0.05, max_wait: float = 30.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.increase = increase
+        self.max_wait = max_wait
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.waited = 0.0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, host: str) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, self.blocked_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+            if wait > self.max_wait:
+                # Sleeping this long would only pile up threads; let the caller answer "try later"
+                raise UpstreamUnavailable(host, wait, "rate limited")
+            self.tokens -= 1
+            self.waited += wait
+            return wait
+
+    async def acquire(self, host: str = ""):
+        wait = self._reserve(host)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self, host: str = ""):
+        wait = self._reserve(host)
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: float = 0.0):
+        with self._lock:
+            now = time.monotonic()
+            self.throttles += 1
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if now - self.last_decrease >= 1.0:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = min(self.tokens, 0.0)
+                self.last_decrease = now
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures; open -> half_open once the cooldown passes,
+    letting a single probe through; the probe's outcome closes the circuit or reopens it for twice as long
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0, max_cooldown: float = 300.0,
+                 probe_timeout: float = 60.0):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.cooldown - time.time())
+
+    def check(self, host: str):
+        """Raise while requests would be refused, without claiming the half-open probe"""
+        with self._lock:
+            if self.state == "open" and self.retry_after() > 0:
+                raise UpstreamUnavailable(host, self.retry_after())
+            if self.state == "half_open" and time.time() - self.probe_started < self.probe_timeout:
+                raise UpstreamUnavailable(host, 5.0, "probing")
+
+    def allow(self, host: str):
+        with self._lock:
+            now = time.time()
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                if self.retry_after() > 0:
+                    raise UpstreamUnavailable(host, self.retry_after())
+                self.state = "half_open"
+                self.probe_started = now
+                logger.info("[Upstream] %s circuit half-open, probing", host)
+                return
+            # half_open: one probe at a time, unless the last one never reported back
+            if now - self.probe_started < self.probe_timeout:
+                raise UpstreamUnavailable(host, 5.0, "probing")
+            self.probe_started = now
+
+    def on_success(self, host: str):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("[Upstream] %s circuit closed", host)
+            self.state = "closed"
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+
+    def on_failure(self, host: str, retry_after: float = 0.0):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open":
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            elif self.state == "open" or self.failures < self.threshold:
+                return
+            self.state = "open"
+            self.opened_at = time.time()
+            self.cooldown = max(self.cooldown, retry_after)
+            self.trips += 1
+            logger.warning("[Upstream] %s circuit open for %.0fs after %s failures", host, self.cooldown, self.failures)
+
+
+class HostRateLimiter:
+    """An adaptive token bucket and a circuit breaker per guarded upstream host, created on first use"""
+
+    def __init__(self, rate: float = 5.0, burst: float = 10.0, min_rate: float = 0.2,
+                 failure_threshold: int = 5, cooldown: float = 30.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "HostRateLimiter":
+        return cls(
+            rate=float(os.environ.get("UPSTREAM_RATE", 5)),
+            burst=float(os.environ.get("UPSTREAM_BURST", 10)),
+            min_rate=float(os.environ.get("UPSTREAM_MIN_RATE", 0.2)),
+            failure_threshold=int(os.environ.get("UPSTREAM_FAILURE_THRESHOLD", 5)),
+            cooldown=float(os.environ.get("UPSTREAM_COOLDOWN", 30)),
+        )
+
+    def _guards(self, url_or_host: str):
+        key = host_key(url_or_host)
+        if key not in GUARDED_HOSTS.values():
+            return key, None, None
+        if key not in self._buckets:
+            with self._lock:
+                if key not in self._buckets:
+                    self._breakers[key] = CircuitBreaker(self.failure_threshold, self.cooldown)
+                    self._buckets[key] = TokenBucket(self.rate, self.burst, self.min_rate)
+        return key, self._buckets[key], self._breakers[key]
+
+    def check(self, url_or_host: str):
+        key, _, breaker = self._guards(url_or_host)
+        if breaker:
+            breaker.check(key)
+
+    def is_open(self, url_or_host: str) -> bool:
+        try:
+            self.check(url_or_host)
+            return False
+        except UpstreamUnavailable:
+            return True
+
+    async def acquire(self, url_or_host: str):
+        key, bucket, breaker = self._guards(url_or_host)
+        if bucket:
+            spend(key)
+            breaker.allow(key)
+            await bucket.acquire(key)
+
+    def acquire_blocking(self, url_or_host: str):
+        key, bucket, breaker = self._guards(url_or_host)
+        if bucket:
+            spend(key)
+            breaker.allow(key)
+            bucket.acquire_blocking(key)
+
+    def record(self, url_or_host: str, status: int, headers: Optional[Mapping[str, str]] = None,
+               text: Optional[str] = None) -> bool:
+        """Feed a response back; returns True when it was a throttle the caller should not retry"""
+        key, bucket, breaker = self._guards(url_or_host)
+        throttled = is_throttled(status, headers, text)
+        if not bucket:
+            return throttled
+        if throttled:
+            self.record_throttle(url_or_host, retry_after_seconds(headers))
+        elif status >= 500:
+            breaker.on_failure(key)
+        else:
+            bucket.on_success()
+            breaker.on_success(key)
+        return throttled
+
+    def record_throttle(self, url_or_host: str, retry_after: float = 0.0):
+        """A challenge or rate-limit answer, including one only noticed after the body started arriving"""
+        key, bucket, breaker = self._guards(url_or_host)
+        if bucket:
+            bucket.on_throttle(retry_after)
+            breaker.on_failure(key, retry_after)
+
+    def record_failure(self, url_or_host: str):
+        """A timeout or connection error"""
+        if budget_exhausted():
+            # Cut short by our own deadline, not the host's fault
+            return
+        key, bucket, breaker = self._guards(url_or_host)
+        if breaker:
+            breaker.on_failure(key)
+
+    def guard(self, func: Callable[..., Any], url: str, *args, **kwargs) -> Any:
+        """Run a blocking HTTP call through the limiter and record its outcome"""
+        self.acquire_blocking(url)
+        if "timeout" in kwargs:
+            kwargs["timeout"] = budget_timeout(kwargs["timeout"])
+        try:
+            response = func(url, *args, **kwargs)
+        except Exception:
+            self.record_failure(url)
+            raise
+        headers = getattr(response, "headers", None)
+        self.record(url, response.status_code, {k.lower(): v for k, v in headers.items()} if headers else None)
+        return response
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            host: {
+                "rate": round(bucket.rate, 2),
+                "burst": bucket.burst,
+                "tokens": round(bucket.tokens, 2),
+                "waited_seconds": round(bucket.waited, 2),
+                "throttled": bucket.throttles,
+                "circuit": self._breakers[host].state,
+                "circuit_trips": self._breakers[host].trips,
+                "retry_after": round(self._breakers[host].retry_after(), 1),
+            }
+            for host, bucket in list(self._buckets.items())
+        }
+
+
+# One limiter per process, shared by the API server and the scraper client
+upstream_limiter = HostRateLimiter.from_env()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Search result cache - queries are normalized (case, spacing, Arabic letter variants, digits) into one key,
+kept with a TTL in a bounded LRU, and identical in-flight searches share a single upstream fetch
+"""
+
+import asyncio
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+
+# Harakat, superscript alef and Quranic marks carry no meaning for app names
+_ARABIC_MARKS = re.compile(r'[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+_TATWEEL = '\u0640'
+
+_ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    'ک': 'ك', 'ی': 'ي',
+})
+
+# Arabic-Indic and Extended (Persian) digits
+_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹', '01234567890123456789')
+
+_SEPARATORS = re.compile(r'[\s\-_:;,!?\'"()\[\]{}|/\\+&*#@~`^=<>«»،؛؟]+')
+
+
+def normalize_query(query: str) -> str:
+    text = unicodedata.normalize('NFKC', query).casefold()
+    text = _ARABIC_MARKS.sub('', text).replace(_TATWEEL, '')
+    text = text.translate(_ARABIC_LETTERS).translate(_DIGITS)
+    # Latin accents: "café" and "cafe" are the same search
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _SEPARATORS.sub(' ', text).strip()
+
+
+class SearchCache:
+    """TTL + LRU cache of search results with single-flight fetching per normalized query"""
+
+    def __init__(self, ttl: float = 600.0, empty_ttl: float = 30.0, max_entries: int = 500,
+                 fetch_limit: int = 50):
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.max_entries = max_entries
+        self.fetch_limit = fetch_limit
+        # key -> (expires_at, limit the results were fetched with, results)
+        self._entries: "OrderedDict[str, Tuple[float, int, List[Any]]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[int, asyncio.Future]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _lookup(self, key: str, limit: int) -> Optional[List[Any]]:
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        expires_at, fetched_limit, results = entry
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        # Fewer results than were asked for means upstream had no more, so any smaller limit is covered too
+        if limit > fetched_limit and len(results) >= fetched_limit:
+            return None
+        self._entries.move_to_end(key)
+        return results[:limit]
+
+    def _store(self, key: str, fetched_limit: int, results: List[Any]):
+        ttl = self.ttl if results else self.empty_ttl
+        self._entries[key] = (time.time() + ttl, fetched_limit, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_fetch(self, query: str, limit: int,
+                           fetch: Callable[[str, int], Awaitable[List[Any]]]) -> Tuple[List[Any], str]:
+        """Results for the query and how they were obtained: "hit", "coalesced" or "miss" """
+        key = normalize_query(query)
+        cached = self._lookup(key, limit)
+        if cached is not None:
+            self.hits += 1
+            return cached, "hit"
+
+        inflight = self._inflight.get(key)
+        if inflight and inflight[0] >= limit:
+            self.coalesced += 1
+            results = await asyncio.shield(inflight[1])
+            return results[:limit], "coalesced"
+
+        self.misses += 1
+        fetched_limit = max(limit, self.fetch_limit)
+        # The fetch runs as its own task so a caller that goes away does not cancel it for the others
+        task = asyncio.ensure_future(self._fetch(key, ' '.join(query.split()), fetched_limit, fetch))
+        self._inflight[key] = (fetched_limit, task)
+        results = await asyncio.shield(task)
+        return results[:limit], "miss"
+
+    async def _fetch(self, key: str, query: str, fetched_limit: int,
+                     fetch: Callable[[str, int], Awaitable[List[Any]]]) -> List[Any]:
+        try:
+            results = await fetch(query, fetched_limit)
+            self._store(key, fetched_limit, results)
+            return results
+        finally:
+            if self._inflight.get(key, (None, None))[1] is asyncio.current_task():
+                del self._inflight[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
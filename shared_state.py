@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+State shared by every worker process on the host - caches and counters live in a SQLite database
+in WAL mode, per-package locks are flock()ed lock files next to it. Readers never wait in WAL mode;
+a write the event loop cannot get the lock for within `loop_timeout` is finished by a writer thread.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator, List, Tuple, Callable
+
+from structured_log import get_logger
+
+logger = get_logger("shared_state")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Fields of stored JSON objects that SharedDict.find() looks up through an expression index
+INDEXED_FIELDS = ("package_name", "file_path")
+
+
+UPSERT = ("INSERT INTO kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?) "
+          "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at")
+
+
+class SharedDB:
+    """
+    One SQLite connection per thread and process, opened lazily. The event loop's thread waits at most
+    `loop_timeout` for another worker's write. When that is not enough, the write goes to a writer
+    thread that can wait the full `timeout`. Later writes from the loop follow it there until it is
+    done, so they stay in order; reads in the meantime may briefly see the old value.
+    """
+
+    def __init__(self, path: str, timeout: float = 10.0, loop_timeout: float = 0.5):
+        self.path = path
+        self.timeout = timeout
+        self.loop_timeout = loop_timeout
+        self._local = threading.local()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self.connection()
+        conn.executescript(SCHEMA)
+        for field in INDEXED_FIELDS:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS kv_{field} ON kv (namespace, json_extract(value, '$.{field}'))")
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            timeout = self.loop_timeout if threading.current_thread() is threading.main_thread() else self.timeout
+            conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def execute(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, params)
+
+    def _write_now(self, sql: str, params: Any, many: bool) -> int:
+        conn = self.connection()
+        if not many:
+            return conn.execute(sql, params).rowcount
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rowcount = conn.executemany(sql, params).rowcount
+            conn.execute("COMMIT")
+            return rowcount
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _write_behind(self, sql: str, params: Any, many: bool):
+        try:
+            self._write_now(sql, params, many)
+        except Exception as e:
+            logger.warning("[State] Deferred write failed: %s", e)
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+
+    def write(self, sql: str, params: Any = (), many: bool = False) -> Optional[int]:
+        """
+        Run a write (`many`: executemany in one transaction); the rowcount, or None when the event
+        loop's thread handed it to the writer thread instead of failing the request
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return self._write_now(sql, params, many)
+        if not self._pending:
+            try:
+                return self._write_now(sql, params, many)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+        with self._pending_lock:
+            self._pending += 1
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-db-writer")
+        self._writer.submit(self._write_behind, sql, params, many)
+        return None
+
+
+class SharedDict(MutableMapping):
+    """A dict of JSON values stored in one namespace of the shared database"""
+
+    def __init__(self, db: SharedDB, namespace: str):
+        self.db = db
+        self.namespace = namespace
+
+    def __getitem__(self, key: str) -> Any:
+        row = self.db.execute("SELECT value FROM kv WHERE namespace = ? AND key = ?",
+                              (self.namespace, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key: str, value: Any):
+        self.db.write(UPSERT, (self.namespace, key, json.dumps(value), time.time()))
+
+    def set_many(self, entries: Dict[str, Any]):
+        """Upsert several entries in one transaction"""
+        if not entries:
+            return
+        now = time.time()
+        self.db.write(UPSERT, [(self.namespace, key, json.dumps(value), now) for key, value in entries.items()],
+                      many=True)
+
+    def __delitem__(self, key: str):
+        # A deferred delete (None) is taken to have found the key
+        if self.db.write("DELETE FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key)) == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return self.db.execute("SELECT 1 FROM kv WHERE namespace = ? AND key = ?",
+                               (self.namespace, key)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([row[0] for row in self.db.execute("SELECT key FROM kv WHERE namespace = ?", (self.namespace,))])
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM kv WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        rows = self.db.execute("SELECT key, value FROM kv WHERE namespace = ?", (self.namespace,))
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def values(self) -> List[Any]:
+        return [value for _, value in self.items()]
+
+    def find(self, field: str, value: Any) -> List[Tuple[str, Any]]:
+        """Entries whose JSON object has `field` == value, through the index for INDEXED_FIELDS"""
+        rows = self.db.execute(
+            f"SELECT key, value FROM kv WHERE namespace = ? AND json_extract(value, '$.{field}') = ?",
+            (self.namespace, value))
+        return [(key, json.loads(stored)) for key, stored in rows]
+
+    def raise_field(self, key: str, field: str, value: float) -> bool:
+        """Set a numeric field to at least `value` in one statement, so concurrent updates never lose one"""
+        rowcount = self.db.write(
+            f"UPDATE kv SET value = json_set(value, '$.{field}', "
+            f"MAX(COALESCE(json_extract(value, '$.{field}'), 0), ?)), updated_at = ? "
+            "WHERE namespace = ? AND key = ?",
+            (value, time.time(), self.namespace, key))
+        return rowcount is None or rowcount > 0
+
+    def set_field(self, key: str, field: str, value: Any) -> bool:
+        """Set one field of a stored JSON object, leaving fields other workers changed meanwhile alone"""
+        rowcount = self.db.write(
+            f"UPDATE kv SET value = json_set(value, '$.{field}', json(?)), updated_at = ? "
+            "WHERE namespace = ? AND key = ?",
+            (json.dumps(value), time.time(), self.namespace, key))
+        return rowcount is None or rowcount > 0
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        try:
+            value = self[key]
+            del self[key]
+            return value
+        except KeyError:
+            return default
+
+    def clear(self):
+        self.db.write("DELETE FROM kv WHERE namespace = ?", (self.namespace,))
+
+
+class SharedCounters:
+    """Named integer counters; incr() is a single atomic UPDATE so concurrent workers never lose counts"""
+
+    def __init__(self, db: SharedDB, defaults: Dict[str, int]):
+        self.db = db
+        self.names = list(defaults)
+        self.db.connection().executemany("INSERT OR IGNORE INTO counters (name, value) VALUES (?, ?)",
+                                         list(defaults.items()))
+
+    def incr(self, name: str, delta: int = 1):
+        self.db.write(
+            "INSERT INTO counters (name, value) VALUES (?, MAX(0, ?)) "
+            "ON CONFLICT (name) DO UPDATE SET value = MAX(0, counters.value + ?)",
+            (name, delta, delta)
+        )
+
+    def __getitem__(self, name: str) -> int:
+        row = self.db.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def snapshot(self) -> Dict[str, int]:
+        values = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+        return {name: values.get(name, 0) for name in self.names}
+
+    def reset(self):
+        self.db.write("UPDATE counters SET value = 0")
+
+
+def _lock_path(lock_dir: str, name: str) -> str:
+    return os.path.join(lock_dir, re.sub(r'[^A-Za-z0-9._-]', '_', name) + ".lock")
+
+
+class PackageLock:
+    """
+    Per-package lock across worker processes: an asyncio.Lock queues this process's waiters,
+    then the holder polls a non-blocking flock on the package's lock file. `on_idle` is called once
+    nobody holds or waits for it any more.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.1,
+                 on_idle: Optional[Callable[["PackageLock"], None]] = None):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.on_idle = on_idle
+        self.users = 0
+        self._local = asyncio.Lock()
+        self._fd: Optional[int] = None
+
+    def _leave(self):
+        self.users -= 1
+        if self.users == 0 and self.on_idle:
+            self.on_idle(self)
+
+    def locked(self) -> bool:
+        return self._local.locked()
+
+    async def __aenter__(self):
+        self.users += 1
+        try:
+            await self._local.acquire()
+        except BaseException:
+            self._leave()
+            raise
+        fd = None
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            self._local.release()
+            self._leave()
+            raise
+        self._fd = fd
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        finally:
+            self._fd = None
+            self._local.release()
+            self._leave()
+
+
+class SharedState:
+    """Everything the API workers coordinate through, rooted in one data directory"""
+
+    def __init__(self, data_dir: str, counters: Dict[str, int], loop_timeout: float = 0.5):
+        self.data_dir = data_dir
+        self.lock_dir = os.path.join(data_dir, "locks")
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.db = SharedDB(os.path.join(data_dir, "state.db"), loop_timeout=loop_timeout)
+        self.counters = SharedCounters(self.db, counters)
+        self._package_locks: Dict[str, PackageLock] = {}
+
+    def dict(self, namespace: str) -> SharedDict:
+        return SharedDict(self.db, namespace)
+
+    def package_lock(self, package_name: str) -> PackageLock:
+        lock = self._package_locks.get(package_name)
+        if lock is None:
+            lock = self._package_locks[package_name] = PackageLock(
+                _lock_path(self.lock_dir, package_name), on_idle=lambda idle: self._forget_lock(package_name, idle))
+        return lock
+
+    def _forget_lock(self, package_name: str, lock: PackageLock):
+        # Only once unused, so a woken waiter and a newcomer never end up on different asyncio locks
+        if self._package_locks.get(package_name) is lock:
+            del self._package_locks[package_name]
+
+    @property
+    def package_locks(self) -> Dict[str, PackageLock]:
+        return self._package_locks
+
+    @contextmanager
+    def file_lock(self, name: str):
+        """Blocking cross-process lock, for startup steps only one worker should run at a time"""
+        fd = os.open(_lock_path(self.lock_dir, name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def reset(self, *namespaces: str):
+        """Forget per-run state before workers start: counters and the given namespaces"""
+        self.counters.reset()
+        for namespace in namespaces:
+            self.dict(namespace).clear()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Structured logging - leveled loggers with lazy %-formatting, per-message-class sampling and rate limits
+applied before anything is formatted, and a bounded queue drained by a background thread, so a log
+call on the event loop costs a level check and a queue put. LOG_FORMAT=json writes one JSON object per line.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Optional, Dict, Any, Tuple
+
+ROOT_LOGGER = "appomar"
+
+# Message classes ("[Tag]" a message starts with) that only every Nth of is kept: "Tag=rate,Tag=rate"
+DEFAULT_SAMPLES = "Cache Hit=0.1,aria2 Progress=0.2,APKPure Client=0.5"
+
+# Attributes every LogRecord has; anything else came in through `extra` and is a structured field
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "suppressed"}
+
+
+def message_class(template: str) -> str:
+    """The "[Tag]" a message template starts with, or the whole template"""
+    if template.startswith("["):
+        end = template.find("]")
+        if end > 0:
+            return template[1:end]
+    return template
+
+
+def parse_samples(spec: str) -> Dict[str, float]:
+    rates = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = entry.rpartition("=")
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            print(f"[Logging] Ignoring sample rate {entry!r}", file=sys.stderr)
+    return rates
+
+
+class LogStats:
+    def __init__(self):
+        self.queued = 0
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self.dropped = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "sampled_out": self.sampled_out,
+            "rate_limited": self.rate_limited,
+            "dropped": self.dropped,
+        }
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keeps one record in 1/rate per message class, counting rather than drawing so the kept ones are
+    evenly spread; warnings and errors are never sampled
+    """
+
+    def __init__(self, rates: Dict[str, float], stats: LogStats):
+        super().__init__()
+        self.rates = rates
+        self.stats = stats
+        self._seen: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rates.get(message_class(str(record.msg)))
+        if rate is None or rate >= 1.0:
+            return True
+        with self._lock:
+            seen = self._seen.get(record.msg, 0)
+            self._seen[record.msg] = seen + 1
+        if rate > 0 and seen % round(1 / rate) == 0:
+            return True
+        self.stats.sampled_out += 1
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    A token bucket per message template; what a burst suppresses is reported on the next record of that
+    template that gets through. Errors always pass.
+    """
+
+    def __init__(self, rate: float, burst: float, stats: LogStats):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.stats = stats
+        self._buckets: Dict[Tuple[str, Any], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= 4096:
+                    self._buckets.clear()
+                # tokens, last refill, suppressed since the last record that passed
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.stats.rate_limited += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues the record as it is: the message is formatted by the listener thread, not the caller, and a
+    full queue drops the record instead of blocking the event loop
+    """
+
+    def __init__(self, log_queue: queue.Queue, stats: LogStats):
+        super().__init__(log_queue)
+        self.stats = stats
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            self.stats.queued += 1
+        except queue.Full:
+            self.stats.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    """The plain "[Tag] message" lines the service has always written"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} (+{suppressed} similar suppressed)" if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "class": message_class(str(record.msg)),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+log_stats = LogStats()
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """Install the queue handler and its writer thread on the service's root logger; idempotent"""
+    global _listener
+    with _setup_lock:
+        if _listener:
+            return
+        level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+        fmt = (fmt or os.environ.get("LOG_FORMAT", "text")).lower()
+
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter("%(message)s"))
+
+        log_queue = queue.Queue(maxsize=int(os.environ.get("LOG_QUEUE_SIZE", 10000)))
+        handler = DeferredQueueHandler(log_queue, log_stats)
+        handler.addFilter(SampleFilter(parse_samples(os.environ.get("LOG_SAMPLE", DEFAULT_SAMPLES)), log_stats))
+        handler.addFilter(RateLimitFilter(float(os.environ.get("LOG_RATE", 20)),
+                                          float(os.environ.get("LOG_BURST", 50)), log_stats))
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(getattr(logging, level, logging.INFO))
+        root.addHandler(handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, output)
+        _listener.start()
+        # Whatever is still queued at exit gets written
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
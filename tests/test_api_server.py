@@ -0,0 +1,224 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import zipfile
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+# Private state and cache directories, set before the server module reads them at import
+_STATE = tempfile.mkdtemp(prefix="api-server-test-")
+os.environ["DATA_DIR"] = os.path.join(_STATE, "data")
+os.environ["APP_CACHE_DIR"] = os.path.join(_STATE, "app_cache")
+
+import api_server
+
+SPLIT = os.urandom(300000)
+
+
+def make_xapk() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("manifest.json", json.dumps({"package_name": "com.example", "version_name": "1.0"}),
+                         zipfile.ZIP_DEFLATED)
+        archive.writestr("com.example.apk", SPLIT, zipfile.ZIP_STORED)
+        archive.writestr("config.arm64_v8a.apk", SPLIT, zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def request(method, url, **kwargs):
+    async def send():
+        transport = httpx.ASGITransport(app=api_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+    return asyncio.run(send())
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    api_server.file_cache.clear()
+    api_server.url_cache.clear()
+    api_server.zip_entries_cache.clear()
+    # Loop-bound primitives must not outlive the event loop of one test
+    monkeypatch.setattr(api_server, "info_semaphore", asyncio.Semaphore(api_server.INFO_CONCURRENCY))
+    yield
+    api_server.pending_deletions.clear()
+    api_server.delete_cached_files()
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    """get_download_info answered locally, recording how many resolutions ran at once"""
+    state = {"running": 0, "peak": 0, "calls": []}
+
+    async def get_download_info(package_name):
+        state["calls"].append(package_name)
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        try:
+            await asyncio.sleep(0.01)
+            if package_name.startswith("missing"):
+                raise HTTPException(status_code=404, detail=f"{package_name} not found")
+            return {"source": "apkpure", "download_url": f"https://d.apkpure.com/b/XAPK/{package_name}",
+                    "size": len(make_xapk()), "file_type": "xapk", "version": "1.0"}
+        finally:
+            state["running"] -= 1
+
+    monkeypatch.setattr(api_server, "get_download_info", get_download_info)
+    return state
+
+
+def test_admission_turns_away_work_that_cannot_start_soon(monkeypatch):
+    with pytest.raises(HTTPException) as raised:
+        api_server.check_file_size(api_server.MAX_FILE_SIZE_MB * 1024 * 1024 + 1)
+    assert raised.value.status_code == 413
+
+    monkeypatch.setattr(api_server, "MAX_QUEUE_DEPTH", 0)
+    with pytest.raises(HTTPException) as raised:
+        api_server.check_admission(1024)
+    assert raised.value.status_code == 503 and "queue full" in raised.value.detail
+    assert api_server.RETRY_AFTER_MIN <= int(raised.value.headers["Retry-After"]) <= api_server.RETRY_AFTER_MAX
+
+    monkeypatch.setattr(api_server, "MAX_QUEUE_DEPTH", 300)
+    monkeypatch.setattr(api_server, "MIN_FREE_DISK_MB", 1024 ** 3)
+    with pytest.raises(HTTPException) as raised:
+        api_server.check_admission()
+    assert raised.value.status_code == 503 and "disk space" in raised.value.detail
+
+
+def test_rejections_reach_the_client_as_503_with_retry_after(monkeypatch):
+    monkeypatch.setattr(api_server, "aria2_client", object())
+    monkeypatch.setattr(api_server, "MAX_QUEUE_DEPTH", 2)
+    response = request("POST", "/batch-download", json=["com.a", "com.b", "com.c"])
+    assert response.status_code == 503
+    assert response.headers["retry-after"].isdigit()
+    assert response.json()["detail"].startswith("Server busy: download queue full")
+
+
+def cache_xapk(package_name="com.example"):
+    data = make_xapk()
+    path = os.path.join(api_server.DOWNLOADS_DIR, f"{package_name}_test.xapk")
+    with open(path, "wb") as f:
+        f.write(data)
+    api_server.file_cache[api_server.package_cache_key(package_name, "1.0")] = {
+        "package_name": package_name, "version": "1.0", "file_path": path, "file_type": "xapk",
+        "size": len(data), "sha256": "ab" * 32, "engine": "test", "expires_at": 0}
+    return path
+
+
+def test_members_stream_out_of_the_cached_xapk():
+    cache_xapk()
+    stored = request("GET", "/member/com.example/com.example.apk")
+    assert stored.status_code == 200 and stored.content == SPLIT
+    assert stored.headers["x-member-compression"] == "stored"
+    assert stored.headers["content-disposition"] == 'attachment; filename="com.example.apk"'
+
+    # Stored members are a window of the archive, so byte ranges work on them
+    tail = request("GET", "/member/com.example/com.example.apk", headers={"range": "bytes=-100"})
+    assert tail.status_code == 206 and tail.content == SPLIT[-100:]
+    assert tail.headers["content-range"] == f"bytes {len(SPLIT) - 100}-{len(SPLIT) - 1}/{len(SPLIT)}"
+
+    deflated = request("GET", "/member/com.example/config.arm64_v8a.apk")
+    assert deflated.status_code == 200 and deflated.content == SPLIT
+    assert deflated.headers["x-member-compression"] == "deflated" and deflated.headers["accept-ranges"] == "none"
+    assert deflated.headers["x-member-crc32"] == stored.headers["x-member-crc32"]
+
+    etag = deflated.headers["etag"]
+    assert request("GET", "/member/com.example/config.arm64_v8a.apk",
+                   headers={"if-none-match": etag}).status_code == 304
+
+    missing = request("GET", "/member/com.example/config.x86.apk")
+    assert missing.status_code == 404
+
+
+def test_unreadable_archive_is_422():
+    path = cache_xapk()
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 30)
+    # Same size as recorded is what makes a cached file count as intact; keep it so
+    api_server.file_cache.set_field(api_server.package_cache_key("com.example", "1.0"), "size", os.path.getsize(path))
+    assert request("GET", "/member/com.example/com.example.apk").status_code == 422
+
+
+class FakeAria2:
+    """aria2 over system.multicall: addUri writes the file at once, tellStatus reports it complete"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.batches = []
+        self.gids = {}
+
+    def multicall2(self, calls):
+        self.batches.append([method for method, _ in calls])
+        results = []
+        for method, params in calls:
+            if method == "aria2.addUri":
+                url, options = params[0][0], params[1]
+                gid = f"gid{len(self.gids)}"
+                self.gids[gid] = url
+                with open(os.path.join(options["dir"], options["out"]), "wb") as f:
+                    f.write(b"<html>blocked</html>" if any(p in url for p in self.failing) else make_xapk())
+                results.append([gid])
+            elif method == "aria2.tellStatus":
+                results.append([{"gid": params[0], "status": "complete"}])
+            else:
+                results.append(["OK"])
+        return results
+
+
+def test_batch_streams_each_result_and_submits_in_multicalls(monkeypatch, resolver):
+    aria2 = FakeAria2(failing=["com.bad"])
+    monkeypatch.setattr(api_server, "aria2_client", aria2)
+    monkeypatch.setattr(api_server, "BATCH_POLL_INTERVAL", 0.01)
+    cache_xapk("com.cached")
+
+    packages = ["com.a", "com.b", "com.bad", "missing.app", "com.cached"]
+    response = request("POST", "/batch-download?stream=true", json=packages)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    results = {line["package_name"]: line for line in lines[:-1]}
+
+    assert lines[-1] == {"done": True, "total": 5, "successful": 3, "failed": 2}
+    assert results["com.cached"]["cached"] and "com.cached" not in resolver["calls"]
+    assert results["com.a"]["success"] and results["com.a"]["size"] == len(make_xapk())
+    assert results["com.bad"]["error"] == "Got HTML instead of file"
+    assert results["missing.app"]["error"] == "missing.app not found"
+    assert api_server.find_cached_package("com.a") and not api_server.find_cached_package("com.bad")
+
+    # Every submission and poll is a single round trip, never one call per package
+    assert all(len(set(batch)) == 1 for batch in aria2.batches)
+    assert sum(batch.count("aria2.addUri") for batch in aria2.batches) == 3
+    assert api_server.download_scheduler.reserved_bytes() == 0
+
+
+def test_batch_without_streaming_keeps_the_summary_shape(monkeypatch, resolver):
+    monkeypatch.setattr(api_server, "aria2_client", FakeAria2())
+    monkeypatch.setattr(api_server, "BATCH_POLL_INTERVAL", 0.01)
+    body = request("POST", "/batch-download", json=["com.a", "missing.app"]).json()
+    assert (body["total"], body["successful"], body["failed"]) == (2, 1, 1)
+    assert [r["package_name"] for r in body["results"]] == ["missing.app", "com.a"]
+
+
+def test_bulk_info_answers_known_packages_first_and_bounds_concurrency(monkeypatch, resolver):
+    monkeypatch.setattr(api_server, "info_semaphore", asyncio.Semaphore(3))
+    api_server.url_cache["com.known"] = ({"size": 5, "file_type": "apk", "version": "2.0"}, api_server.time.time())
+    packages = ["com.known"] + [f"com.app{i}" for i in range(10)] + ["missing.app", "com.app0"]
+
+    body = request("POST", "/info", json=packages).json()
+    assert (body["total"], body["successful"], body["failed"]) == (12, 11, 1)
+    assert [r["package_name"] for r in body["results"]] == list(dict.fromkeys(packages))
+    assert body["results"][0]["from"] == "url_cache" and body["results"][0]["version"] == "2.0"
+    assert body["results"][-1] == {"package_name": "missing.app", "success": False, "error": "missing.app not found"}
+    assert "com.known" not in resolver["calls"] and len(resolver["calls"]) == 11
+    assert resolver["peak"] == 3
+
+    # Each request() runs its own event loop, which a semaphore that has been waited on is bound to
+    monkeypatch.setattr(api_server, "info_semaphore", asyncio.Semaphore(3))
+    lines = [json.loads(line) for line in request("POST", "/info?stream=true", json=packages).text.splitlines()]
+    assert lines[0]["package_name"] == "com.known"
+    assert lines[-1] == {"done": True, "total": 12, "successful": 11, "failed": 1}
+
+    too_many = [f"com.app{i}" for i in range(api_server.BULK_INFO_MAX + 1)]
+    assert request("POST", "/info", json=too_many).status_code == 400
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+import apkpure_client
+from apkpure_client import APKPureClient
+from budget import BudgetExceeded, request_budget
+from providers import ProviderResolver
+
+
+class NoNetwork:
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        raise AssertionError(f"GET {url} sent after the budget ran out")
+
+    head = get
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = APKPureClient()
+    stub = NoNetwork()
+    monkeypatch.setattr(APKPureClient, "scraper", property(lambda self: stub))
+    monkeypatch.setattr(apkpure_client, "curl_head", stub.head)
+    client.stub = stub
+    return client
+
+
+def test_resolve_over_budget_is_a_504_not_a_provider_failure(client):
+    resolver = ProviderResolver([client])
+
+    with request_budget(60, attempts=0):
+        with pytest.raises(BudgetExceeded) as raised:
+            asyncio.run(resolver.resolve("com.example.app"))
+
+    assert raised.value.status_code == 504
+    assert client.stub.calls == 0
+    assert resolver.snapshot()["providers"]["apkpure"]["failures"] == 0
+
+
+def test_url_verification_stops_at_the_budget(client):
+    with request_budget(60, attempts=5) as budget:
+        budget.cancel("deadline passed")
+        with pytest.raises(BudgetExceeded):
+            client.verify_download_url("https://d.apkpure.com/b/XAPK/com.example.app?version=latest")
+    assert client.stub.calls == 0
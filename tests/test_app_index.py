@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from app_index import AppIndex, deletions, edit_distance, max_edits
+
+APPS = [
+    {"appId": "com.whatsapp", "title": "WhatsApp Messenger", "developer": "WhatsApp LLC"},
+    {"appId": "org.telegram.messenger", "title": "Telegram", "developer": "Telegram FZ-LLC"},
+    {"appId": "com.spotify.music", "title": "Spotify: Music and Podcasts", "developer": "Spotify AB"},
+    {"appId": "com.instagram.android", "title": "Instagram", "developer": "Instagram"},
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = AppIndex(str(tmp_path / "app_index.json"))
+    index.add_results(APPS)
+    return index
+
+
+def ids(result):
+    return [r["appId"] for r in result.results]
+
+
+def test_edit_helpers():
+    assert max_edits("abc") == 0
+    assert max_edits("spotify") == 1
+    assert max_edits("instagram") == 2
+    assert "sptify" in deletions("spotify", 1)
+    assert edit_distance("telegarm", "telegram", 2) == 2
+    assert edit_distance("kitten", "sitting", 1) == 2
+
+
+def test_exact_and_prefix(index):
+    assert ids(index.search("telegram"))[0] == "org.telegram.messenger"
+    assert ids(index.search("spot"))[0] == "com.spotify.music"
+    # Every query token has to match
+    assert ids(index.search("spotify telegram")) == []
+
+
+def test_typos(index):
+    assert ids(index.search("spotfy")) == ["com.spotify.music"]
+    assert ids(index.search("instagarm")) == ["com.instagram.android"]
+    # Too short to guess at
+    assert ids(index.search("spt")) == []
+
+
+def test_title_outranks_developer(index):
+    index.add_results([{"appId": "com.example.fan", "title": "Fan app", "developer": "Messenger Fans"}])
+    # Title, then package segment, then developer
+    assert ids(index.search("messenger")) == ["com.whatsapp", "org.telegram.messenger", "com.example.fan"]
+
+
+def test_fuzzy_matches_do_not_complete_the_answer(index):
+    assert index.search("telegram", limit=1).complete
+    assert not index.search("telegarm", limit=1).complete
+
+
+def test_freshness(index):
+    assert index.search("telegram").results[0]["freshness"] == "fresh"
+    index.fresh_for = -1
+    result = index.search("telegram")
+    assert result.stale and result.results[0]["freshness"] == "stale"
+
+
+def test_updates_reindex(index):
+    index.add_results([{"appId": "com.spotify.music", "title": "Sound Player"}])
+    assert ids(index.search("sound player")) == ["com.spotify.music"]
+    assert ids(index.search("podcasts")) == []
+    # What the update did not mention is kept
+    assert ids(index.search("spotify ab")) == ["com.spotify.music"]
+
+
+def test_eviction_keeps_newest(tmp_path):
+    index = AppIndex(str(tmp_path / "app_index.json"), max_apps=2)
+    for app in APPS[:3]:
+        index.add_results([app])
+        time.sleep(0.01)
+    assert len(index) == 2
+    assert "com.whatsapp" not in index
+
+
+def test_save_and_load_merge(index, tmp_path):
+    index.add_package("com.whatsapp")
+    assert index.save()
+    other = AppIndex(index.path)
+    assert other.load() == len(APPS)
+    assert other.get("com.whatsapp")["downloads"] == 1
+    assert ids(other.search("whatsapp"))[0] == "com.whatsapp"
@@ -0,0 +1,97 @@
+import io
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+from archive_utils import (StreamValidator, ZipFormatError, _apply_zip64_extra, iter_member, open_member,
+                           read_central_directory, read_entry, ZIP_EOCD_SIGNATURE)
+
+SPLIT = b"split apk " * 5000
+
+
+def make_zip(comment: bytes = b"") -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("manifest.json", b'{"package_name": "com.example"}', zipfile.ZIP_DEFLATED)
+        archive.writestr("config.arm64_v8a.apk", SPLIT, zipfile.ZIP_STORED)
+        archive.writestr("base.apk", SPLIT, zipfile.ZIP_DEFLATED)
+        archive.comment = comment
+    return buffer.getvalue()
+
+
+def to_zip64_eocd(data: bytes) -> bytes:
+    """The same archive with its EOCD values saturated and the real ones in a ZIP64 record, as large XAPKs have"""
+    position = data.rfind(ZIP_EOCD_SIGNATURE)
+    entries, cd_size, cd_offset = struct.unpack("<HII", data[position + 10:position + 20])
+    record = struct.pack("<4sQHHIIQQQQ", b"PK\x06\x06", 44, 45, 45, 0, 0, entries, entries, cd_size, cd_offset)
+    locator = struct.pack("<4sIQI", b"PK\x06\x07", 0, position, 1)
+    eocd = struct.pack("<4sHHHHIIH", ZIP_EOCD_SIGNATURE, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0)
+    return data[:position] + record + locator + eocd
+
+
+@pytest.fixture(params=["plain", "comment", "zip64"])
+def archive(request, tmp_path):
+    data = make_zip(b"x" * 300 if request.param == "comment" else b"")
+    if request.param == "zip64":
+        data = to_zip64_eocd(data)
+    path = tmp_path / "app.xapk"
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_central_directory(archive):
+    entries = {e.name: e for e in read_central_directory(archive)}
+    assert set(entries) == {"manifest.json", "config.arm64_v8a.apk", "base.apk"}
+    assert entries["config.arm64_v8a.apk"].method == 0
+    assert entries["base.apk"].method == 8
+    assert entries["base.apk"].uncompressed_size == len(SPLIT)
+    assert entries["base.apk"].crc == zlib.crc32(SPLIT)
+    assert read_entry(archive, entries["manifest.json"]) == b'{"package_name": "com.example"}'
+
+
+def test_iter_member_streams_both_methods(archive):
+    for entry in read_central_directory(archive):
+        f, offset = open_member(archive, entry)
+        data = b"".join(iter_member(f, entry, offset, chunk_size=4096))
+        assert zlib.crc32(data) == entry.crc
+        assert f.closed
+
+
+def test_iter_member_detects_crc_mismatch(tmp_path):
+    path = tmp_path / "app.xapk"
+    path.write_bytes(make_zip())
+    entry = next(e for e in read_central_directory(str(path)) if e.name == "base.apk")
+    entry.crc ^= 1
+    f, offset = open_member(str(path), entry)
+    with pytest.raises(ZipFormatError, match="CRC"):
+        b"".join(iter_member(f, entry, offset))
+
+
+def test_missing_eocd(tmp_path):
+    path = tmp_path / "broken.xapk"
+    path.write_bytes(make_zip()[:-30])
+    with pytest.raises(ZipFormatError):
+        read_central_directory(str(path))
+
+
+def test_zip64_extra_only_holds_overflowed_fields():
+    extra = struct.pack("<HH", 0x9901, 2) + b"\0\0" + struct.pack("<HHQQ", 0x0001, 16, 5 << 32, 7 << 32)
+    assert _apply_zip64_extra(extra, 0xFFFFFFFF, 10, 0xFFFFFFFF) == (5 << 32, 10, 7 << 32)
+
+
+def test_stream_validator():
+    data = make_zip()
+    validator = StreamValidator(min_size=1)
+    for start in range(0, len(data), 1000):
+        assert validator.feed(data[start:start + 1000])
+    assert validator.finish()
+
+    truncated = StreamValidator(min_size=1)
+    truncated.feed(data[:-10])
+    assert not truncated.finish()
+
+    html = StreamValidator(min_size=1)
+    assert not html.feed(b"<!DOCTYPE html><html>blocked</html>")
+    assert html.error == "Got HTML instead of file"
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import budget
+from budget import (BudgetExceeded, budget_exhausted, budget_timeout, check_budget, current_budget,
+                    request_budget, spend)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(budget, "time", fake)
+    return fake
+
+
+def test_attempts_are_drawn_from_one_pool():
+    with request_budget(60, 2, "GET /download"):
+        spend("probe")
+        spend("download")
+        with pytest.raises(BudgetExceeded) as raised:
+            spend("retry")
+        assert raised.value.status_code == 504
+        assert "all 2 upstream attempts used (last: download)" in raised.value.detail
+        # Spent stays spent, even for a plain check after the error was swallowed
+        with pytest.raises(BudgetExceeded):
+            check_budget()
+    assert current_budget() is None
+    spend("outside any request")
+
+
+def test_deadline_and_timeouts(clock):
+    with request_budget(30, 5) as spent:
+        assert budget_timeout(60) == 30
+        assert budget_timeout(10) == 10
+        spend("search")
+        clock.now += 29.95
+        assert budget_timeout(None) == 0.1
+        clock.now += 0.1
+        assert budget_exhausted()
+        with pytest.raises(BudgetExceeded) as raised:
+            check_budget()
+        assert raised.value.reason == "deadline of 30s passed during search"
+        assert spent.snapshot()["exhausted"] == raised.value.reason
+    assert budget_timeout(60) == 60
+
+
+def test_nested_budgets_inherit_unless_told_not_to(clock):
+    with request_budget(10, 5):
+        clock.now += 4
+        with request_budget(60, 3) as inner:
+            assert inner.remaining() == 6
+        with request_budget(60, 3, inherit=False) as detached:
+            assert detached.remaining() == 60
+
+
+def test_cancel_stops_work_at_its_next_check():
+    with request_budget(60, 5) as spent:
+        spent.cancel("every requester went away")
+        spent.cancel("a later reason")
+        with pytest.raises(BudgetExceeded) as raised:
+            spend("download")
+        assert raised.value.reason == "every requester went away"
+
+
+def test_tasks_started_by_a_request_share_its_budget():
+    async def worker():
+        spend("from a task")
+
+    async def main():
+        with request_budget(60, 3) as spent:
+            await asyncio.gather(worker(), worker())
+            assert spent.used == 2
+
+    asyncio.run(main())
+
+
+def test_middleware_gives_each_http_request_a_budget():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(current_budget() and current_budget().snapshot()["label"])
+
+    middleware = budget.BudgetMiddleware(app, deadline=60, attempts=3)
+    asyncio.run(middleware({"type": "http", "method": "GET", "path": "/info"}, None, None))
+    asyncio.run(middleware({"type": "lifespan"}, None, None))
+    assert seen == ["GET /info", None]
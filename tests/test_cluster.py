@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import io
+import os
+import zipfile
+
+import httpx
+from starlette.requests import Request
+
+from cluster import FORWARDED_HEADER, Cluster, HashRing
+
+NODES = ["http://a:5000", "http://b:5000", "http://c:5000"]
+PACKAGES = [f"com.example.app{i}" for i in range(2000)]
+
+
+def make_request(path="/download/com.example", headers=None):
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": raw})
+
+
+def use_transport(cluster, handler):
+    cluster._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def make_apk() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("classes.dex", os.urandom(600000), zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+
+def test_adding_a_node_moves_only_its_share():
+    before = HashRing(NODES)
+    after = HashRing(NODES + ["http://d:5000"])
+    moved = [p for p in PACKAGES if before.owner(p) != after.owner(p)]
+    assert all(after.owner(p) == "http://d:5000" for p in moved)
+    assert 0.15 < len(moved) / len(PACKAGES) < 0.35
+    assert sorted(before.owners(PACKAGES[0])) == NODES
+    assert HashRing([]).owner("com.example") is None
+
+
+def test_ownership_membership_and_bounces():
+    cluster = Cluster("a:5000/", NODES[1:])
+    assert cluster.enabled and cluster.self_url == "http://a:5000"
+    assert Cluster("http://a:5000", []).enabled is False
+
+    remote = next(p for p in PACKAGES if cluster.owner_of(p) != cluster.self_url)
+    local = next(p for p in PACKAGES if cluster.owner_of(p) == cluster.self_url)
+    assert cluster.remote_owner(local) is None
+    assert cluster.remote_owner(remote) == cluster.owner_of(remote)
+    assert cluster.remote_owner(remote, make_request(headers={FORWARDED_HEADER: "http://b:5000"})) is None
+
+    cluster.mark_down(cluster.owner_of(remote), "ConnectError")
+    assert cluster.remote_owner(remote) is None
+
+    assert cluster.is_peer("b:5000") and not cluster.is_peer("http://a:5000")
+    assert not cluster.is_peer("http://evil:5000") and not cluster.is_peer(None)
+
+
+def test_forward_proxies_to_the_owner_or_falls_back():
+    cluster = Cluster("http://a:5000", NODES[1:])
+    package = next(p for p in PACKAGES if cluster.owner_of(p) == "http://b:5000")
+    seen = []
+
+    def owner(request):
+        seen.append(request)
+        return httpx.Response(206, headers={"content-range": "bytes 0-1/10", "connection": "close"}, content=b"PK")
+
+    async def main():
+        use_transport(cluster, owner)
+        response = await cluster.forward(make_request(f"/download/{package}", {"range": "bytes=0-1",
+                                                                              "cookie": "secret"}), package)
+        assert response.status_code == 206
+        assert response.headers["x-cluster-node"] == "http://b:5000" and "connection" not in response.headers
+        sent = seen[0]
+        assert str(sent.url) == f"http://b:5000/download/{package}"
+        assert sent.headers["range"] == "bytes=0-1" and "cookie" not in sent.headers
+        assert sent.headers[FORWARDED_HEADER] == "http://a:5000"
+
+        def unreachable(request):
+            raise httpx.ConnectError("refused")
+        use_transport(cluster, unreachable)
+        assert await cluster.forward(make_request(f"/download/{package}"), package) is None
+        assert not cluster.is_up("http://b:5000") and cluster.fallbacks == 1
+
+    asyncio.run(main())
+
+
+def test_pull_validates_the_peers_file(tmp_path):
+    cluster = Cluster("http://a:5000", NODES[1:])
+    data = make_apk()
+    path = str(tmp_path / "pulled.part")
+
+    def peer(checksum):
+        return lambda request: httpx.Response(200, headers={"x-content-sha256": checksum}, content=data)
+
+    async def main():
+        use_transport(cluster, peer(hashlib.sha256(data).hexdigest()))
+        validator, headers = await cluster.pull("http://b:5000", "com.example", path)
+        assert validator.error is None and open(path, "rb").read() == data
+        assert cluster.pulled == 1
+
+        use_transport(cluster, peer("0" * 64))
+        validator, _ = await cluster.pull("http://b:5000", "com.example", path)
+        assert validator.error == "checksum mismatch with peer"
+
+        use_transport(cluster, lambda request: httpx.Response(200, content=b"<html>busy</html>" * 100))
+        validator, _ = await cluster.pull("http://b:5000", "com.example", path)
+        assert validator.error == "Got HTML instead of file"
+
+        use_transport(cluster, lambda request: httpx.Response(404))
+        validator, _ = await cluster.pull("http://b:5000", "com.example", path)
+        assert validator.error == "peer returned HTTP 404"
+
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+
+import download_jobs
+from download_jobs import JobManager
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(download_jobs, "REMOTE_POLL_INTERVAL", 0.01)
+
+
+def runner(manager, release):
+    async def run(job):
+        try:
+            manager.update(job, status="downloading", total_bytes=100)
+            await release.wait()
+            manager.update(job, status="done", completed_bytes=100, file_type="apk")
+        except asyncio.CancelledError:
+            manager.update(job, status="cancelled")
+            raise
+    return run
+
+
+def statuses(events):
+    return [json.loads(event.split("data: ", 1)[1])["status"] for event in events if event.startswith("event:")]
+
+
+def test_jobs_are_deduplicated_per_package_and_stream_to_the_end():
+    async def main():
+        manager = JobManager()
+        release = asyncio.Event()
+        job, new = manager.submit("com.a", "u1", runner(manager, release))
+        again, new_again = manager.submit("com.a", "u2", runner(manager, release))
+        assert new and not new_again and again is job
+
+        events = []
+
+        async def follow():
+            async for event in manager.events(job):
+                events.append(event)
+
+        follower = asyncio.ensure_future(follow())
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.wait_for(follower, 1)
+        assert statuses(events) == ["downloading", "done"]
+        assert job.to_dict()["progress"] == 100.0 and not job.subscribers
+
+        # Finished, so the next request for the package is a new job
+        assert manager.submit("com.a", "u1", runner(manager, release))[1]
+
+    asyncio.run(main())
+
+
+def test_progress_is_throttled_and_never_reopens_a_finished_job():
+    async def main():
+        manager = JobManager()
+        job, _ = manager.submit("com.a", None, runner(manager, asyncio.Event()))
+        report = manager.progress_callback(job)
+        report(10, 100)
+        report(20, 100)
+        await asyncio.sleep(0)
+        assert job.completed_bytes == 10
+
+        report(100, 100)
+        await asyncio.sleep(0)
+        assert job.completed_bytes == 100
+
+        job.task.cancel()
+        await asyncio.sleep(0)
+        assert job.status == "cancelled"
+        report(100, 100)
+        await asyncio.sleep(0)
+        assert job.status == "cancelled"
+
+    asyncio.run(main())
+
+
+def test_jobs_are_shared_and_cancelled_across_workers_through_the_store():
+    async def main():
+        store = {}
+        owner, other = JobManager(store=store), JobManager(store=store)
+        job, _ = owner.submit("com.a", None, runner(owner, asyncio.Event()))
+        await asyncio.sleep(0)
+
+        seen, new = other.submit("com.a", None, runner(other, asyncio.Event()))
+        assert not new and seen.id == job.id and seen.remote
+        assert other.get(job.id).status == "downloading"
+
+        events = []
+
+        async def follow():
+            async for event in other.events(seen):
+                events.append(event)
+
+        follower = asyncio.ensure_future(follow())
+        assert other.cancel(seen)
+        await asyncio.wait_for(follower, 1)
+        assert job.status == "cancelled"
+        assert statuses(events) == ["downloading", "cancelled"]
+        assert "active:com.a" not in store
+        assert other.snapshot() == {"total": 1, "by_status": {"cancelled": 1}}
+
+    asyncio.run(main())
+
+
+def test_stale_jobs_stop_deduplicating():
+    async def main():
+        store = {}
+        owner = JobManager(store=store)
+        job, _ = owner.submit("com.a", None, runner(owner, asyncio.Event()))
+        await asyncio.sleep(0)
+        store[job.id] = {**store[job.id], "updated_at": store[job.id]["updated_at"] - 1000}
+
+        # The worker that owned it is presumed dead
+        fresh, new = JobManager(store=store, stale_after=900).submit("com.a", None, runner(owner, asyncio.Event()))
+        assert new and fresh.id != job.id
+        job.task.cancel()
+        fresh.task.cancel()
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
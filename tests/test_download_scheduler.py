@@ -0,0 +1,102 @@
+import asyncio
+
+from download_scheduler import BULK_LANE, FAST_LANE, INTERNAL_PREFIX, DownloadScheduler
+
+MB = 1024 * 1024
+
+
+def test_lane_for_size():
+    scheduler = DownloadScheduler(fast_lane_max_bytes=100 * MB)
+    assert scheduler.lane_for_size(10 * MB) == FAST_LANE
+    assert scheduler.lane_for_size(100 * MB) == FAST_LANE
+    assert scheduler.lane_for_size(101 * MB) == BULK_LANE
+    # Unknown sizes could be anything, so they never take a fast slot
+    assert scheduler.lane_for_size(0) == BULK_LANE
+
+
+def test_round_robin_between_users():
+    async def main():
+        scheduler = DownloadScheduler(fast_slots=1, bulk_slots=1, per_user_limit=3)
+        first = await scheduler.acquire("alice", "a0", MB)
+        waiters = [asyncio.ensure_future(scheduler.acquire(user, f"{user}{i}", MB))
+                   for user, i in (("alice", 1), ("alice", 2), ("bob", 1))]
+        await asyncio.sleep(0)
+
+        order = [t.package_name for t in scheduler.lanes[FAST_LANE].dispatch_order()]
+        # alice was just served, so bob goes first despite queueing last
+        assert order == ["bob1", "alice1", "alice2"]
+
+        started = []
+        scheduler.release(first)
+        for _ in range(3):
+            done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            ticket = done.pop().result()
+            waiters = [w for w in waiters if not w.done()]
+            started.append(ticket.package_name)
+            scheduler.release(ticket)
+        assert started == ["bob1", "alice1", "alice2"]
+
+    asyncio.run(main())
+
+
+def test_per_user_quota_lets_others_through():
+    async def main():
+        scheduler = DownloadScheduler(fast_slots=10, bulk_slots=1, per_user_limit=2)
+        held = [await scheduler.acquire("alice", f"a{i}", MB) for i in range(2)]
+        blocked = asyncio.ensure_future(scheduler.acquire("alice", "a2", MB))
+        other = await asyncio.wait_for(scheduler.acquire("bob", "b0", MB), 1)
+        await asyncio.sleep(0)
+
+        assert not blocked.done()
+        assert other.user_id == "bob"
+        assert scheduler.user_status("alice")[-1]["state"] == "queued"
+
+        scheduler.release(held[0])
+        ticket = await asyncio.wait_for(blocked, 1)
+        assert ticket.package_name == "a2"
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def main():
+        scheduler = DownloadScheduler(fast_slots=1, bulk_slots=1)
+        held = await scheduler.acquire("alice", "a0", MB)
+        waiter = asyncio.ensure_future(scheduler.acquire("bob", "b0", MB))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        assert scheduler.queued == 0
+        scheduler.release(held)
+        assert scheduler.snapshot()["lanes"][FAST_LANE]["active"] == 0
+
+    asyncio.run(main())
+
+
+def test_reserved_bytes_counts_active_queued_and_outside():
+    async def main():
+        scheduler = DownloadScheduler(fast_slots=1, bulk_slots=1)
+        held = await scheduler.acquire("alice", "a0", 5 * MB)
+        waiter = asyncio.ensure_future(scheduler.acquire("bob", "b0", 7 * MB))
+        await asyncio.sleep(0)
+        scheduler.reserve(3 * MB)
+        assert scheduler.reserved_bytes() == 15 * MB
+
+        scheduler.unreserve(3 * MB)
+        scheduler.release(held)
+        scheduler.release(await waiter)
+        assert scheduler.reserved_bytes() == 0
+
+    asyncio.run(main())
+
+
+def test_internal_keys_are_not_held_to_the_user_quota():
+    async def main():
+        scheduler = DownloadScheduler(fast_slots=10, bulk_slots=1, per_user_limit=1)
+        tickets = [await asyncio.wait_for(scheduler.acquire(f"{INTERNAL_PREFIX}peer:http://b", f"p{i}", MB), 1)
+                   for i in range(3)]
+        assert len(tickets) == 3
+        assert scheduler.snapshot()["lanes"][FAST_LANE]["active"] == 3
+
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+import pytest
+
+import engine_stats
+from engine_stats import EngineSelector, size_class
+
+MB = 1024 * 1024
+ENGINES = ["aria2", "httpx", "curl_cffi"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(engine_stats, "time", fake)
+    return fake
+
+
+def fail(selector, engine, times, host="d.apkpure.com", size=MB):
+    for _ in range(times):
+        selector.record(engine, host, size, False, 0, 1.0)
+
+
+def test_size_class():
+    assert size_class(0) == "small"
+    assert size_class(50 * MB) == "medium"
+    assert size_class(2048 * MB) == "large"
+
+
+def test_configured_order_until_there_is_data(clock):
+    selector = EngineSelector(ENGINES, min_samples=4)
+    assert selector.order("d.apkpure.com", MB) == ENGINES
+
+
+def test_faster_engine_moves_up(clock):
+    selector = EngineSelector(ENGINES, min_samples=2)
+    for _ in range(2):
+        selector.record("aria2", "d.apkpure.com", MB, True, 10 * MB, 10.0)
+        selector.record("httpx", "d.apkpure.com", MB, True, 10 * MB, 1.0)
+    assert selector.order("d.apkpure.com", MB)[:2] == ["httpx", "aria2"]
+    # Other hosts and size classes keep their own history
+    assert selector.order("apkpure.com", MB) == ENGINES
+    assert selector.order("d.apkpure.com", 600 * MB) == ENGINES
+
+
+def test_degraded_engine_is_skipped_then_probed(clock):
+    selector = EngineSelector(ENGINES, min_samples=4, degraded_below=0.3, probe_interval=120.0)
+    fail(selector, "aria2", 6)
+    assert selector.order("d.apkpure.com", MB) == ["httpx", "curl_cffi"]
+
+    clock.now += 120
+    # The probe goes first, and only one caller gets it
+    assert selector.order("d.apkpure.com", MB) == ["aria2", "httpx", "curl_cffi"]
+    assert selector.order("d.apkpure.com", MB) == ["httpx", "curl_cffi"]
+
+    selector.record("aria2", "d.apkpure.com", MB, True, MB, 1.0)
+    assert "aria2" in selector.order("d.apkpure.com", MB)
+
+
+def test_all_degraded_still_tries_everything(clock):
+    selector = EngineSelector(ENGINES, min_samples=4)
+    for engine in ENGINES:
+        fail(selector, engine, 6)
+    clock.now += 10
+    assert sorted(selector.order("d.apkpure.com", MB)) == sorted(ENGINES)
+
+
+def test_order_preview_does_not_take_the_probe(clock):
+    selector = EngineSelector(ENGINES, min_samples=4, probe_interval=120.0)
+    fail(selector, "aria2", 6)
+    clock.now += 120
+    assert selector.order_preview("d.apkpure.com", "small")[-1] == "aria2"
+    assert selector.snapshot()["d.apkpure.com"]["small"]["aria2"]["degraded"]
+    assert selector.order("d.apkpure.com", MB)[0] == "aria2"
@@ -0,0 +1,117 @@
+import os
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+from starlette.applications import Starlette
+from starlette.routing import Route
+
+from file_serving import etag_matches, file_response, make_etag, parse_range
+
+SIZE = 1000 * 1000
+ETAG = make_etag("abc123")
+
+
+def test_parse_range():
+    assert parse_range("bytes=-100", 1000) == ((900, 999), False)
+    assert parse_range("bytes=-5000", 1000) == ((0, 999), False)
+    assert parse_range("bytes=900-", 1000) == ((900, 999), False)
+    assert parse_range("bytes=10-19", 1000) == ((10, 19), False)
+    assert parse_range("bytes=10-5000", 1000) == ((10, 999), False)
+    assert parse_range("bytes=1000-", 1000) == (None, True)
+    assert parse_range("bytes=-0", 1000) == (None, True)
+    assert parse_range("bytes=20-10", 1000) == (None, True)
+    assert parse_range("bytes=0-9,20-29", 1000) == (None, False)
+    assert parse_range("items=0-9", 1000) == (None, False)
+    assert parse_range(None, 1000) == (None, False)
+
+
+def test_etag_matches_weakly():
+    assert etag_matches(ETAG, ETAG)
+    assert etag_matches(f'"other", W/{ETAG}', ETAG)
+    assert etag_matches("*", ETAG)
+    assert not etag_matches('"other"', ETAG)
+    assert not etag_matches(ETAG, None)
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("files") / "app.apk")
+    with open(path, "wb") as f:
+        f.write(bytes(i % 251 for i in range(SIZE)))
+
+    async def serve(request):
+        return file_response(request, path, etag=ETAG, filename="app.apk")
+
+    async def serve_fd(request):
+        # The descriptor outlives the path, as with a cache entry deleted mid-download
+        return file_response(request, path, etag=ETAG, fd=os.open(path, os.O_RDONLY), base_offset=10, length=100)
+
+    app = Starlette(routes=[Route("/file", serve, methods=["GET", "HEAD"]), Route("/fd", serve_fd)])
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    uv = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error", lifespan="off"))
+    thread = threading.Thread(target=uv.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not uv.started and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with open(path, "rb") as f:
+        yield f"http://127.0.0.1:{port}", f.read()
+    uv.should_exit = True
+    thread.join(5)
+
+
+def get(server, route="/file", **headers):
+    base, _ = server
+    return httpx.get(base + route, headers=headers)
+
+
+def test_whole_file_is_read_through_pread_under_uvicorn(server):
+    _, data = server
+    response = get(server)
+    assert response.status_code == 200
+    assert response.headers["etag"] == ETAG
+    assert response.headers["content-length"] == str(SIZE)
+    assert response.content == data
+
+
+def test_ranges(server):
+    _, data = server
+    response = get(server, range="bytes=-100")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {SIZE - 100}-{SIZE - 1}/{SIZE}"
+    assert response.content == data[-100:]
+
+    response = get(server, range=f"bytes={SIZE - 300000}-")
+    assert response.status_code == 206 and response.content == data[-300000:]
+
+    response = get(server, range=f"bytes={SIZE}-")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{SIZE}"
+
+    response = get(server, range="bytes=0-9,20-29")
+    assert response.status_code == 200 and response.content == data
+
+
+def test_conditional_requests(server):
+    _, data = server
+    response = get(server, **{"if-none-match": f"W/{ETAG}"})
+    assert response.status_code == 304 and response.content == b""
+
+    response = get(server, range="bytes=0-9", **{"if-range": ETAG})
+    assert response.status_code == 206 and response.content == data[:10]
+    response = get(server, range="bytes=0-9", **{"if-range": '"stale"'})
+    assert response.status_code == 200 and response.content == data
+
+
+def test_passed_descriptor_and_window(server):
+    _, data = server
+    response = get(server, "/fd")
+    assert response.status_code == 200 and response.content == data[10:110]
+    response = get(server, "/fd", range="bytes=-10")
+    assert response.status_code == 206 and response.content == data[100:110]
@@ -0,0 +1,100 @@
+import asyncio
+import io
+import os
+
+import pytest
+
+import icon_cache
+from icon_cache import IconCache, icon_source_allowed, sniff_image_type
+
+Image = pytest.importorskip("PIL.Image")
+
+SRC = "https://image.winudf.com/v2/icon.png"
+
+
+def make_png(width=300, height=200) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (255, 0, 0)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class Upstream:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, src):
+        self.calls.append(src)
+        await asyncio.sleep(0.01)
+        return make_png()
+
+
+def test_icon_sources_and_sniffing():
+    assert icon_source_allowed(SRC)
+    assert icon_source_allowed("https://lh3.googleusercontent.com/x")
+    assert not icon_source_allowed("https://evilwinudf.com/x.png")
+    assert not icon_source_allowed("file:///etc/passwd")
+    assert sniff_image_type(make_png()) == "image/png"
+    assert sniff_image_type(b"RIFF\0\0\0\0WEBPVP8 ") == "image/webp"
+    assert sniff_image_type(b"<html>") == "application/octet-stream"
+
+
+def test_concurrent_requests_fetch_and_render_once(tmp_path):
+    async def main():
+        cache = IconCache(str(tmp_path))
+        upstream = Upstream()
+        results = await asyncio.gather(*[cache.get(SRC, 96, "webp", upstream) for _ in range(5)])
+        assert len(upstream.calls) == 1 and cache.renders == 1 and cache.hits == 4
+        assert cache._locks == {}
+
+        path, media_type, st = results[0]
+        assert media_type == "image/webp" and st.st_size == os.path.getsize(path)
+        with Image.open(path) as icon:
+            assert icon.size == (96, 96)
+
+        # Another size renders from the stored original instead of fetching again
+        path, media_type, _ = await cache.get(SRC, 192, "jpeg", upstream)
+        assert len(upstream.calls) == 1 and cache.renders == 2
+        with Image.open(path) as icon:
+            assert (icon.format, icon.mode, icon.size) == ("JPEG", "RGB", (192, 192))
+
+    asyncio.run(main())
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    async def main():
+        cache = IconCache(str(tmp_path), max_bytes=1)
+        upstream = Upstream()
+        first, _, _ = await cache.get(SRC, 96, "webp", upstream)
+        second, _, _ = await cache.get(SRC + "?2", 96, "webp", upstream)
+        assert os.path.exists(second) and not os.path.exists(first)
+        assert cache.snapshot()["files"] == 1 and cache.evictions == 3
+
+        # A file another worker evicted is rebuilt rather than served from a stale listing
+        os.remove(second)
+        await cache.get(SRC + "?2", 96, "webp", upstream)
+        assert len(upstream.calls) == 3
+
+    asyncio.run(main())
+
+
+def test_existing_files_are_picked_up_on_start(tmp_path):
+    async def main():
+        upstream = Upstream()
+        await IconCache(str(tmp_path)).get(SRC, 96, "webp", upstream)
+        restarted = IconCache(str(tmp_path))
+        assert restarted.snapshot()["files"] == 2
+        await restarted.get(SRC, 96, "webp", upstream)
+        assert len(upstream.calls) == 1 and restarted.hits == 1
+
+    asyncio.run(main())
+
+
+def test_without_pillow_the_original_is_served(tmp_path, monkeypatch):
+    monkeypatch.setattr(icon_cache, "Image", None)
+
+    async def main():
+        cache = IconCache(str(tmp_path))
+        path, media_type, _ = await cache.get(SRC, 96, "webp", Upstream())
+        assert path.endswith(".src") and media_type == "image/png" and cache.renders == 0
+
+    asyncio.run(main())
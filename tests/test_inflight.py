@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from budget import current_budget
+from inflight import ClientDisconnected, SharedFetches
+
+TOTAL = 100 * 1024 * 1024
+
+
+class Engine:
+    """A fetch that reports progress in steps, advancing only when told to"""
+
+    def __init__(self):
+        self.step = asyncio.Event()
+        self.calls = 0
+        self.cancelled = False
+        self.budget = None
+
+    async def __call__(self, progress):
+        self.calls += 1
+        self.budget = current_budget()
+        completed = 0
+        try:
+            while completed < TOTAL:
+                await self.step.wait()
+                self.step.clear()
+                completed = min(TOTAL, completed + TOTAL // 4)
+                progress(completed, TOTAL)
+            return "file"
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    async def advance(self, steps=1):
+        for _ in range(steps):
+            self.step.set()
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+
+
+def gone_after(event):
+    async def disconnected():
+        return event.is_set()
+    return disconnected
+
+
+def test_joiner_attaching_mid_stream_shares_the_fetch():
+    async def main():
+        fetches = SharedFetches(poll_interval=0.01)
+        engine = Engine()
+        first_seen, joiner_seen = [], []
+        first = fetches.join("com.a", engine, 60, 3, progress=lambda c, t: first_seen.append(c))
+        waiter = asyncio.ensure_future(fetches.wait(first, progress=None))
+        await engine.advance()
+
+        joined = fetches.join("com.a", engine, 60, 3, progress=lambda c, t: joiner_seen.append(c))
+        assert joined is first and joined.holders == 2 and joined.completed == TOTAL // 4
+        joiner = asyncio.ensure_future(fetches.wait(joined))
+        await engine.advance(3)
+
+        assert await waiter == "file" and await joiner == "file"
+        assert engine.calls == 1
+        assert first_seen == [TOTAL // 4 * n for n in range(1, 5)]
+        assert joiner_seen == [TOTAL // 4 * n for n in range(2, 5)]
+        snapshot = fetches.snapshot()
+        assert snapshot["started"] == 1 and snapshot["joined"] == 1 and snapshot["active"] == {}
+
+    asyncio.run(main())
+
+
+def test_fetch_is_cancelled_when_the_last_holder_leaves():
+    async def main():
+        fetches = SharedFetches(poll_interval=0.01, keep_bytes=0)
+        engine = Engine()
+        left = [asyncio.Event(), asyncio.Event()]
+        fetch = fetches.join("com.a", engine, 60, 3)
+        fetches.join("com.a", engine, 60, 3)
+        waiters = [asyncio.ensure_future(fetches.wait(fetch, gone_after(event))) for event in left]
+        await engine.advance()
+
+        left[0].set()
+        with pytest.raises(ClientDisconnected):
+            await waiters[0]
+        assert fetch.holders == 1 and not fetch.task.done()
+
+        left[1].set()
+        with pytest.raises(ClientDisconnected):
+            await waiters[1]
+        await asyncio.sleep(0)
+        assert fetch.holders == 0 and fetch.task.cancelled() and engine.cancelled
+        assert engine.budget.exhausted == "every requester went away"
+        assert fetches.cancelled == 1 and fetches.disconnects == 2
+
+        # The next requester starts afresh rather than joining the cancelled fetch
+        assert fetches.join("com.a", engine, 60, 3) is not fetch
+        assert engine.calls == 1
+        await asyncio.sleep(0)
+        assert engine.calls == 2
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("keep_ratio, keep_bytes, steps, kept", [
+    (0.7, 0, 3, True),                    # 75% done, past keep_ratio
+    (0.9, 0, 3, False),                   # 75% done, short of keep_ratio
+    (1.0, TOTAL // 2, 2, True),           # half left, within keep_bytes
+    (1.0, TOTAL // 2 - 1, 2, False),
+    (0.0, TOTAL, 0, False),               # no progress yet: nothing to judge the size by
+])
+def test_abandoned_fetch_is_kept_when_nearly_done(keep_ratio, keep_bytes, steps, kept):
+    async def main():
+        fetches = SharedFetches(keep_ratio=keep_ratio, keep_bytes=keep_bytes)
+        engine = Engine()
+        fetch = fetches.join("com.a", engine, 60, 3)
+        await engine.advance(steps)
+        fetches.release(fetch)
+        await asyncio.sleep(0)
+        assert fetch.task.cancelled() != kept
+        assert (fetches.kept, fetches.cancelled) == ((1, 0) if kept else (0, 1))
+        if kept:
+            await engine.advance(4 - steps)
+            assert await fetch.task == "file"
+
+    asyncio.run(main())
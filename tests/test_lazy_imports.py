@@ -0,0 +1,61 @@
+import importlib
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from lazy_imports import lazy_import, preload
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_module_is_imported_on_first_use_only():
+    sys.modules.pop("colorsys", None)
+    colorsys = lazy_import("colorsys")
+    assert not colorsys.loaded and "colorsys" not in sys.modules
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert colorsys.loaded and "not loaded" not in repr(colorsys)
+
+
+def test_attribute_form_is_callable():
+    dedent = lazy_import("textwrap", "dedent")
+    assert dedent("  x\n  y") == "x\ny"
+
+
+def test_missing_module_is_falsy_and_raises_on_use():
+    missing = lazy_import("no_such_module_anywhere")
+    assert not missing
+    assert not missing
+    with pytest.raises(ImportError):
+        missing.anything
+    preload(missing)
+
+
+def test_concurrent_first_use_imports_once(monkeypatch):
+    calls = []
+    real_import = importlib.import_module
+
+    def counting_import(name):
+        calls.append(name)
+        return real_import(name)
+
+    monkeypatch.setattr("lazy_imports.importlib.import_module", counting_import)
+    json_module = lazy_import("json")
+    threads = [threading.Thread(target=preload, args=(json_module,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ["json"]
+
+
+def test_server_import_defers_heavy_dependencies(tmp_path):
+    env = {**os.environ, "DATA_DIR": str(tmp_path), "APP_CACHE_DIR": str(tmp_path)}
+    check = ("import sys, api_server; "
+             "print(','.join(m for m in ('curl_cffi', 'bs4', 'cloudscraper', 'PIL', 'aria2p') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", check], cwd=HERE, env=env, capture_output=True, text=True,
+                            timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.splitlines()[-1] == ""
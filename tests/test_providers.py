@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from budget import BudgetExceeded
+from providers import ProviderResolver, SourceProvider, StaticProvider
+
+INFO = {"download_url": "https://mirror.example/app.apk", "size": 10, "file_type": "apk"}
+
+
+def test_hedge_lets_fast_provider_win():
+    slow = StaticProvider("slow", {"app": INFO}, delay=1.0)
+    fast = StaticProvider("fast", {"app": INFO}, delay=0.01)
+    resolver = ProviderResolver([slow, fast], hedge_delay=0.05, min_hedge_delay=0.01)
+
+    started = time.monotonic()
+    result = asyncio.run(resolver.resolve("app"))
+
+    assert result["source"] == "fast"
+    assert time.monotonic() - started < 0.5
+    assert resolver.hedges == 1
+
+
+def test_no_hedge_when_favourite_answers_within_delay():
+    first = StaticProvider("first", {"app": INFO}, delay=0.01)
+    second = StaticProvider("second", {"app": INFO})
+    resolver = ProviderResolver([first, second], hedge_delay=0.5)
+
+    assert asyncio.run(resolver.resolve("app"))["source"] == "first"
+    assert second.calls == []
+    assert resolver.hedges == 0
+
+
+def test_failure_moves_on_without_waiting_for_hedge_delay():
+    broken = StaticProvider("broken", error=RuntimeError("down"))
+    empty = StaticProvider("empty")
+    good = StaticProvider("good", {"app": INFO})
+    resolver = ProviderResolver([broken, empty, good], hedge_delay=5.0)
+
+    started = time.monotonic()
+    assert asyncio.run(resolver.resolve("app"))["source"] == "good"
+    assert time.monotonic() - started < 1.0
+    assert resolver.snapshot()["providers"]["broken"]["failures"] == 1
+
+
+def test_nothing_found_returns_none():
+    resolver = ProviderResolver([StaticProvider("a"), StaticProvider("b")], hedge_delay=0.05)
+    assert asyncio.run(resolver.resolve("missing")) is None
+
+
+def test_scoring_prefers_provider_that_answers_the_package():
+    a = StaticProvider("a", {"other": INFO})
+    b = StaticProvider("b", {"app": INFO})
+    resolver = ProviderResolver([a, b], hedge_delay=0.05)
+    assert [p.name for p in resolver.order("app")] == ["a", "b"]
+
+    for _ in range(3):
+        asyncio.run(resolver.resolve("app"))
+
+    assert [p.name for p in resolver.order("app")] == ["b", "a"]
+
+
+def test_hedge_delay_follows_observed_latency():
+    provider = StaticProvider("p", {"app": INFO}, delay=0.02)
+    resolver = ProviderResolver([provider], hedge_delay=5.0, min_hedge_delay=0.5)
+    assert resolver._delay(provider) == 5.0
+
+    asyncio.run(resolver.resolve("app"))
+
+    assert resolver._delay(provider) == 0.5
+
+
+def test_budget_exceeded_propagates_and_is_not_counted():
+    provider = StaticProvider("p", error=BudgetExceeded("out of time"))
+    resolver = ProviderResolver([provider])
+
+    with pytest.raises(BudgetExceeded):
+        asyncio.run(resolver.resolve("app"))
+    assert resolver.snapshot()["providers"]["p"]["failures"] == 0
+
+
+def test_provider_must_implement_resolve():
+    with pytest.raises(TypeError):
+        SourceProvider()
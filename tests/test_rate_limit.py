@@ -0,0 +1,138 @@
+import pytest
+
+import rate_limit
+from rate_limit import CircuitBreaker, HostRateLimiter, TokenBucket, UpstreamUnavailable, host_key, is_throttled
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", fake)
+    return fake
+
+
+def test_host_key_folds_aliases():
+    assert host_key("https://www.apkpure.com/search?q=x") == "apkpure.com"
+    assert host_key("download.apkpure.com") == "d.apkpure.com"
+    assert host_key("https://example.com/") == "example.com"
+
+
+def test_is_throttled():
+    assert is_throttled(429)
+    assert is_throttled(200, {"cf-mitigated": "challenge"})
+    assert is_throttled(403, {"server": "cloudflare"})
+    assert is_throttled(200, {}, "<html><title>Just a moment...</title>")
+    assert not is_throttled(200, {}, "<html>app page</html>")
+    assert not is_throttled(404)
+
+
+def test_bucket_spaces_out_reservations(clock):
+    bucket = TokenBucket(rate=2.0, burst=2.0)
+    waits = [bucket._reserve("h") for _ in range(4)]
+    assert waits == [0.0, 0.0, 0.5, 1.0]
+
+    clock.now += 10
+    assert bucket._reserve("h") == 0.0
+
+
+def test_bucket_refuses_waits_past_max(clock):
+    bucket = TokenBucket(rate=1.0, burst=1.0, max_wait=2.0)
+    for _ in range(3):
+        bucket._reserve("h")
+    with pytest.raises(UpstreamUnavailable) as raised:
+        bucket._reserve("h")
+    assert raised.value.reason == "rate limited"
+
+
+def test_bucket_aimd(clock):
+    bucket = TokenBucket(rate=4.0, burst=4.0, min_rate=1.0, increase=0.5)
+    bucket.on_throttle()
+    assert bucket.rate == 2.0
+    # A burst of rejections within a second halves the rate once
+    bucket.on_throttle()
+    assert bucket.rate == 2.0
+
+    clock.now += 1
+    bucket.on_throttle()
+    clock.now += 1
+    bucket.on_throttle()
+    assert bucket.rate == 1.0
+
+    bucket.on_success()
+    assert bucket.rate == 1.5
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 4.0
+
+
+def test_bucket_honours_retry_after(clock):
+    bucket = TokenBucket(rate=10.0, burst=10.0)
+    bucket.on_throttle(retry_after=5.0)
+    assert bucket._reserve("h") == pytest.approx(5.0)
+
+
+def test_circuit_transitions(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30.0, max_cooldown=100.0, probe_timeout=60.0)
+    for _ in range(2):
+        breaker.on_failure("h")
+    assert breaker.state == "closed"
+    breaker.on_failure("h")
+    assert breaker.state == "open"
+    with pytest.raises(UpstreamUnavailable):
+        breaker.allow("h")
+
+    clock.now += 30
+    breaker.check("h")
+    assert breaker.state == "open"
+    breaker.allow("h")
+    assert breaker.state == "half_open"
+    # Only the one probe goes through
+    with pytest.raises(UpstreamUnavailable):
+        breaker.allow("h")
+
+    breaker.on_failure("h")
+    assert breaker.state == "open"
+    assert breaker.cooldown == 60.0
+
+    clock.now += 60
+    breaker.allow("h")
+    breaker.on_success("h")
+    assert breaker.state == "closed"
+    assert breaker.cooldown == 30.0
+    assert breaker.trips == 2
+
+
+def test_half_open_probe_that_never_reports_is_replaced(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=10.0, probe_timeout=60.0)
+    breaker.on_failure("h")
+    clock.now += 10
+    breaker.allow("h")
+    clock.now += 60
+    breaker.allow("h")
+    assert breaker.state == "half_open"
+
+
+def test_limiter_only_guards_apkpure(clock):
+    limiter = HostRateLimiter(failure_threshold=2)
+    assert limiter.record("https://example.com/", 429)
+    limiter.check("https://example.com/")
+    assert "example.com" not in limiter.snapshot()
+
+    limiter.record("https://apkpure.com/a", 503)
+    limiter.record("https://www.apkpure.com/b", 503)
+    assert limiter.is_open("https://m.apkpure.com/")
+    assert not limiter.is_open("https://d.apkpure.com/")
@@ -0,0 +1,113 @@
+import asyncio
+
+import search_cache
+from search_cache import SearchCache, normalize_query
+
+
+class Upstream:
+    def __init__(self, count=100, delay=0.02, error=None):
+        self.count = count
+        self.delay = delay
+        self.error = error
+        self.calls = []
+
+    async def __call__(self, query, limit):
+        self.calls.append((query, limit))
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return [f"{query}-{i}" for i in range(min(limit, self.count))]
+
+
+def test_normalize_query():
+    assert normalize_query("  WhatsApp   Messenger ") == "whatsapp messenger"
+    assert normalize_query("Café-Maps") == "cafe maps"
+    assert normalize_query("إنستقرام") == normalize_query("انستقرام")
+    assert normalize_query("لعبة ٢٠٢٤") == "لعبه 2024"
+
+
+def test_concurrent_identical_queries_share_one_fetch():
+    async def main():
+        cache = SearchCache(fetch_limit=50)
+        upstream = Upstream()
+        answers = await asyncio.gather(*[cache.get_or_fetch(q, 10, upstream)
+                                         for q in ("Spotify", "spotify", " SPOTIFY ")])
+        assert len(upstream.calls) == 1
+        assert [how for _, how in answers] == ["miss", "coalesced", "coalesced"]
+        assert all(len(results) == 10 for results, _ in answers)
+
+        results, how = await cache.get_or_fetch("spotify", 20, upstream)
+        assert how == "hit" and len(results) == 20
+
+    asyncio.run(main())
+
+
+def test_larger_limit_than_fetched_goes_upstream():
+    async def main():
+        cache = SearchCache(fetch_limit=10)
+        upstream = Upstream()
+        await cache.get_or_fetch("maps", 5, upstream)
+        _, how = await cache.get_or_fetch("maps", 30, upstream)
+        assert how == "miss"
+        assert upstream.calls[-1] == ("maps", 30)
+
+        # Upstream had fewer than asked for, so any limit is answered from the cache
+        short = Upstream(count=3)
+        await cache.get_or_fetch("rare", 5, short)
+        _, how = await cache.get_or_fetch("rare", 40, short)
+        assert how == "hit" and len(short.calls) == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_fetch():
+    async def main():
+        cache = SearchCache()
+        upstream = Upstream(delay=0.05)
+        first = asyncio.ensure_future(cache.get_or_fetch("maps", 10, upstream))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_fetch("maps", 10, upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        results, how = await second
+        assert how == "coalesced" and len(results) == 10
+        assert len(upstream.calls) == 1
+
+    asyncio.run(main())
+
+
+def test_failures_reach_every_waiter_and_are_not_cached():
+    async def main():
+        cache = SearchCache()
+        upstream = Upstream(error=RuntimeError("blocked"))
+        answers = await asyncio.gather(cache.get_or_fetch("maps", 10, upstream),
+                                       cache.get_or_fetch("maps", 10, upstream), return_exceptions=True)
+        assert all(isinstance(a, RuntimeError) for a in answers)
+        assert cache.snapshot()["inflight"] == 0
+
+        upstream.error = None
+        _, how = await cache.get_or_fetch("maps", 10, upstream)
+        assert how == "miss"
+
+    asyncio.run(main())
+
+
+def test_lru_bound_and_expiry(monkeypatch):
+    async def main():
+        cache = SearchCache(ttl=100, empty_ttl=1, max_entries=2)
+        upstream = Upstream(delay=0)
+        for query in ("a", "b", "c"):
+            await cache.get_or_fetch(query, 5, upstream)
+        assert cache.snapshot()["entries"] == 2
+        assert cache._lookup("a", 5) is None
+
+        await cache.get_or_fetch("none", 5, Upstream(count=0, delay=0))
+        return cache
+
+    cache = asyncio.run(main())
+    now = search_cache.time.time()
+    monkeypatch.setattr(search_cache.time, "time", lambda: now + 10)
+    # Empty answers expire sooner than real ones
+    assert cache._lookup("none", 5) is None
+    assert cache._lookup("c", 5) == ["c-0", "c-1", "c-2", "c-3", "c-4"]
+
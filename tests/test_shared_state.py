@@ -0,0 +1,88 @@
+import asyncio
+import sqlite3
+import time
+
+from shared_state import SharedState
+
+
+def make_state(tmp_path, **kwargs):
+    return SharedState(str(tmp_path), {"downloads": 0}, **kwargs)
+
+
+def wait_for_writes(state, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while state.db._pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not state.db._pending
+
+
+def test_dict_round_trip_find_and_raise_field(tmp_path):
+    state = make_state(tmp_path)
+    cache = state.dict("file_cache")
+    cache.set_many({"a": {"package_name": "com.a", "expires_at": 10},
+                    "b": {"package_name": "com.b", "expires_at": 10}})
+    assert len(cache) == 2
+    assert cache.find("package_name", "com.b") == [("b", {"package_name": "com.b", "expires_at": 10})]
+
+    assert cache.raise_field("a", "expires_at", 5)
+    assert cache["a"]["expires_at"] == 10
+    assert cache.raise_field("a", "expires_at", 20)
+    assert cache["a"]["expires_at"] == 20
+    assert not cache.raise_field("missing", "expires_at", 20)
+
+    assert cache.set_field("a", "manifest", {"splits": ["base.apk"], "version": None})
+    assert cache["a"] == {"package_name": "com.a", "expires_at": 20,
+                          "manifest": {"splits": ["base.apk"], "version": None}}
+    assert not cache.set_field("missing", "manifest", {})
+
+    del cache["a"]
+    assert "a" not in cache
+    assert cache.pop("a", "gone") == "gone"
+
+
+def test_counters_never_go_negative(tmp_path):
+    state = make_state(tmp_path)
+    state.counters.incr("downloads", 2)
+    state.counters.incr("downloads", -5)
+    assert state.counters["downloads"] == 0
+
+
+def test_locked_database_defers_loop_writes_in_order(tmp_path):
+    state = make_state(tmp_path, loop_timeout=0.05)
+    cache = state.dict("file_cache")
+    other = sqlite3.connect(str(tmp_path / "state.db"), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    started = time.monotonic()
+    cache["k"] = {"n": 1}
+    cache["k"] = {"n": 2}
+    state.counters.incr("downloads")
+    assert time.monotonic() - started < 1
+    assert state.db._pending == 3
+
+    other.execute("COMMIT")
+    wait_for_writes(state)
+    assert cache["k"] == {"n": 2}
+    assert state.counters["downloads"] == 1
+
+    cache["k"] = {"n": 3}
+    assert state.db._pending == 0 and cache["k"] == {"n": 3}
+
+
+def test_package_locks_are_shared_while_used_then_dropped(tmp_path):
+    state = make_state(tmp_path)
+    order = []
+
+    async def hold(name, tag):
+        async with state.package_lock(name):
+            order.append(tag)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        lock = state.package_lock("com.a")
+        await asyncio.gather(hold("com.a", 1), hold("com.a", 2), hold("com.b", 3))
+        assert sorted(order) == [1, 2, 3]
+        assert state.package_locks == {}
+        assert state.package_lock("com.a") is not lock
+
+    asyncio.run(main())
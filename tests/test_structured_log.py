@@ -0,0 +1,81 @@
+import json
+import logging
+import queue
+
+import pytest
+
+import structured_log
+from structured_log import (DeferredQueueHandler, JsonFormatter, LogStats, RateLimitFilter, SampleFilter,
+                            TextFormatter, message_class, parse_samples)
+
+
+def record(msg, level=logging.INFO, args=(), name="appomar.test", **extra):
+    entry = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def test_message_class():
+    assert message_class("[Cache Hit] %s") == "Cache Hit"
+    assert message_class("plain %s") == "plain %s"
+
+
+def test_parse_samples_clamps_and_skips_bad_entries():
+    assert parse_samples("Cache Hit=0.1, Progress=2,Bad=x,,") == {"Cache Hit": 0.1, "Progress": 1.0}
+
+
+def test_sample_filter_keeps_every_nth():
+    stats = LogStats()
+    sampler = SampleFilter({"Cache Hit": 0.25}, stats)
+    kept = [sampler.filter(record("[Cache Hit] %s", args=(i,))) for i in range(8)]
+    assert kept == [True, False, False, False, True, False, False, False]
+    assert stats.sampled_out == 6
+
+    assert sampler.filter(record("[Cache Hit] %s", level=logging.WARNING))
+    assert sampler.filter(record("[Other] %s"))
+    assert not SampleFilter({"Off": 0.0}, stats).filter(record("[Off] x"))
+
+
+def test_rate_limit_filter_reports_suppressed(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(structured_log.time, "monotonic", lambda: now[0])
+    stats = LogStats()
+    limiter = RateLimitFilter(rate=1.0, burst=2.0, stats=stats)
+
+    passed = [limiter.filter(record("[Loop] %s", args=(i,))) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert stats.rate_limited == 3
+    # Errors always get through; other templates have their own bucket
+    assert limiter.filter(record("[Loop] %s", level=logging.ERROR))
+    assert limiter.filter(record("[Other] x"))
+
+    now[0] += 1
+    resumed = record("[Loop] %s", args=(9,))
+    assert limiter.filter(resumed)
+    assert resumed.suppressed == 3
+    assert TextFormatter("%(message)s").format(resumed) == "[Loop] 9 (+3 similar suppressed)"
+
+
+def test_queue_handler_drops_when_full_and_defers_formatting():
+    stats = LogStats()
+    handler = DeferredQueueHandler(queue.Queue(maxsize=1), stats)
+    first = record("[A] %s", args=({"big": "object"},))
+    handler.emit(first)
+    handler.emit(record("[A] again"))
+    assert (stats.queued, stats.dropped) == (1, 1)
+    # Still the template and its arguments, formatted later by the writer thread
+    assert handler.queue.get_nowait().msg == "[A] %s"
+
+
+def test_json_formatter_includes_extra_fields():
+    entry = json.loads(JsonFormatter().format(record("[Download] %s done", args=("app",), package="app")))
+    assert entry["class"] == "Download"
+    assert entry["msg"] == "[Download] app done"
+    assert entry["package"] == "app"
+    assert entry["level"] == "info"
+
+
+@pytest.mark.parametrize("rate", [0, -1])
+def test_rate_limit_disabled(rate):
+    limiter = RateLimitFilter(rate=rate, burst=0, stats=LogStats())
+    assert all(limiter.filter(record("[X] y")) for _ in range(100))
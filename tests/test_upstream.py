@@ -0,0 +1,87 @@
+import asyncio
+import socket
+
+import httpx
+
+import upstream
+from upstream import (CachedDNSBackend, DNSCache, cdn_url_fields, cdn_url_valid, signed_url_expiry,
+                      trace_request)
+
+
+class RecordingBackend:
+    def __init__(self, refuse=()):
+        self.refuse = set(refuse)
+        self.connected = []
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.connected.append(host)
+        if host in self.refuse:
+            raise upstream.httpcore.ConnectError(f"{host} refused")
+        return "stream"
+
+
+def fake_resolver(addresses):
+    calls = []
+
+    def resolve(host, port, family=0, type=0, proto=0, flags=0):
+        calls.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (ip, port)) for ip in addresses]
+    return resolve, calls
+
+
+def test_backend_resolves_once_and_falls_through_addresses():
+    cache = DNSCache(ttl=60)
+    cache._resolve, calls = fake_resolver(["10.0.0.1", "10.0.0.2"])
+    inner = RecordingBackend(refuse={"10.0.0.1"})
+    backend = CachedDNSBackend(inner, cache)
+
+    async def main():
+        for _ in range(3):
+            assert await backend.connect_tcp("apkpure.com", 443) == "stream"
+
+    asyncio.run(main())
+    assert calls == ["apkpure.com"]
+    assert inner.connected[:2] == ["10.0.0.1", "10.0.0.2"]
+    assert cache.snapshot()["hits"] == 2
+    # Nothing outside the client is affected
+    assert socket.getaddrinfo is not cache.getaddrinfo
+
+
+def test_only_apkpure_requests_keep_warm_up_going(monkeypatch):
+    monkeypatch.setattr(upstream, "_last_request", float("-inf"))
+
+    async def send(url, **extensions):
+        await trace_request(httpx.Request("GET", url, extensions=extensions))
+
+    asyncio.run(send("https://image.winudf.com/icon.png"))
+    asyncio.run(send("https://apkpure.com/", warmup=True))
+    assert upstream._last_request == float("-inf")
+
+    asyncio.run(send("https://d.apkpure.com/b/XAPK/com.example"))
+    assert upstream._last_request > 0
+
+
+def test_signed_url_expiry():
+    assert signed_url_expiry("https://cdn.example/a.apk?Expires=1900000000&sig=x") == 1900000000
+    assert signed_url_expiry("https://cdn.example/a.apk?e=1900000000123") == 1900000000
+    assert signed_url_expiry("https://cdn.example/a.apk?X-Amz-Date=20300101T000000Z&X-Amz-Expires=600") \
+        == 1893456000 + 600
+    # A lifetime rather than a timestamp, and unsigned URLs, say nothing
+    assert signed_url_expiry("https://cdn.example/a.apk?expires=3600") is None
+    assert signed_url_expiry("https://cdn.example/a.apk?X-Amz-Date=garbage&X-Amz-Expires=600") is None
+    assert signed_url_expiry("https://cdn.example/a.apk") is None
+
+
+def test_cdn_url_fields_and_validity(monkeypatch):
+    monkeypatch.setattr(upstream.time, "time", lambda: 1900000000.0)
+    url = "https://d.apkpure.com/b/XAPK/com.example?version=latest"
+    assert cdn_url_fields(url, url) == {} and cdn_url_fields(url, None) == {}
+
+    signed = cdn_url_fields(url, "https://cdn.example/a.xapk?expires=1900000600")
+    assert signed == {"cdn_url": "https://cdn.example/a.xapk?expires=1900000600", "cdn_expires_at": 1900000600}
+    unsigned = cdn_url_fields(url, "https://cdn.example/a.xapk")
+    assert unsigned["cdn_expires_at"] == 1900000000 + upstream.CDN_URL_DEFAULT_TTL
+
+    assert cdn_url_valid(signed)
+    assert not cdn_url_valid({"cdn_url": signed["cdn_url"], "cdn_expires_at": 1900000000 + upstream.CDN_URL_MARGIN})
+    assert not cdn_url_valid({})
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Upstream connections - a DNS cache and HTTP/2 (when h2 is installed) for the shared httpx client that
+the httpx download engine and icon fetches use, per-thread curl-cffi sessions that keep their
+connections alive, and keep-alive warm-up of the APKPure hosts while httpx downloads from them, with
+metrics on how often a connection or lookup was reused. Also reads the expiry out of signed CDN URLs,
+so a redirect chain resolved once can be skipped while it is valid.
+"""
+
+import asyncio
+import calendar
+import importlib.util
+import os
+import socket
+import threading
+import time
+from typing import Optional, Dict, Any, Tuple
+from urllib.parse import urlparse, parse_qsl
+
+import anyio
+import httpcore
+import httpx
+
+from lazy_imports import lazy_import
+from rate_limit import upstream_limiter, host_key
+from structured_log import get_logger
+
+logger = get_logger("upstream")
+
+curl_requests = lazy_import("curl_cffi.requests")
+CurlInfo = lazy_import("curl_cffi", "CurlInfo")
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Hosts every download touches; their connections are kept open between requests
+WARM_URLS = ("https://apkpure.com/", "https://d.apkpure.com/")
+_WARM_HOSTS = {host_key(url) for url in WARM_URLS}
+
+# Query parameters signed CDN URLs carry their expiry in, as a Unix time in seconds or milliseconds
+EXPIRY_PARAMS = ("expires", "expire", "exp", "e", "deadline", "validto")
+
+# How long a CDN URL without a readable expiry is trusted, and how much validity a download must start with
+CDN_URL_DEFAULT_TTL = float(os.environ.get("CDN_URL_DEFAULT_TTL", 300))
+CDN_URL_MARGIN = float(os.environ.get("CDN_URL_MARGIN", 120))
+
+
+class DNSCache:
+    """getaddrinfo with a TTL cache in front, for the connections of the clients it is handed to"""
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self._resolve = socket.getaddrinfo
+        self.hits = 0
+        self.misses = 0
+        self.lookup_time = 0.0
+
+    def cached(self, host, port, family=0, type=0, proto=0, flags=0):
+        """The cached answer, or None; never blocks"""
+        entry = self._entries.get((host, port, family, type, proto, flags))
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        return None
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        result = self.cached(host, port, family, type, proto, flags)
+        if result is not None:
+            return result
+        key = (host, port, family, type, proto, flags)
+        started = time.monotonic()
+        result = self._resolve(host, port, family, type, proto, flags)
+        with self._lock:
+            self.misses += 1
+            self.lookup_time += time.monotonic() - started
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        average = self.lookup_time / self.misses if self.misses else 0.0
+        return {
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "avg_lookup_ms": round(average * 1000, 1),
+            "lookup_seconds_saved": round(self.hits * average, 2),
+        }
+
+
+class ConnectionStats:
+    """Requests per client, how many rode an open connection, and what a new one cost to set up"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clients: Dict[str, Dict[str, float]] = {}
+
+    def record(self, client: str, reused: bool, handshake: float = 0.0):
+        with self._lock:
+            entry = self.clients.setdefault(client, {"requests": 0, "reused": 0, "handshake_time": 0.0})
+            entry["requests"] += 1
+            if reused:
+                entry["reused"] += 1
+            else:
+                entry["handshake_time"] += handshake
+
+    def snapshot(self) -> Dict[str, Any]:
+        result = {}
+        for client, entry in list(self.clients.items()):
+            new = entry["requests"] - entry["reused"]
+            average = entry["handshake_time"] / new if new else 0.0
+            result[client] = {
+                "requests": entry["requests"],
+                "reused": entry["reused"],
+                "reuse_rate": round(entry["reused"] / entry["requests"], 3) if entry["requests"] else 0.0,
+                "avg_handshake_ms": round(average * 1000, 1),
+                "handshake_seconds_saved": round(entry["reused"] * average, 2),
+            }
+        return result
+
+
+class HttpxTrace:
+    """httpcore trace callback for one request: a connect event means the request needed a new connection"""
+
+    def __init__(self, stats: ConnectionStats):
+        self.stats = stats
+        self.connect_started: Optional[float] = None
+        self.handshake = 0.0
+
+    async def __call__(self, event: str, info: Dict[str, Any]):
+        if event == "connection.connect_tcp.started":
+            self.connect_started = time.monotonic()
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete") and self.connect_started:
+            self.handshake = time.monotonic() - self.connect_started
+        elif event.endswith(".send_request_headers.started"):
+            self.stats.record("httpx", self.connect_started is None, self.handshake)
+
+
+class CachedDNSBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend that resolves through a DNSCache and connects to the address; TLS still
+    verifies and sends SNI for the host name, which httpcore takes from the request, not from here
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend, cache: DNSCache):
+        self.backend = backend
+        self.cache = cache
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        addresses = self.cache.cached(host, port, 0, socket.SOCK_STREAM)
+        if addresses is None:
+            addresses = await anyio.to_thread.run_sync(self.cache.getaddrinfo, host, port, 0, socket.SOCK_STREAM)
+        error: Optional[Exception] = None
+        for ip in dict.fromkeys(address[4][0] for address in addresses):
+            try:
+                return await self.backend.connect_tcp(ip, port, timeout=timeout, local_address=local_address,
+                                                      socket_options=socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error or httpcore.ConnectError(f"No address for {host}")
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float):
+        await self.backend.sleep(seconds)
+
+
+dns_cache = DNSCache(ttl=float(os.environ.get("DNS_CACHE_TTL", 300)))
+connection_stats = ConnectionStats()
+_curl_local = threading.local()
+# Monotonic time of the shared client's last real (not warm-up) request to a WARM_URLS host
+_last_request = float("-inf")
+
+
+def cached_dns_transport(**kwargs):
+    """An httpx transport whose connections resolve through dns_cache; nothing else in the process is affected"""
+    transport = httpx.AsyncHTTPTransport(**kwargs)
+    pool = getattr(transport, "_pool", None)
+    if hasattr(pool, "_network_backend"):
+        pool._network_backend = CachedDNSBackend(pool._network_backend, dns_cache)
+    else:
+        logger.warning("[Upstream] This httpcore has no pluggable network backend; DNS is not cached")
+    return transport
+
+
+def curl_session():
+    """This thread's curl-cffi session; libcurl keeps its connections and DNS entries between calls"""
+    session = getattr(_curl_local, "session", None)
+    if session is None:
+        try:
+            session = curl_requests.Session(
+                curl_infos=[CurlInfo.NUM_CONNECTS, CurlInfo.CONNECT_TIME, CurlInfo.APPCONNECT_TIME])
+        except TypeError:
+            # curl-cffi before curl_infos: connections are still reused, only not measured
+            session = curl_requests.Session()
+        _curl_local.session = session
+    return session
+
+
+def _record_curl(response):
+    infos = getattr(response, "infos", None) or {}
+    if CurlInfo.NUM_CONNECTS in infos:
+        connects = infos[CurlInfo.NUM_CONNECTS]
+        # APPCONNECT_TIME covers TCP and TLS; it stays 0 for plain HTTP, where CONNECT_TIME is the cost
+        handshake = infos.get(CurlInfo.APPCONNECT_TIME) or infos.get(CurlInfo.CONNECT_TIME) or 0.0
+        connection_stats.record("curl_cffi", connects == 0, handshake)
+
+
+def curl_get(url: str, **kwargs):
+    response = curl_session().get(url, **kwargs)
+    _record_curl(response)
+    return response
+
+
+def curl_head(url: str, **kwargs):
+    response = curl_session().head(url, **kwargs)
+    _record_curl(response)
+    return response
+
+
+async def trace_request(request):
+    """Request hook for the shared httpx client"""
+    global _last_request
+    request.extensions["trace"] = HttpxTrace(connection_stats)
+    # Icon fetches and other hosts say nothing about whether APKPure connections are about to be needed
+    if not request.extensions.get("warmup") and host_key(str(request.url)) in _WARM_HOSTS:
+        _last_request = time.monotonic()
+
+
+async def keep_warm(client, interval: float = 45.0, idle_after: float = 600.0):
+    """
+    Touch the APKPure hosts often enough that the shared client's keep-alive connections never idle
+    out, so the next httpx download does not pay for DNS, TCP and TLS. Connections belong to the worker,
+    so each worker warms its own, and only until idle_after seconds have passed without a request to
+    those hosts; a worker that is not downloading from APKPure sends nothing.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if time.monotonic() - _last_request > idle_after:
+            continue
+        for url in WARM_URLS:
+            if upstream_limiter.is_open(url):
+                continue
+            try:
+                # Flagged so the limiter neither charges nor judges it: a challenge on "/" says nothing
+                await client.head(url, timeout=10.0, extensions={"warmup": True})
+            except Exception as e:
+                logger.warning("[Upstream] Warm-up of %s failed: %s", url, e)
+
+
+def signed_url_expiry(url: str) -> Optional[float]:
+    """Unix time a signed URL stops working, if its query string says"""
+    params = {key.lower(): value for key, value in parse_qsl(urlparse(url).query)}
+    for name in EXPIRY_PARAMS:
+        value = params.get(name, "")
+        if value.isdigit():
+            stamp = int(value)
+            if stamp > 10 ** 12:
+                stamp //= 1000
+            # Small numbers are lifetimes or something else entirely, not timestamps
+            if stamp > 10 ** 9:
+                return float(stamp)
+    if params.get("x-amz-expires", "").isdigit() and "x-amz-date" in params:
+        try:
+            signed_at = calendar.timegm(time.strptime(params["x-amz-date"], "%Y%m%dT%H%M%SZ"))
+            return float(signed_at + int(params["x-amz-expires"]))
+        except ValueError:
+            return None
+    return None
+
+
+def cdn_url_fields(download_url: str, final_url: Optional[str]) -> Dict[str, Any]:
+    """cdn_url and cdn_expires_at for a download URL that redirected to final_url; empty if it did not"""
+    if not final_url or final_url == download_url:
+        return {}
+    expires_at = signed_url_expiry(final_url) or time.time() + CDN_URL_DEFAULT_TTL
+    return {"cdn_url": final_url, "cdn_expires_at": expires_at}
+
+
+def cdn_url_valid(info: Dict[str, Any]) -> bool:
+    return bool(info.get("cdn_url")) and info.get("cdn_expires_at", 0) - time.time() > CDN_URL_MARGIN
+
+
+def snapshot() -> Dict[str, Any]:
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "dns": dns_cache.snapshot(),
+        "connections": connection_stats.snapshot(),
+    }